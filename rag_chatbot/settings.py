@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "ragapp.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -147,3 +148,138 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# RAG pipeline
+
+# Local state (embedding cache etc.) lives under this directory
+RAG_DATA_DIR = Path(os.getenv("RAG_DATA_DIR", BASE_DIR / "data"))
+
+# Embedding requests are sent in multi-text batches (the Gemini batch limit is 100)
+# and a bounded number of batches run concurrently.
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+EMBEDDING_RETRY_BACKOFF = float(os.getenv("EMBEDDING_RETRY_BACKOFF", "1.0"))
+
+# Rows parsed, embedded and upserted per ingestion step
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+# Persistent embedding cache keyed by model + chunk text
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "True") == "True"
+EMBEDDING_CACHE_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", RAG_DATA_DIR / "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+# Previous realestate_v{n} collections kept after an alias swap (for rollback)
+COLLECTION_VERSIONS_TO_KEEP = int(os.getenv("COLLECTION_VERSIONS_TO_KEEP", "1"))
+
+# Uploads are spooled here and ingested by a background worker pool
+INGEST_UPLOAD_DIR = Path(os.getenv("INGEST_UPLOAD_DIR", RAG_DATA_DIR / "uploads"))
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+# A running job with no progress for this many seconds is considered dead (its
+# worker restarted) and marked failed by the next process to start
+INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", "900"))
+# Running jobs refresh their heartbeat this often, even during long phases
+# (encoding detection, .xls parsing, snapshot writes) that report no rows
+INGEST_JOB_HEARTBEAT_SECONDS = float(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "30"))
+# Rows parsed from the spooled file at a time; bounds memory for large uploads
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "5000"))
+
+# In-process LRU cache of query vectors. Set QUERY_EMBEDDING_CACHE_BACKEND to a
+# CACHES alias (e.g. a shared Redis/file cache) to share vectors across workers.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+QUERY_EMBEDDING_CACHE_BACKEND = os.getenv("QUERY_EMBEDDING_CACHE_BACKEND") or None
+
+# Cached llama_answer results, reused for queries whose embeddings have at
+# least ANSWER_CACHE_SIMILARITY cosine similarity and that name the same
+# localities, cities and years; cleared on every new dataset version
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True") == "True"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.97"))
+
+# Identical (normalized) queries that arrive while one is being answered wait
+# for it and share its result instead of calling Gemini and Qdrant again. Set
+# QUERY_COALESCING_BACKEND to a CACHES alias shared by all workers (e.g. Redis)
+# to coalesce across processes as well.
+QUERY_COALESCING_ENABLED = os.getenv("QUERY_COALESCING_ENABLED", "True") == "True"
+QUERY_COALESCING_BACKEND = os.getenv("QUERY_COALESCING_BACKEND") or None
+QUERY_COALESCING_TIMEOUT = float(os.getenv("QUERY_COALESCING_TIMEOUT", "60"))
+
+# Time budget (seconds) for answering a query through retrieval + generation.
+# Query embedding and vector search may each use at most their own timeout;
+# generation gets the rest. If no answer is back when the budget runs out, a
+# degraded answer (retrieved rows plus a computed chart) is returned instead.
+QUERY_DEADLINE = float(os.getenv("QUERY_DEADLINE", "20"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "3"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "3"))
+
+# A duplicate generation request is sent when the first one is slower than
+# the GENERATION_HEDGE_QUANTILE of recent calls (GENERATION_HEDGE_DELAY seconds
+# until 20 calls have been seen); the first response wins. At most
+# GENERATION_MAX_HEDGES duplicates are in flight per process. Transient Gemini
+# errors are retried with jittered exponential backoff while budget remains.
+GENERATION_HEDGING_ENABLED = os.getenv("GENERATION_HEDGING_ENABLED", "True") == "True"
+GENERATION_HEDGE_QUANTILE = float(os.getenv("GENERATION_HEDGE_QUANTILE", "0.95"))
+GENERATION_HEDGE_DELAY = float(os.getenv("GENERATION_HEDGE_DELAY", "5"))
+GENERATION_MAX_HEDGES = int(os.getenv("GENERATION_MAX_HEDGES", "8"))
+GENERATION_MAX_RETRIES = int(os.getenv("GENERATION_MAX_RETRIES", "2"))
+GENERATION_RETRY_BACKOFF = float(os.getenv("GENERATION_RETRY_BACKOFF", "0.5"))
+
+# /api/query/batch accepts up to QUERY_BATCH_MAX_SIZE queries and runs at most
+# QUERY_BATCH_CONCURRENCY of their generations at once; each generation gets
+# its own QUERY_DEADLINE from the moment it starts
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "500"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+
+# Seconds before the cached collection state is refreshed in the background
+COLLECTION_STATE_TTL = float(os.getenv("COLLECTION_STATE_TTL", "10"))
+
+# Trend/comparison/ranking queries are answered with pandas group-bys over the
+# uploaded table; the LLM only writes the prose summary when enabled
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "True") == "True"
+ANALYTICS_LLM_SUMMARY = os.getenv("ANALYTICS_LLM_SUMMARY", "False") == "True"
+ANALYTICS_TOP_N = int(os.getenv("ANALYTICS_TOP_N", "10"))
+ANALYTICS_TABLE_ROWS = int(os.getenv("ANALYTICS_TABLE_ROWS", "20"))
+
+# "hybrid" fuses dense Qdrant results with a local BM25 index over the chunk
+# texts using reciprocal rank fusion; "dense" uses Qdrant only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Vector index backend: "qdrant" (Qdrant Cloud/server via QDRANT_URL) or "local"
+# (memory-mapped NumPy files under LOCAL_VECTOR_STORE_DIR, shared by all workers
+# on the host; good for single-node installs and up to a few hundred thousand rows)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "qdrant")
+LOCAL_VECTOR_STORE_DIR = Path(os.getenv("LOCAL_VECTOR_STORE_DIR", RAG_DATA_DIR / "vectors"))
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+
+# Retrieved rows go into the prompt as a CSV table of the key and queried
+# metric columns, best matches first, cut off at PROMPT_CONTEXT_TOKEN_BUDGET
+# (estimated) tokens. "records" restores the old one-line-per-field format.
+PROMPT_CONTEXT_FORMAT = os.getenv("PROMPT_CONTEXT_FORMAT", "table")
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", "1200"))
+PROMPT_MAX_ROWS = int(os.getenv("PROMPT_MAX_ROWS", "15"))
+
+# HTTP connections the async Qdrant client keeps per process (/api/query/async)
+QDRANT_ASYNC_POOL_SIZE = int(os.getenv("QDRANT_ASYNC_POOL_SIZE", "200"))
+
+# Embedding size requested from text-embedding-004. 768 is the model's native
+# size; smaller values (e.g. 256) return truncated vectors. Changing it requires
+# re-uploading the data, since stored and query vectors must have the same size.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "768"))
+
+# How new Qdrant collections store their vectors (see `benchmark quantization`):
+#   "float32" - full vectors in RAM
+#   "on_disk" - full vectors memory-mapped from disk, only the HNSW graph in RAM
+#   "int8"    - int8 scalar-quantized copy in RAM (4x smaller), originals on disk
+#   "binary"  - 1-bit binary-quantized copy in RAM (32x smaller), originals on disk
+# Quantized profiles fetch QUANTIZATION_OVERSAMPLING x top_k candidates and
+# rescore them with the original vectors. Applies from the next upload on.
+VECTOR_STORAGE_PROFILE = os.getenv("VECTOR_STORAGE_PROFILE", "float32")
+QUANTIZATION_OVERSAMPLING = float(os.getenv("QUANTIZATION_OVERSAMPLING", "2.0"))
+
+# Per-stage timings (embedding, search, generation, ...) are sent back in a
+# Server-Timing header; /api/metrics exposes them as Prometheus histograms
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "True") == "True"
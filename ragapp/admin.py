@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import IngestJob
 
-# Register your models here.
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "file_name", "mode", "status", "rows_upserted", "total_rows", "created_at")
+    list_filter = ("status", "mode")
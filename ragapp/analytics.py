@@ -0,0 +1,323 @@
+import re
+import logging
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# (query phrases, column, chart key, aggregation). Longer phrases are listed
+# first so "office rate" wins over the generic "rate".
+METRICS = [
+    (("office rate", "office rates", "office price", "office prices"), "office - weighted average rate", "office_rate", "mean"),
+    (("shop rate", "shop rates", "shop price", "shop prices"), "shop - weighted average rate", "shop_rate", "mean"),
+    (("others rate", "others rates", "other rate", "other rates"), "others - weighted average rate", "others_rate", "mean"),
+    (("flat rate", "flat rates", "flat price", "flat prices", "price", "prices", "rate", "rates", "cost", "costs"),
+     "flat - weighted average rate", "flat_rate", "mean"),
+    (("flats sold", "flat sold"), "flat_sold - igr", "flats_sold", "sum"),
+    (("offices sold", "office sold"), "office_sold - igr", "offices_sold", "sum"),
+    (("shops sold", "shop sold"), "shop_sold - igr", "shops_sold", "sum"),
+    (("residential",), "residential_sold - igr", "residential_sold", "sum"),
+    (("commercial",), "commercial_sold - igr", "commercial_sold", "sum"),
+    (("sales", "revenue", "turnover"), "total_sales - igr", "total_sales", "sum"),
+    (("sold", "transactions", "demand"), "total sold - igr", "total_sold", "sum"),
+    (("carpet area", "area"), "total carpet area supplied (sqft)", "carpet_area", "sum"),
+    (("supply", "supplied", "units", "inventory"), "total units", "total_units", "sum"),
+]
+
+DEFAULT_METRIC = METRICS[3]
+
+LOCATION_COLUMN = "final location"
+YEAR_COLUMN = "year"
+
+YEAR_PATTERN = re.compile(r"\b(19\d{2}|20\d{2})\b")
+YEAR_RANGE_PATTERN = re.compile(r"\b(19\d{2}|20\d{2})\s*(?:-|–|to|until|through)\s*(19\d{2}|20\d{2})\b")
+LAST_YEARS_PATTERN = re.compile(r"\b(?:last|past|previous)\s+(\d+|two|three|four|five|six|seven|eight|nine|ten)\s+years?\b")
+TOP_N_PATTERN = re.compile(r"\btop\s+(\d+)\b")
+
+# Explicit requests for an aggregate or chart. Metric words alone ("area",
+# "price", "sold") are too common in open questions to route on.
+CHART_INTENT_PATTERN = re.compile(
+    r"\b(compare|comparison|versus|vs|trends?|over time|growth|yearly|year on year|top|rank|ranking|"
+    r"highest|lowest|most|least|chart|plot|graph)\b"
+)
+
+NUMBER_WORDS = {"two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+
+def detect_intent(query: str):
+    """Classify a query as comparison / trend / total by keyword"""
+    query_lower = query.lower()
+    return {
+        "is_comparison": any(word in query_lower for word in ['compare', 'vs', 'versus', 'between', 'difference', 'across']),
+        "is_trend": any(word in query_lower for word in ['trend', 'over time', 'yearly', 'year', 'growth', 'change', 'last', 'years', 'over']),
+        "has_total": any(word in query_lower for word in ['total', 'sum', 'aggregate', 'highest', 'top', 'which', 'best', 'worst']),
+    }
+
+def _normalize(text: str):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", str(text).lower()).split())
+
+class TermMatcher:
+    """Whole-word lookup of vocabulary entries in a query
+
+    Entries are indexed by their normalized words once, so a lookup costs
+    a few dict probes per query word instead of a scan of the vocabulary.
+    Build one per dataset version and reuse it.
+    """
+
+    def __init__(self, vocabulary):
+        self.terms = {}
+        for term in sorted({str(t) for t in vocabulary if pd.notna(t)}):
+            words = tuple(_normalize(term).split())
+            if words:
+                self.terms.setdefault(words, term)
+        self.max_words = max(map(len, self.terms), default=0)
+
+    def find(self, query: str):
+        """Longer names are matched first and consume their words, so
+        "Hinjewadi Phase 2" is not also reported as "Hinjewadi"
+        """
+        words = _normalize(query).split()
+        used = [False] * len(words)
+        found = []
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                if any(used[start:start + size]):
+                    continue
+                term = self.terms.get(tuple(words[start:start + size]))
+                if term is not None:
+                    used[start:start + size] = [True] * size
+                    if term not in found:
+                        found.append(term)
+        return found
+
+def extract_terms(query: str, vocabulary):
+    """Return vocabulary entries (a TermMatcher or any iterable) mentioned in the query as whole words"""
+    matcher = vocabulary if isinstance(vocabulary, TermMatcher) else TermMatcher(vocabulary)
+    return matcher.find(query)
+
+def extract_locations(query: str, locations):
+    return extract_terms(query, locations)
+
+def extract_metrics(query: str):
+    """Return the METRICS entries mentioned in the query"""
+    text = f" {_normalize(query)} "
+    found = []
+    for phrases, column, key, agg in METRICS:
+        for phrase in phrases:
+            needle = f" {phrase} "
+            if needle in text:
+                found.append((phrases, column, key, agg))
+                text = text.replace(needle, " | ")
+                break
+    return found
+
+def extract_years(query: str, available_years):
+    """Return an inclusive (start, end) year range from the query, or None"""
+    query_lower = query.lower()
+    available = sorted(int(y) for y in available_years if pd.notna(y))
+
+    match = YEAR_RANGE_PATTERN.search(query_lower)
+    if match:
+        start, end = sorted((int(match.group(1)), int(match.group(2))))
+        return start, end
+
+    match = LAST_YEARS_PATTERN.search(query_lower)
+    if match and available:
+        count = match.group(1)
+        count = int(count) if count.isdigit() else NUMBER_WORDS[count]
+        return available[-1] - count + 1, available[-1]
+
+    years = [int(y) for y in YEAR_PATTERN.findall(query_lower)]
+    if years:
+        return min(years), max(years)
+    return None
+
+def _number(value):
+    """Convert a NumPy scalar to a rounded JSON-friendly number"""
+    if value is None or pd.isna(value):
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 2)
+
+def _records(frame: pd.DataFrame):
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+def analyze(query: str, df: pd.DataFrame, vocabulary: dict = None):
+    """Answer chart queries with exact group-bys over the full table
+
+    Only queries that name a known locality or year and ask for a metric,
+    or that explicitly ask for a comparison, trend, ranking or chart, are
+    answered here; "Is Baner a good place to invest?" is not. Returns a
+    {summary, chart, table} dict, or None when the query should go through
+    the LLM. vocabulary is the dataset version's filters.get_vocabulary();
+    without it the localities and years are collected from df.
+    """
+    if df is None or df.empty or LOCATION_COLUMN not in df.columns or YEAR_COLUMN not in df.columns:
+        return None
+
+    intent = detect_intent(query)
+    if vocabulary:
+        locations = extract_locations(query, vocabulary["locations"])
+        year_range = extract_years(query, vocabulary["years"])
+    else:
+        locations = extract_locations(query, df[LOCATION_COLUMN].dropna().unique())
+        year_range = extract_years(query, pd.to_numeric(df[YEAR_COLUMN], errors="coerce").dropna().unique())
+    metrics = extract_metrics(query)
+    charted = CHART_INTENT_PATTERN.search(_normalize(query))
+    if not (locations or year_range or charted) or not (metrics or charted):
+        return None
+
+    if any(column not in df.columns for _, column, _, _ in metrics):
+        return None
+    if not metrics:
+        if not locations:
+            return None
+        metrics = [DEFAULT_METRIC] if DEFAULT_METRIC[1] in df.columns else []
+        if not metrics:
+            return None
+
+    columns = [LOCATION_COLUMN, YEAR_COLUMN] + [column for _, column, _, _ in metrics]
+    frame = df[columns].copy()
+    frame[LOCATION_COLUMN] = frame[LOCATION_COLUMN].astype(str).str.strip()
+    for column in columns[1:]:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+
+    if locations:
+        frame = frame[frame[LOCATION_COLUMN].isin([str(loc).strip() for loc in locations])]
+    if year_range:
+        frame = frame[frame[YEAR_COLUMN].between(*year_range)]
+    if frame.empty:
+        return None
+
+    if intent["is_trend"] or (locations and not intent["is_comparison"] and not intent["has_total"]):
+        chart = _trend_chart(frame, locations, metrics)
+    elif (intent["has_total"] and not intent["is_comparison"]) or not locations:
+        match = TOP_N_PATTERN.search(query.lower())
+        chart = _ranking_chart(frame, metrics, top_n=int(match.group(1)) if match else settings.ANALYTICS_TOP_N)
+    else:
+        chart = _comparison_chart(frame, metrics)
+    if not chart["data"]:
+        return None
+
+    table_rows = df.loc[frame.index].sort_values([LOCATION_COLUMN, YEAR_COLUMN])
+    result = {
+        "summary": summarize(chart, metrics, year_range),
+        "chart": chart,
+        "table": _records(table_rows.head(settings.ANALYTICS_TABLE_ROWS)),
+    }
+    logger.info(f"Analytics answered '{query}' with a {chart['type']} chart of {len(chart['data'])} points")
+    return result
+
+# Locations (in retrieval order) plotted by chart_from_rows
+ROW_CHART_LOCATIONS = 5
+
+def chart_from_rows(query: str, rows: list):
+    """Chart and template summary computed from already-retrieved rows
+
+    Used for degraded answers when generation did not finish in time.
+    Returns (chart, summary); summary is None when no chart could be built.
+    """
+    empty = {"type": "bar", "data": []}
+    frame = pd.DataFrame(rows)
+    if frame.empty or LOCATION_COLUMN not in frame.columns or YEAR_COLUMN not in frame.columns:
+        return empty, None
+    metrics = [metric for metric in extract_metrics(query) or [DEFAULT_METRIC] if metric[1] in frame.columns]
+    if not metrics:
+        return empty, None
+
+    columns = [LOCATION_COLUMN, YEAR_COLUMN] + [column for _, column, _, _ in metrics]
+    frame = frame[columns].copy()
+    frame[LOCATION_COLUMN] = frame[LOCATION_COLUMN].astype(str).str.strip()
+    for column in columns[1:]:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    locations = list(frame[LOCATION_COLUMN].unique()[:ROW_CHART_LOCATIONS])
+    frame = frame[frame[LOCATION_COLUMN].isin(locations)]
+
+    if detect_intent(query)["is_trend"] and frame[YEAR_COLUMN].nunique() > 1:
+        chart = _trend_chart(frame, locations, metrics)
+    else:
+        chart = _comparison_chart(frame, metrics)
+    if not chart["data"]:
+        return empty, None
+    return chart, _template_summary(chart, metrics, None)
+
+def _trend_chart(frame: pd.DataFrame, locations: list, metrics: list):
+    """Line chart with one row per year"""
+    if len(locations) > 1:
+        # One series per location for the first metric
+        _, column, _, agg = metrics[0]
+        pivot = frame.pivot_table(index=YEAR_COLUMN, columns=LOCATION_COLUMN, values=column, aggfunc=agg)
+    else:
+        # One series per metric, for a single location or the whole table
+        pivot = frame.groupby(YEAR_COLUMN).agg({column: agg for _, column, _, agg in metrics})
+        pivot.columns = [key for _, _, key, _ in metrics]
+
+    pivot = pivot.sort_index().dropna(how="all")
+    data = []
+    for year, values in zip(pivot.index, pivot.to_numpy()):
+        row = {"year": int(year)}
+        row.update({str(name): _number(value) for name, value in zip(pivot.columns, values)})
+        data.append(row)
+    return {"type": "line", "data": data}
+
+def _comparison_chart(frame: pd.DataFrame, metrics: list):
+    """Bar chart with one row per location"""
+    grouped = frame.groupby(LOCATION_COLUMN).agg({column: agg for _, column, _, agg in metrics})
+    grouped.columns = [key for _, _, key, _ in metrics]
+    return {"type": "bar", "data": _bar_rows(grouped)}
+
+def _ranking_chart(frame: pd.DataFrame, metrics: list, top_n: int):
+    """Bar chart of the top locations by the first metric"""
+    grouped = frame.groupby(LOCATION_COLUMN).agg({column: agg for _, column, _, agg in metrics})
+    grouped.columns = [key for _, _, key, _ in metrics]
+    grouped = grouped.sort_values(grouped.columns[0], ascending=False).head(top_n)
+    return {"type": "bar", "data": _bar_rows(grouped)}
+
+def _bar_rows(grouped: pd.DataFrame):
+    grouped = grouped.dropna(how="all")
+    values = grouped.to_numpy()
+    return [
+        {"location": location, **{key: _number(value) for key, value in zip(grouped.columns, row)}}
+        for location, row in zip(grouped.index, values)
+    ]
+
+def summarize(chart: dict, metrics: list, year_range):
+    """Prose summary of the computed chart, optionally rewritten by the LLM"""
+    summary = _template_summary(chart, metrics, year_range)
+    if settings.ANALYTICS_LLM_SUMMARY:
+        from .llm import summarize_chart
+        summary = summarize_chart(chart, fallback=summary)
+    return summary
+
+def _template_summary(chart: dict, metrics: list, year_range):
+    data = chart["data"]
+    key = metrics[0][2].replace("_", " ")
+    if not year_range:
+        period = ""
+    elif year_range[0] == year_range[1]:
+        period = f" in {year_range[0]}"
+    else:
+        period = f" ({year_range[0]}–{year_range[1]})"
+
+    if chart["type"] == "line":
+        first, last = data[0], data[-1]
+        parts = []
+        for series in [k for k in first if k != "year"][:4]:
+            start, end = first.get(series), last.get(series)
+            if start is None or end is None:
+                continue
+            change = f" ({(end - start) / start * 100:+.1f}%)" if start else ""
+            parts.append(f"{series} went from {start:,} in {first['year']} to {end:,} in {last['year']}{change}")
+        if not parts:
+            return f"Yearly {key}{period} computed from {len(data)} years of data."
+        return "; ".join(parts) + "."
+
+    series = [k for k in data[0] if k != "location"][0]
+    ranked = sorted((row for row in data if row.get(series) is not None), key=lambda row: -row[series])
+    if not ranked:
+        return f"{key.capitalize()} by location{period}."
+    top = ranked[0]
+    text = f"{top['location']} has the highest {series.replace('_', ' ')}{period} at {top[series]:,}"
+    if len(ranked) > 1:
+        bottom = ranked[-1]
+        text += f", and {bottom['location']} the lowest at {bottom[series]:,}"
+    return text + f" across {len(ranked)} locations."
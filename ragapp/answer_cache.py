@@ -0,0 +1,107 @@
+import numpy as np
+import threading
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from .embeddings import normalize_query
+from .filters import extract_filter, get_vocabulary
+from .vector_store import collection_state
+
+logger = logging.getLogger(__name__)
+
+class AnswerCache:
+    """Cache of llama_answer results for exact and near-duplicate queries
+
+    Entries are keyed by normalized query text and also matched by cosine
+    similarity of query embeddings against `threshold`. Near-duplicates
+    must also name the same localities, cities and years: "Wakad 2020" and
+    "Wakad 2021" embed almost identically but need different answers.
+    Every entry belongs to one dataset version; seeing a different version
+    empties the cache.
+    """
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.version = None
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (unit vector, filter spec, result)
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                logger.info(f"Dataset version changed ({self.version} -> {version}), dropping cached answers")
+            self._entries.clear()
+            self.version = version
+
+    def lookup(self, query: str, query_vector: list, version):
+        """Return a cached result for the query, or None"""
+        key = normalize_query(query)
+        spec = query_spec(query) if self.threshold < 1 else None
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+            keys = [k for k, entry in self._entries.items() if entry[1] == spec] if self.threshold < 1 else []
+            if keys:
+                matrix = np.stack([self._entries[k][0] for k in keys])
+                scores = matrix @ _unit(query_vector)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.near_hits += 1
+                    logger.info(f"Answer cache near-hit: '{key}' ~ '{keys[best]}' ({scores[best]:.3f})")
+                    return self._entries[keys[best]][2]
+
+            self.misses += 1
+            return None
+
+    def store(self, query: str, query_vector: list, result: dict, version):
+        key = normalize_query(query)
+        spec = query_spec(query)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (_unit(query_vector), spec, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else None,
+        }
+
+def query_spec(query: str):
+    """Localities, cities and years the query names, in a comparable form"""
+    state = collection_state.get()
+    spec = extract_filter(query, get_vocabulary(state["collection"])) if state["exists"] else None
+    return tuple(sorted((field, tuple(sorted(values))) for field, values in (spec or {}).items()))
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_SIZE,
+    threshold=settings.ANSWER_CACHE_SIMILARITY,
+)
@@ -1,6 +1,24 @@
+import logging
 from django.apps import AppConfig
+from django.core.signals import request_started
+
+logger = logging.getLogger(__name__)
 
 
 class RagappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ragapp"
+
+    def ready(self):
+        # Recover interrupted ingest jobs when the first request arrives, once
+        # the database is migrated and reachable (not during manage.py commands)
+        request_started.connect(_recover_jobs, dispatch_uid="ragapp-recover-jobs")
+
+
+def _recover_jobs(sender, **kwargs):
+    from .jobs import recover_jobs
+    request_started.disconnect(dispatch_uid="ragapp-recover-jobs")
+    try:
+        recover_jobs()
+    except Exception as e:
+        logger.warning(f"Ingest job recovery failed: {e}")
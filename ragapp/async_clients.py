@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import weakref
+from google.generativeai import client as genai_client
+
+logger = logging.getLogger(__name__)
+
+# Async gRPC/HTTP clients are bound to the event loop that created them.
+# Under ASGI there is one loop per process, so each client (and its
+# connection pool) is shared by every request; async views served under
+# WSGI run on a fresh loop per request and get their own.
+_clients = weakref.WeakKeyDictionary()
+
+def loop_local(name: str, factory):
+    """Return the client called `name` for the running event loop, creating it once"""
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = factory()
+    return clients[name]
+
+# google-generativeai has no public way to build an async client per event
+# loop or to hand one to a GenerativeModel. The two private hooks used below
+# are only touched here and were checked against the version pinned in
+# requirements.txt; if a release drops them, calls fall back to genai's
+# process-wide default client.
+def _make_gemini_async_client():
+    manager = getattr(genai_client, "_client_manager", None)
+    if manager is None or not hasattr(manager, "make_client"):
+        logger.warning("google-generativeai has no _client_manager.make_client; using its default async client")
+        return None
+    return manager.make_client("generative_async")
+
+def gemini_async_client():
+    """Async Gemini client built from the genai.configure() settings, or None for genai's default"""
+    return loop_local("gemini", _make_gemini_async_client)
+
+def bind_gemini_async_client(model):
+    """Make model.generate_content_async use the event loop's client when the SDK allows it"""
+    client = gemini_async_client()
+    if client is not None and hasattr(model, "_async_client"):
+        model._async_client = client
+    return model
@@ -0,0 +1 @@
+"""Offline benchmarks, run with `python manage.py benchmark <suite>`"""
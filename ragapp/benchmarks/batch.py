@@ -0,0 +1,85 @@
+"""A nightly report run as sequential /api/query calls vs. one /api/query/batch request"""
+import time
+import tempfile
+from collections import Counter
+from django.test import Client, override_settings
+from .harness import benchmark_environment, StageTimes
+from .ingest import write_csv, ingest_file
+from .query import make_queries
+
+def _calls(embeddings, model_class):
+    return embeddings.calls, model_class.calls
+
+def run(dataset_rows: int = 20000, requests: int = 200, concurrency: int = 8, backend: str = "qdrant",
+        qdrant_path: str = None, embed_latency: float = 0.05, llm_latency: float = 1.0, **options):
+    from ..vector_store import get_store
+    from ..embeddings import query_cache
+    queries = make_queries(requests)
+    with tempfile.TemporaryDirectory(prefix="rag-bench-csv-") as directory, \
+            benchmark_environment(backend=backend, qdrant_path=qdrant_path,
+                                  embed_latency=embed_latency, llm_latency=llm_latency) as (embeddings, model_class), \
+            override_settings(ANSWER_CACHE_ENABLED=False, QUERY_BATCH_CONCURRENCY=concurrency):
+        ingest_file(write_csv(dataset_rows, directory))
+        client = Client()
+        # One untimed request maps the snapshot and loads the indexes
+        client.post("/api/query", {"query": "Show price trends for Wakad"}, content_type="application/json")
+
+        store = get_store()
+        stages = StageTimes()
+        targets = {"search": (store, "search"), "search_batch": (store, "search_batch")}
+        modes = {}
+        with stages.patch(targets):
+            query_cache.clear()
+            before = _calls(embeddings, model_class)
+            start = time.perf_counter()
+            statuses = [
+                client.post("/api/query", {"query": query}, content_type="application/json").status_code
+                for query in queries
+            ]
+            modes["sequential"] = (time.perf_counter() - start, statuses, before)
+
+            query_cache.clear()
+            before = _calls(embeddings, model_class)
+            start = time.perf_counter()
+            response = client.post("/api/query/batch", {"queries": queries}, content_type="application/json")
+            statuses = [result["status"] for result in response.json()["results"]]
+            modes["batch"] = (time.perf_counter() - start, statuses, before)
+            batch_timings = response.json()["timings"]
+
+    results = {}
+    after = {"sequential": modes["batch"][2], "batch": _calls(embeddings, model_class)}
+    for mode, (seconds, statuses, (embed_calls, llm_calls)) in modes.items():
+        results[mode] = {
+            "seconds": round(seconds, 3),
+            "status_codes": dict(Counter(statuses)),
+            "embed_calls": after[mode][0] - embed_calls,
+            "llm_calls": after[mode][1] - llm_calls,
+        }
+    results["sequential"]["search_calls"] = len(stages.samples.get("search", []))
+    results["batch"]["search_calls"] = len(stages.samples.get("search_batch", []))
+    results["batch"]["timings_ms"] = batch_timings
+    return {
+        "suite": "batch",
+        "backend": backend,
+        "dataset_rows": dataset_rows,
+        "queries": requests,
+        "concurrency": concurrency,
+        "embed_latency_s": embed_latency,
+        "llm_latency_s": llm_latency,
+        **results,
+    }
+
+def report(results: dict):
+    lines = [
+        f"{results['queries']} queries, {results['backend']}, batch concurrency {results['concurrency']}, "
+        f"LLM latency {results['llm_latency_s']}s"
+    ]
+    for mode in ("sequential", "batch"):
+        entry = results[mode]
+        lines.append(
+            f"  {mode:<10} {entry['seconds']:>9.2f} s   embed calls {entry['embed_calls']:>4}"
+            f"   searches {entry['search_calls']:>4}   LLM calls {entry['llm_calls']:>4}   status {entry['status_codes']}"
+        )
+    stages = ", ".join(f"{name} {ms} ms" for name, ms in results["batch"]["timings_ms"].items())
+    lines.append(f"  batch stages: {stages}")
+    return "\n".join(lines)
@@ -0,0 +1,64 @@
+"""Chunk text and payload construction: per-row iterrows path vs. the vectorized one"""
+import time
+from collections import Counter
+import pandas as pd
+from .datasets import make_dataset
+from ..embeddings import create_chunk
+from ..ingestion import prepare_batch, point_id, content_hash, NATURAL_KEY
+from ..readers import normalize_chunk
+
+def prepare_batch_rowwise(batch: pd.DataFrame, key_counts: Counter):
+    """The pre-vectorization prepare_batch, kept as the reference"""
+    ids = []
+    texts = []
+    payloads = []
+    for _, row in batch.iterrows():
+        texts.append(create_chunk(row))
+        payload = {k: (None if pd.isna(v) else v) for k, v in row.to_dict().items()}
+        if isinstance(payload.get("year"), float) and payload["year"].is_integer():
+            payload["year"] = int(payload["year"])
+        natural_key = tuple(payload.get(col) for col in NATURAL_KEY)
+        ids.append(point_id(payload, key_counts[natural_key]))
+        key_counts[natural_key] += 1
+        payload["_content_hash"] = content_hash(payload)
+        payloads.append(payload)
+    return ids, texts, payloads
+
+def _time(function, df: pd.DataFrame, batch_size: int, repeat: int):
+    best = None
+    for _ in range(repeat):
+        key_counts = Counter()
+        start = time.perf_counter()
+        output = [function(df.iloc[i:i + batch_size], key_counts) for i in range(0, len(df), batch_size)]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+def run(dataset_rows: int = 20000, repeat: int = 3, **options):
+    from django.conf import settings
+    results = {"suite": "chunks", "rows": dataset_rows, "cases": []}
+    raw = make_dataset(dataset_rows)
+    for name, df in (("raw", raw), ("normalized", normalize_chunk(raw.copy()))):
+        rowwise_seconds, rowwise = _time(prepare_batch_rowwise, df, settings.INGEST_BATCH_SIZE, repeat)
+        vectorized_seconds, vectorized = _time(prepare_batch, df, settings.INGEST_BATCH_SIZE, repeat)
+        results["cases"].append({
+            "frame": name,
+            "rowwise_seconds": round(rowwise_seconds, 4),
+            "vectorized_seconds": round(vectorized_seconds, 4),
+            "rowwise_rows_per_sec": round(dataset_rows / rowwise_seconds),
+            "vectorized_rows_per_sec": round(dataset_rows / vectorized_seconds),
+            "speedup": round(rowwise_seconds / vectorized_seconds, 1),
+            # Same IDs, texts, payloads and content hashes
+            "identical": rowwise == vectorized,
+        })
+    return results
+
+def report(results: dict):
+    lines = [f"{results['rows']} rows"]
+    for case in results["cases"]:
+        lines.append(
+            f"{case['frame']:<11} row-wise {case['rowwise_rows_per_sec']:>9,} rows/s   "
+            f"vectorized {case['vectorized_rows_per_sec']:>9,} rows/s   "
+            f"x{case['speedup']}   identical={case['identical']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+LOCATIONS = [
+    "Wakad", "Aundh", "Baner", "Hinjewadi", "Kharadi", "Viman Nagar", "Hadapsar",
+    "Kothrud", "Balewadi", "Pimple Saudagar", "Ravet", "Tathawade", "Wagholi", "Undri",
+]
+
+CITIES = ["Pune", "Pimpri Chinchwad"]
+
+def make_dataset(n_rows: int = 1000, seed: int = 0, first_year: int = 2015, years: int = 10):
+    """Synthetic table with the same columns as the real IGR uploads
+
+    Localities cycle through LOCATIONS (suffixed with a sector number once
+    they run out) with one row per locality and year.
+    """
+    rng = np.random.default_rng(seed)
+    index = np.arange(n_rows)
+    locality = index // years
+    base = np.array(LOCATIONS)[locality % len(LOCATIONS)]
+    sector = locality // len(LOCATIONS)
+    names = np.where(sector == 0, base, np.char.add(np.char.add(base, " Sector "), sector.astype(str)))
+
+    def counts(low, high):
+        return rng.integers(low, high, n_rows)
+
+    def rates(low, high, missing=0.0):
+        values = rng.integers(low, high, n_rows).astype(float)
+        values[rng.random(n_rows) < missing] = np.nan
+        return values
+
+    flats, offices, shops, others = counts(10, 400), counts(0, 40), counts(0, 60), counts(0, 20)
+    flat_rate = rates(4000, 14000)
+    df = pd.DataFrame({
+        "final location": names,
+        "year": first_year + index % years,
+        "city": np.array(CITIES)[locality % len(CITIES)],
+        "loc_lat": np.round(18.4 + rng.random(n_rows) * 0.3, 6),
+        "loc_lng": np.round(73.7 + rng.random(n_rows) * 0.3, 6),
+        "total_sales - igr": (flats * flat_rate * 900).round(),
+        "total sold - igr": flats + offices + shops + others,
+        "flat_sold - igr": flats,
+        "office_sold - igr": offices,
+        "shop_sold - igr": shops,
+        "others_sold - igr": others,
+        "commercial_sold - igr": offices + shops,
+        "other_sold - igr": others,
+        "residential_sold - igr": flats,
+        "flat - weighted average rate": flat_rate,
+        "office - weighted average rate": rates(6000, 18000, missing=0.3),
+        "others - weighted average rate": rates(3000, 12000, missing=0.5),
+        "shop - weighted average rate": rates(8000, 25000, missing=0.2),
+        "flat - most prevailing rate - range": [f"{int(r) - 500}-{int(r) + 500}" for r in flat_rate],
+        "office - most prevailing rate - range": None,
+        "others - most prevailing rate - range": None,
+        "shop - most prevailing rate - range": None,
+        "total units": counts(100, 2000),
+        "total carpet area supplied (sqft)": counts(50000, 900000),
+        "flat total": counts(80, 1500),
+        "shop total": counts(0, 200),
+        "office total": counts(0, 150),
+        "others total": counts(0, 50),
+    })
+    return df
+
+def payload_rows(df: pd.DataFrame):
+    """Rows as the vector store returns them (NaN as None)"""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
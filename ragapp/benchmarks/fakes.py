@@ -0,0 +1,129 @@
+"""Deterministic stand-ins for the Gemini API with configurable latency"""
+import json
+import random
+import time
+import asyncio
+import hashlib
+import threading
+import numpy as np
+
+def fake_vector(text: str, dim: int = 768):
+    """Unit vector seeded by the text, so equal texts always embed equally"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class FakeEmbeddings:
+    """Replacement for genai.embed_content / embed_content_async
+
+    Every call sleeps `latency` seconds plus `per_text` seconds per text,
+    like one round-trip to the embedding endpoint.
+    """
+
+    def __init__(self, latency: float = 0.0, per_text: float = 0.0, dim: int = 768):
+        self.latency = latency
+        self.per_text = per_text
+        self.dim = dim
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, content, kwargs):
+        dim = kwargs.get("output_dimensionality") or self.dim
+        texts = content if isinstance(content, list) else [content]
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        vectors = [fake_vector(text, dim) for text in texts]
+        return {"embedding": vectors if isinstance(content, list) else vectors[0]}
+
+    def _delay(self, content):
+        return self.latency + self.per_text * (len(content) if isinstance(content, list) else 1)
+
+    def __call__(self, model, content, **kwargs):
+        time.sleep(self._delay(content))
+        return self._embed(content, kwargs)
+
+    async def embed_async(self, model, content, **kwargs):
+        await asyncio.sleep(self._delay(content))
+        return self._embed(content, kwargs)
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeTokenCount:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+def fake_answer(prompt: str):
+    """A valid chart answer for the prompt, stable for the same prompt"""
+    seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    rng = np.random.default_rng(seed)
+    data = [{"year": year, "value": int(rng.integers(4000, 12000))} for year in range(2019, 2024)]
+    return json.dumps({
+        "summary": "Rates rose steadily across the period, with the strongest growth in the last two years.",
+        "chart": {"type": "line", "data": data},
+        "table": [],
+    })
+
+class FakeGenerativeModel:
+    """Replacement for genai.GenerativeModel
+
+    generate_content sleeps `latency` seconds (time to first token) plus
+    `per_token` seconds per output token, approximating tokens as 4 chars.
+    Streaming yields the answer in 16-character pieces over the same time.
+    Use fake_model_class() to get a subclass with its own latency and
+    call counter.
+    """
+
+    latency = 0.0
+    per_token = 0.0
+    # Share of calls that take tail_factor times as long, like a slow upstream replica
+    tail = 0.0
+    tail_factor = 10.0
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str = "", **kwargs):
+        self.model_name = model_name
+        self._async_client = None
+
+    def _count(self):
+        with self._lock:
+            type(self).calls += 1
+
+    def _duration(self, text: str):
+        duration = self.latency + self.per_token * len(text) / 4
+        if self.tail and random.random() < self.tail:
+            duration *= self.tail_factor
+        return duration
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        self._count()
+        text = fake_answer(str(prompt))
+        if not stream:
+            time.sleep(self._duration(text))
+            return FakeResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        time.sleep(self.latency)
+        pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+        for piece in pieces:
+            time.sleep(self.per_token * len(piece) / 4)
+            yield FakeResponse(piece)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self._count()
+        text = fake_answer(str(prompt))
+        await asyncio.sleep(self._duration(text))
+        return FakeResponse(text)
+
+    def count_tokens(self, prompt):
+        return FakeTokenCount(len(str(prompt)) // 4)
+
+def fake_model_class(latency: float = 0.0, per_token: float = 0.0, tail: float = 0.0):
+    return type("FakeGenerativeModel", (FakeGenerativeModel,), {
+        "latency": latency, "per_token": per_token, "tail": tail, "calls": 0, "_lock": threading.Lock(),
+    })
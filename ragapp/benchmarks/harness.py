@@ -0,0 +1,191 @@
+"""Environment for offline benchmarks: fake providers, local Qdrant, scratch data dir"""
+import os
+import time
+import asyncio
+import shutil
+import tempfile
+import threading
+import subprocess
+import resource
+from contextlib import contextmanager, ExitStack
+from unittest import mock
+import numpy as np
+from django.test import override_settings
+from .fakes import FakeEmbeddings, fake_model_class
+
+@contextmanager
+def fake_providers(embed_latency: float = 0.0, llm_latency: float = 0.0, llm_per_token: float = 0.0, llm_tail: float = 0.0):
+    """Patch the Gemini SDK entry points the app uses with deterministic fakes"""
+    import google.generativeai as genai
+    embeddings = FakeEmbeddings(latency=embed_latency)
+    model_class = fake_model_class(latency=llm_latency, per_token=llm_per_token, tail=llm_tail)
+    with mock.patch.object(genai, "embed_content", embeddings), \
+            mock.patch.object(genai, "embed_content_async", embeddings.embed_async), \
+            mock.patch.object(genai, "GenerativeModel", model_class), \
+            mock.patch("ragapp.embeddings.gemini_async_client", lambda: None), \
+            mock.patch("ragapp.async_clients.gemini_async_client", lambda: None):
+        yield embeddings, model_class
+
+class AsyncClientAdapter:
+    """Awaitable facade over a sync QdrantClient, standing in for AsyncQdrantClient
+
+    An in-process instance cannot be shared with a second (async) client, so
+    async calls run the sync client's methods in a worker thread.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+@contextmanager
+def local_qdrant(path: str = None):
+    """Point the app's Qdrant clients, sync and async, at an in-process instance (":memory:" or on-disk)"""
+    from qdrant_client import QdrantClient
+    import ragapp.qdrant_client as qdrant
+    client = QdrantClient(path=path) if path else QdrantClient(":memory:")
+    adapter = AsyncClientAdapter(client)
+    with mock.patch.object(qdrant, "client", client), \
+            mock.patch.object(qdrant, "get_async_client", lambda: adapter):
+        try:
+            yield client
+        finally:
+            client.close()
+
+@contextmanager
+def benchmark_environment(backend: str = "qdrant", qdrant_path: str = None, **latencies):
+    """Fresh data directory, selected vector backend and fake Gemini, all undone on exit"""
+    import ragapp.vector_store as vector_store
+    import ragapp.embeddings as embeddings
+    import ragapp.filters as filters
+    import ragapp.lexical as lexical
+    import ragapp.snapshots as snapshots
+    from ragapp.answer_cache import answer_cache
+    data_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(
+                RAG_DATA_DIR=data_dir,
+                LOCAL_VECTOR_STORE_DIR=os.path.join(data_dir, "vectors"),
+                EMBEDDING_CACHE_PATH=os.path.join(data_dir, "embedding_cache.sqlite3"),
+                VECTOR_STORE_BACKEND=backend,
+            ))
+            # Process-wide singletons are rebuilt against the scratch directory
+            stack.enter_context(mock.patch.object(vector_store, "_store", None))
+            stack.enter_context(mock.patch.object(embeddings, "_cache", None))
+            stack.enter_context(mock.patch.object(vector_store.collection_state, "_state", None))
+            # Per-collection caches would otherwise serve realestate_v1 from an earlier run
+            for module, name in ((filters, "_vocabularies"), (lexical, "_indexes"), (snapshots, "_snapshots")):
+                stack.enter_context(mock.patch.object(module, name, {}))
+            answer_cache.invalidate()
+            fakes = stack.enter_context(fake_providers(**latencies))
+            if backend == "qdrant":
+                stack.enter_context(local_qdrant(qdrant_path))
+            embeddings.query_cache.clear()
+            yield fakes
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux), else the peak so far"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakRSS:
+    """Samples RSS in a background thread and records the peak above the starting level"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def result(self):
+        return {"start_mb": round(self.start / 2**20, 1), "peak_mb": round(self.peak / 2**20, 1),
+                "growth_mb": round((self.peak - self.start) / 2**20, 1)}
+
+def percentiles(seconds: list):
+    """p50/p95/p99/max and total in milliseconds"""
+    if not seconds:
+        return {}
+    values = np.asarray(seconds) * 1000
+    return {
+        "total_ms": round(float(values.sum()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+        "count": len(values),
+    }
+
+class StageTimes:
+    """Collects wall-clock durations of wrapped functions by stage name"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, function):
+        if asyncio.iscoroutinefunction(function):
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+            return timed_async
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def patch(self, targets: dict):
+        """Time {stage: (object, attribute)} for the duration of the block"""
+        with ExitStack() as stack:
+            for stage, (owner, attribute) in targets.items():
+                stack.enter_context(mock.patch.object(owner, attribute, self.wrap(stage, getattr(owner, attribute))))
+            yield self
+
+    def summary(self):
+        return {stage: percentiles(values) for stage, values in self.samples.items()}
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
@@ -0,0 +1,58 @@
+"""Ingestion throughput and memory: CSV upload to a published collection version"""
+import os
+import time
+import tempfile
+from .datasets import make_dataset
+from .harness import benchmark_environment, PeakRSS, StageTimes
+
+def write_csv(dataset_rows: int, directory: str):
+    path = os.path.join(directory, f"dataset_{dataset_rows}.csv")
+    make_dataset(dataset_rows).to_csv(path, index=False)
+    return path
+
+def ingest_file(path: str):
+    """Parse and ingest a CSV file the way an upload job does"""
+    from ..ingestion import ingest_new_version
+    from ..readers import read_chunks
+    return ingest_new_version(read_chunks(path, os.path.basename(path)))
+
+def run(dataset_rows: int = 20000, backend: str = "qdrant", qdrant_path: str = None,
+        embed_latency: float = 0.05, **options):
+    from .. import ingestion
+    with tempfile.TemporaryDirectory(prefix="rag-bench-csv-") as directory:
+        path = write_csv(dataset_rows, directory)
+        file_mb = round(os.path.getsize(path) / 2**20, 2)
+        with benchmark_environment(backend=backend, qdrant_path=qdrant_path, embed_latency=embed_latency) as (embeddings, _):
+            stages = StageTimes()
+            targets = {
+                "prepare": (ingestion, "prepare_batch"),
+                "embed": (ingestion, "embed_texts"),
+                "upsert": (ingestion, "_upsert_batch"),
+            }
+            with stages.patch(targets), PeakRSS() as memory:
+                start = time.perf_counter()
+                stats = ingest_file(path)
+                elapsed = time.perf_counter() - start
+
+    return {
+        "suite": "ingest",
+        "backend": backend,
+        "dataset_rows": dataset_rows,
+        "file_mb": file_mb,
+        "embed_latency_s": embed_latency,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(stats["rows_processed"] / elapsed, 1),
+        "embedding_calls": embeddings.calls,
+        "memory": memory.result(),
+        "stages": stages.summary(),
+    }
+
+def report(results: dict):
+    lines = [
+        f"{results['dataset_rows']} rows into {results['backend']} in {results['seconds']}s "
+        f"({results['rows_per_sec']} rows/s, {results['embedding_calls']} embedding calls)",
+        f"RSS {results['memory']['start_mb']} MB -> peak {results['memory']['peak_mb']} MB",
+    ]
+    for stage, stats in results["stages"].items():
+        lines.append(f"  {stage:<10} total {stats['total_ms']:>10.1f} ms   p50 {stats['p50_ms']:>8.2f} ms   calls {stats['count']}")
+    return "\n".join(lines)
@@ -0,0 +1,70 @@
+"""Prompt size (and, with --live, Gemini latency) of the old and new context formats"""
+import time
+import statistics
+from django.test import override_settings
+from .datasets import make_dataset, payload_rows
+from ..context_builder import estimate_tokens
+
+QUERIES = [
+    "Show price trends for Wakad over the last 5 years",
+    "Compare total sales in Aundh and Baner",
+    "Which location has the highest flats sold in 2020",
+    "Tell me about Kharadi",
+    "Office rate growth in Hinjewadi",
+]
+
+FORMATS = ("records", "table")
+
+def _context_rows(df, query: str, n: int):
+    """Stand-in for retrieval: rows of the localities named in the query"""
+    named = [name for name in df["final location"].unique() if name.lower() in query.lower()]
+    matches = df[df["final location"].isin(named)] if named else df
+    return payload_rows(matches.head(n))
+
+def run(rows: int = 10, repeat: int = 3, live: bool = False, **options):
+    from ..llm import build_prompt
+    df = make_dataset(500)
+    if live:
+        import google.generativeai as genai
+        model = genai.GenerativeModel('gemini-2.0-flash')
+
+    results = []
+    for query in QUERIES:
+        context_rows = _context_rows(df, query, rows)
+        entry = {"query": query, "rows": len(context_rows)}
+        for fmt in FORMATS:
+            with override_settings(PROMPT_CONTEXT_FORMAT=fmt):
+                prompt, _ = build_prompt(query, context_rows)
+            stats = {"chars": len(prompt), "est_tokens": estimate_tokens(prompt)}
+            if live:
+                stats["tokens"] = model.count_tokens(prompt).total_tokens
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    model.generate_content(prompt)
+                    latencies.append(time.perf_counter() - start)
+                stats["generate_seconds"] = round(statistics.median(latencies), 3)
+            entry[fmt] = stats
+        results.append(entry)
+
+    totals = {fmt: sum(entry[fmt]["chars"] for entry in results) for fmt in FORMATS}
+    return {
+        "suite": "prompt",
+        "live": live,
+        "queries": results,
+        "prompt_chars_reduction": round(1 - totals["table"] / totals["records"], 3),
+    }
+
+def report(results: dict):
+    lines = [f"{'query':<52} {'records':>9} {'table':>9}"]
+    for entry in results["queries"]:
+        cells = []
+        for fmt in FORMATS:
+            stats = entry[fmt]
+            cell = f"{stats.get('tokens', stats['est_tokens'])}t"
+            if "generate_seconds" in stats:
+                cell += f" {stats['generate_seconds']}s"
+            cells.append(cell)
+        lines.append(f"{entry['query'][:52]:<52} {cells[0]:>9} {cells[1]:>9}")
+    lines.append(f"Prompt size reduced by {results['prompt_chars_reduction']:.0%}")
+    return "\n".join(lines)
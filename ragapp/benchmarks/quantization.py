@@ -0,0 +1,218 @@
+"""Recall, search latency and memory of the vector storage profiles and embedding sizes
+
+Recall@k is measured against exact float32 search over full 768-d vectors,
+i.e. the current configuration. By default the profiles are simulated with
+brute-force NumPy search over synthetic vectors; --live embeds the synthetic
+dataset with Gemini instead, and --qdrant-url also builds each profile as a
+real collection on that server and times its searches there.
+"""
+import os
+import math
+import time
+import numpy as np
+from django.conf import settings
+from .datasets import make_dataset
+from .harness import percentiles
+
+DIMENSIONS = (768, 512, 256, 128)
+PROFILES = ("float32", "on_disk", "int8", "binary")
+
+# Vector bytes held in RAM / on disk per row, for d dimensions. The HNSW graph
+# and payloads come on top and are the same for every profile.
+FOOTPRINT = {
+    "float32": lambda d: (4 * d, 4 * d),
+    "on_disk": lambda d: (0, 4 * d),
+    "int8": lambda d: (d, 5 * d),
+    "binary": lambda d: (math.ceil(d / 8), 4 * d + math.ceil(d / 8)),
+}
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def synthetic_vectors(n_rows: int, n_queries: int, dim: int = 768, seed: int = 0):
+    """Clustered unit vectors whose leading dimensions carry most of the variance
+
+    That falloff mimics Matryoshka-trained models such as text-embedding-004,
+    which is what makes truncated output_dimensionality vectors usable.
+    Queries are noisy copies of corpus rows, so each has true neighbours.
+    """
+    rng = np.random.default_rng(seed)
+    scale = (1 / np.sqrt(1 + np.arange(dim) / 32)).astype(np.float32)
+    centers = rng.standard_normal((max(n_rows // 50, 1), dim), dtype=np.float32) * scale
+    labels = rng.integers(0, len(centers), n_rows)
+    corpus = centers[labels] + 0.6 * rng.standard_normal((n_rows, dim), dtype=np.float32) * scale
+    picks = rng.choice(n_rows, n_queries)
+    queries = corpus[picks] + 0.5 * rng.standard_normal((n_queries, dim), dtype=np.float32) * scale
+    return _unit(corpus), _unit(queries)
+
+def gemini_vectors(n_rows: int, n_queries: int):
+    """Embed the synthetic dataset and benchmark queries with the real model"""
+    from .query import make_queries
+    from ..embeddings import create_chunks, embed_texts
+    corpus, _ = embed_texts(create_chunks(make_dataset(n_rows)))
+    queries, _ = embed_texts(make_queries(n_queries), task_type="retrieval_query")
+    return _unit(corpus), _unit(queries)
+
+def truncate(vectors, dim: int):
+    """What output_dimensionality returns: the leading dims, renormalised"""
+    return _unit(vectors[:, :dim])
+
+def exact_top_k(corpus, queries, top_k: int):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, top_k, axis=1)[:, :top_k]
+    return [set(row) for row in top]
+
+def _top(scores, k: int):
+    k = min(k, len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+class FloatIndex:
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def search(self, query, top_k: int):
+        return _top(self.corpus @ query, top_k)
+
+class Int8Index:
+    """Scalar quantization as Qdrant does it: 0.99 quantile range mapped to 256 levels"""
+
+    def __init__(self, corpus, oversampling: float, quantile: float = 0.99):
+        self.corpus = corpus
+        self.oversampling = oversampling
+        low, high = np.quantile(corpus, [1 - quantile, quantile])
+        codes = np.clip(np.round((corpus - low) / (high - low) * 255), 0, 255).astype(np.uint8)
+        # Scores against the codes rank like scores against the dequantised vectors
+        self.codes = codes.astype(np.float32)
+
+    def search(self, query, top_k: int):
+        candidates = _top(self.codes @ query, math.ceil(top_k * self.oversampling))
+        return candidates[_top(self.corpus[candidates] @ query, top_k)]
+
+class BinaryIndex:
+    """One sign bit per dimension, ranked by Hamming distance, then rescored"""
+
+    def __init__(self, corpus, oversampling: float):
+        self.corpus = corpus
+        self.oversampling = oversampling
+        self.bits = np.packbits(corpus > 0, axis=1)
+
+    def search(self, query, top_k: int):
+        distance = np.bitwise_count(self.bits ^ np.packbits(query > 0)).sum(axis=1, dtype=np.int32)
+        candidates = _top(-distance, math.ceil(top_k * self.oversampling))
+        return candidates[_top(self.corpus[candidates] @ query, top_k)]
+
+def make_index(profile: str, corpus, oversampling: float):
+    if profile == "int8":
+        return Int8Index(corpus, oversampling)
+    if profile == "binary":
+        return BinaryIndex(corpus, oversampling)
+    return FloatIndex(corpus)
+
+def measure(search, queries, truth: list, top_k: int):
+    """Recall@k against the exact results, plus per-query latency"""
+    seconds, found = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids = search(query, top_k)
+        seconds.append(time.perf_counter() - start)
+        found += len(expected.intersection(int(id) for id in ids))
+    return round(found / (len(truth) * top_k), 4), percentiles(seconds)
+
+def qdrant_search(url: str, profile: str, corpus, top_k: int):
+    """Build the profile as a temporary collection on a Qdrant server; returns (search, cleanup)"""
+    from qdrant_client import QdrantClient
+    from qdrant_client.http.models import VectorParams, Distance, PointStruct
+    from ..qdrant_client import storage_profile, search_params
+
+    client = QdrantClient(url=url, api_key=os.getenv("QDRANT_API_KEY"), timeout=120)
+    name = f"benchmark_{profile}_{corpus.shape[1]}"
+    on_disk, quantization = storage_profile(profile)
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=corpus.shape[1], distance=Distance.COSINE, on_disk=on_disk),
+        quantization_config=quantization,
+    )
+    for start in range(0, len(corpus), 1000):
+        client.upsert(collection_name=name, points=[
+            PointStruct(id=start + i, vector=vector.tolist()) for i, vector in enumerate(corpus[start:start + 1000])
+        ])
+    # Wait for the optimizer to build the HNSW index before timing searches
+    while client.get_collection(name).status.value != "green":
+        time.sleep(0.5)
+    params = search_params(profile)
+
+    def search(query, k: int):
+        points = client.query_points(collection_name=name, query=query.tolist(), limit=k, search_params=params).points
+        return [point.id for point in points]
+
+    return search, lambda: client.delete_collection(name)
+
+def run(dataset_rows: int = 20000, requests: int = 200, rows: int = 10, live: bool = False,
+        qdrant_url: str = None, archive_rows: int = 5_000_000, **options):
+    top_k = rows
+    oversampling = settings.QUANTIZATION_OVERSAMPLING
+    if live:
+        corpus, queries = gemini_vectors(dataset_rows, requests)
+    else:
+        corpus, queries = synthetic_vectors(dataset_rows, requests)
+    truth = exact_top_k(corpus, queries, top_k)
+
+    results = []
+    for dim in DIMENSIONS:
+        reduced, reduced_queries = truncate(corpus, dim), truncate(queries, dim)
+        for profile in PROFILES:
+            ram, disk = FOOTPRINT[profile](dim)
+            entry = {
+                "dim": dim, "profile": profile,
+                "ram_bytes_per_vector": ram,
+                "archive_ram_gb": round(ram * archive_rows / 1e9, 2),
+                "archive_disk_gb": round(disk * archive_rows / 1e9, 2),
+            }
+            # on_disk searches the same float32 vectors, so its recall is float32's;
+            # its latency depends on the page cache and only shows up on a server
+            if profile == "on_disk":
+                entry["recall"] = results[-1]["recall"]
+            else:
+                index = make_index(profile, reduced, oversampling)
+                entry["recall"], entry["latency"] = measure(index.search, reduced_queries, truth, top_k)
+            if qdrant_url:
+                search, cleanup = qdrant_search(qdrant_url, profile, reduced, top_k)
+                try:
+                    entry["qdrant_recall"], entry["qdrant_latency"] = measure(search, reduced_queries, truth, top_k)
+                finally:
+                    cleanup()
+            results.append(entry)
+
+    return {
+        "suite": "quantization",
+        "vectors": "gemini" if live else "synthetic",
+        "dataset_rows": dataset_rows,
+        "queries": requests,
+        "top_k": top_k,
+        "oversampling": oversampling,
+        "archive_rows": archive_rows,
+        "profiles": results,
+    }
+
+def report(results: dict):
+    lines = [
+        f"{results['dataset_rows']} {results['vectors']} vectors, {results['queries']} queries, "
+        f"recall@{results['top_k']} vs. exact float32/768, oversampling {results['oversampling']}",
+        f"{'dim':>5} {'profile':<8} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'RAM B/vec':>10} {'RAM GB':>8} {'disk GB':>8}  @ {results['archive_rows']:,} rows",
+    ]
+    for entry in results["profiles"]:
+        recall = entry.get("qdrant_recall", entry.get("recall"))
+        latency = entry.get("qdrant_latency", entry.get("latency", {}))
+        lines.append(
+            f"{entry['dim']:>5} {entry['profile']:<8} {recall:>7}"
+            f" {latency.get('p50_ms', '-'):>8} {latency.get('p95_ms', '-'):>8}"
+            f" {entry['ram_bytes_per_vector']:>10} {entry['archive_ram_gb']:>8} {entry['archive_disk_gb']:>8}"
+        )
+    if not any("qdrant_latency" in entry for entry in results["profiles"]):
+        lines.append("Latencies are brute-force NumPy scans; pass --qdrant-url to time HNSW searches on a server.")
+    return "\n".join(lines)
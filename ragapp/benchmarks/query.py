@@ -0,0 +1,105 @@
+"""query_view (or query_async_view) latency under concurrent load, with a per-stage breakdown"""
+import time
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.test import Client, override_settings
+from .datasets import LOCATIONS, CITIES
+from .harness import benchmark_environment, StageTimes, percentiles
+from .ingest import write_csv, ingest_file
+
+# Queries naming a known locality are answered by analytics; the city-level
+# ones match no locality or metric and go through retrieval + generation
+ANALYTICS_TEMPLATES = [
+    "Show price trends for {0}",
+    "Compare total sales in {0} and {1}",
+    "Which areas near {0} sold the most flats",
+]
+
+RAG_TEMPLATES = [
+    "What is the property market like in {2}",
+    "Tell me about real estate in {2}",
+    "Is {2} a good place for a first home",
+]
+
+def make_queries(count: int):
+    """Alternate analytics and RAG queries, numbered so each one is distinct"""
+    templates = [t for pair in zip(ANALYTICS_TEMPLATES, RAG_TEMPLATES) for t in pair]
+    queries = []
+    for i in range(count):
+        template = templates[i % len(templates)]
+        first = LOCATIONS[i % len(LOCATIONS)]
+        second = LOCATIONS[(i + 3) % len(LOCATIONS)]
+        city = CITIES[(i // 2) % len(CITIES)]
+        queries.append(f"{template.format(first, second, city)} (case {i})")
+    return queries
+
+def run(dataset_rows: int = 20000, requests: int = 200, concurrency: int = 8, backend: str = "qdrant",
+        qdrant_path: str = None, embed_latency: float = 0.05, llm_latency: float = 1.0, llm_tail: float = 0.0,
+        answer_cache: bool = False, distinct_queries: int = None, endpoint: str = "query", **options):
+    from .. import views, llm
+    from ..vector_store import get_store
+    # With distinct_queries the same few queries repeat, like a dashboard load spike
+    distinct = make_queries(distinct_queries or requests)
+    queries = [distinct[i % len(distinct)] for i in range(requests)]
+    with tempfile.TemporaryDirectory(prefix="rag-bench-csv-") as directory, \
+            benchmark_environment(backend=backend, qdrant_path=qdrant_path,
+                                  embed_latency=embed_latency, llm_latency=llm_latency, llm_tail=llm_tail) as (_, model_class), \
+            override_settings(ANSWER_CACHE_ENABLED=answer_cache):
+        ingest_file(write_csv(dataset_rows, directory))
+
+        def ask(query: str):
+            start = time.perf_counter()
+            response = Client().post(f"/api/{endpoint}", {"query": query}, content_type="application/json")
+            degraded = response.status_code == 200 and response.json().get("degraded", False)
+            return time.perf_counter() - start, response.status_code, degraded
+
+        # One untimed request maps the snapshot and loads the indexes
+        ask("Show price trends for Wakad")
+
+        stages = StageTimes()
+        suffix = "_async" if endpoint == "query/async" else ""
+        targets = {
+            "analytics": (views, "analyze"),
+            "embed_query": (views, f"embed_query{suffix}"),
+            "retrieve": (llm, f"retrieve_context{suffix}"),
+            "vector_search": (get_store(), f"search{suffix}"),
+            "generate": (llm, f"llama_answer{suffix}"),
+        }
+        with stages.patch(targets), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            outcomes = list(pool.map(ask, queries))
+            elapsed = time.perf_counter() - start
+
+    return {
+        "suite": "query",
+        "backend": backend,
+        "endpoint": endpoint,
+        "dataset_rows": dataset_rows,
+        "requests": requests,
+        "concurrency": concurrency,
+        "embed_latency_s": embed_latency,
+        "llm_latency_s": llm_latency,
+        "llm_tail": llm_tail,
+        "answer_cache": answer_cache,
+        "distinct_queries": len(distinct),
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(requests / elapsed, 2),
+        "status_codes": dict(Counter(status for _, status, _ in outcomes)),
+        "degraded": sum(degraded for _, _, degraded in outcomes),
+        "llm_calls": model_class.calls,
+        "latency": percentiles([seconds for seconds, _, _ in outcomes]),
+        "stages": stages.summary(),
+    }
+
+def report(results: dict):
+    latency = results["latency"]
+    lines = [
+        f"{results['requests']} queries to /api/{results['endpoint']}, concurrency {results['concurrency']}, {results['backend']}: "
+        f"{results['requests_per_sec']} req/s, status {results['status_codes']}, "
+        f"{results['degraded']} degraded, {results['llm_calls']} LLM calls",
+        f"latency p50 {latency['p50_ms']} ms   p95 {latency['p95_ms']} ms   p99 {latency['p99_ms']} ms",
+    ]
+    for stage, stats in results["stages"].items():
+        lines.append(f"  {stage:<14} p50 {stats['p50_ms']:>9.2f} ms   p95 {stats['p95_ms']:>9.2f} ms   calls {stats['count']}")
+    return "\n".join(lines)
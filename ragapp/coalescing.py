@@ -0,0 +1,204 @@
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds between result checks while another worker computes a query
+POLL_INTERVAL = 0.05
+# Seconds a shared result stays readable for workers that were still waiting
+SHARED_RESULT_TTL = 10
+
+# Set on a call whose leader was cancelled; its followers elect a new leader
+_ABANDONED = object()
+
+def _count(role: str):
+    registry.increment("rag_coalesced_queries_total", help="Queries by single-flight role", role=role)
+
+class SingleFlight:
+    """Runs one computation per key at a time within the process
+
+    Callers that arrive while a key is in flight wait for the running
+    computation and get its result (or exception) instead of starting their
+    own. Sync and async callers share the same in-flight table. If the
+    leader is cancelled (CancelledError, KeyboardInterrupt, SystemExit),
+    the key is released and one of the followers computes it instead.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Return (future, is_leader) for key"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = Future()
+            return call, True
+
+    def _finish(self, key, call: Future, result=None, error: Exception = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            call.set_exception(error)
+        else:
+            call.set_result(result)
+
+    def do(self, key, func):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            try:
+                result = call.result(timeout=max(deadline - time.monotonic(), 0))
+            except FutureTimeout:
+                logger.warning(f"Gave up waiting for in-flight query after {self.timeout}s, computing it again")
+                return func()
+            if result is not _ABANDONED:
+                _count("follower")
+                return result
+
+        _count("leader")
+        try:
+            result = func()
+        except Exception as e:
+            self._finish(key, call, error=e)
+            raise
+        except BaseException:
+            self._finish(key, call, _ABANDONED)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def do_async(self, key, func):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: a cancelled waiter must not cancel the shared future
+                result = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(call)), max(deadline - time.monotonic(), 0),
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Gave up waiting for in-flight query after {self.timeout}s, computing it again")
+                return await func()
+            if result is not _ABANDONED:
+                _count("follower")
+                return result
+
+        _count("leader")
+        try:
+            result = await func()
+        except Exception as e:
+            self._finish(key, call, error=e)
+            raise
+        except BaseException:
+            self._finish(key, call, _ABANDONED)
+            raise
+        self._finish(key, call, result)
+        return result
+
+class SharedFlight:
+    """Single-flight across worker processes through a Django cache alias
+
+    The first worker to add the lock key computes the result and publishes
+    it under the result key; the others poll for it. If the lock holder dies
+    or times out, waiters compute the result themselves. Exceptions are not
+    shared across workers.
+    """
+
+    def __init__(self, backend: str, timeout: float):
+        self.backend = backend
+        self.timeout = timeout
+
+    @staticmethod
+    def _keys(key):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return f"query-flight-lock:{digest}", f"query-flight-result:{digest}"
+
+    def do(self, key, func):
+        cache = caches[self.backend]
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.timeout
+        while True:
+            found = cache.get(result_key)
+            if found is not None:
+                _count("shared")
+                return found
+            if cache.add(lock_key, token, timeout=self.timeout) or time.monotonic() > deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            # The previous holder may have published just before releasing the lock
+            found = cache.get(result_key)
+            if found is not None:
+                _count("shared")
+                return found
+            result = func()
+            cache.set(result_key, result, timeout=SHARED_RESULT_TTL)
+            return result
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    async def do_async(self, key, func):
+        cache = caches[self.backend]
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.timeout
+        while True:
+            found = await cache.aget(result_key)
+            if found is not None:
+                _count("shared")
+                return found
+            if await cache.aadd(lock_key, token, timeout=self.timeout) or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            # The previous holder may have published just before releasing the lock
+            found = await cache.aget(result_key)
+            if found is not None:
+                _count("shared")
+                return found
+            result = await func()
+            await cache.aset(result_key, result, timeout=SHARED_RESULT_TTL)
+            return result
+        finally:
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+
+single_flight = SingleFlight(timeout=settings.QUERY_COALESCING_TIMEOUT)
+
+def coalesce(key, func):
+    """Run func() once for concurrent callers with the same key"""
+    if not settings.QUERY_COALESCING_ENABLED:
+        return func()
+    if settings.QUERY_COALESCING_BACKEND:
+        shared = SharedFlight(settings.QUERY_COALESCING_BACKEND, settings.QUERY_COALESCING_TIMEOUT)
+        return single_flight.do(key, lambda: shared.do(key, func))
+    return single_flight.do(key, func)
+
+async def coalesce_async(key, func):
+    """coalesce for coroutine functions"""
+    if not settings.QUERY_COALESCING_ENABLED:
+        return await func()
+    if settings.QUERY_COALESCING_BACKEND:
+        shared = SharedFlight(settings.QUERY_COALESCING_BACKEND, settings.QUERY_COALESCING_TIMEOUT)
+        return await single_flight.do_async(key, lambda: shared.do_async(key, func))
+    return await single_flight.do_async(key, func)
@@ -0,0 +1,90 @@
+import io
+import csv
+import math
+import logging
+from collections import namedtuple
+from django.conf import settings
+from .analytics import extract_metrics, LOCATION_COLUMN, YEAR_COLUMN
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a row; kept whenever present
+KEY_COLUMNS = [LOCATION_COLUMN, "city", YEAR_COLUMN]
+
+# Shown when the query does not name a metric
+DEFAULT_COLUMNS = [
+    "total_sales - igr",
+    "total sold - igr",
+    "flat - weighted average rate",
+    "total units",
+]
+
+# Rough characters per token for Gemini on numeric tables; close enough to
+# budget prompts without an extra count_tokens round-trip
+CHARS_PER_TOKEN = 4
+
+Context = namedtuple("Context", ["text", "columns", "rows", "tokens", "dropped"])
+
+def _tokens(chars: int):
+    return math.ceil(chars / CHARS_PER_TOKEN)
+
+def estimate_tokens(text: str):
+    return _tokens(len(text))
+
+def select_columns(query: str, rows: list):
+    """Key columns plus the metric columns the query asks about
+
+    Falls back to every column when none of the wanted metrics exist, so
+    uploads with a different schema still get their data into the prompt.
+    """
+    available = []
+    for row in rows:
+        for column, value in row.items():
+            if value is not None and column not in available:
+                available.append(column)
+
+    wanted = [column for _, column, _, _ in extract_metrics(query)] or DEFAULT_COLUMNS
+    metrics = [column for column in dict.fromkeys(wanted) if column in available]
+    if not metrics:
+        return available
+    return [column for column in KEY_COLUMNS if column in available] + metrics
+
+def _format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        return str(int(value)) if value.is_integer() else str(round(value, 2))
+    return str(value)
+
+def _csv_line(values: list):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+def build_context(query: str, rows: list, token_budget: int = None, max_rows: int = None):
+    """Render retrieved rows as a compact CSV table within a token budget
+
+    Rows must be ordered best match first (as retrieve_context returns
+    them); once the budget is reached the least relevant rows are dropped.
+    The first row is always kept.
+    """
+    token_budget = token_budget or settings.PROMPT_CONTEXT_TOKEN_BUDGET
+    max_rows = max_rows or settings.PROMPT_MAX_ROWS
+    columns = select_columns(query, rows)
+
+    lines = [_csv_line(columns)]
+    chars = len(lines[0])
+    for row in rows[:max_rows]:
+        line = _csv_line([_format_value(row.get(column)) for column in columns])
+        if len(lines) > 1 and _tokens(chars + 1 + len(line)) > token_budget:
+            break
+        lines.append(line)
+        chars += 1 + len(line)
+
+    text = "\n".join(lines)
+    kept = len(lines) - 1
+    dropped = len(rows) - kept
+    logger.info(f"Prompt context: {kept} rows x {len(columns)} columns, ~{estimate_tokens(text)} tokens ({dropped} rows dropped)")
+    return Context(text, columns, kept, estimate_tokens(text), dropped)
@@ -0,0 +1,65 @@
+import time
+import random
+import threading
+from collections import deque
+from google.api_core import exceptions as google_exceptions
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out"""
+
+class Deadline:
+    """Time budget for one request, shared by its stages"""
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def budget(self, cap: float = None):
+        """Seconds a stage may take: what is left, capped at the stage's own limit"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Query deadline exceeded")
+        return remaining if cap is None else min(remaining, cap)
+
+class LatencyTracker:
+    """Recent successful call durations, used to time hedged requests"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, default: float):
+        """q-quantile of the window, or default until min_samples calls were seen"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return default
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+# Upstream errors worth another attempt; anything else fails the call at once
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Errors that mean a stage ran out of time
+TIMEOUT_ERRORS = (DeadlineExceeded, google_exceptions.DeadlineExceeded, TimeoutError)
+
+def is_transient(error: Exception):
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def backoff_delay(attempt: int, base: float):
+    """Exponential backoff with full jitter, so retries from many requests spread out"""
+    return random.uniform(0, base * (2 ** attempt))
@@ -0,0 +1,122 @@
+import os
+import json
+import logging
+import threading
+import pandas as pd
+from django.conf import settings
+from .analytics import TermMatcher, extract_terms, extract_years, LOCATION_COLUMN, YEAR_COLUMN
+
+logger = logging.getLogger(__name__)
+
+CITY_COLUMN = "city"
+
+_vocabularies = {}
+_lock = threading.Lock()
+
+class VocabularyBuilder:
+    """Collects the distinct localities, cities and years of a dataset chunk by chunk"""
+
+    def __init__(self):
+        self.locations = set()
+        self.cities = set()
+        self.years = set()
+
+    def add(self, df: pd.DataFrame):
+        if LOCATION_COLUMN in df.columns:
+            self.locations.update(str(v) for v in df[LOCATION_COLUMN].dropna().unique())
+        if CITY_COLUMN in df.columns:
+            self.cities.update(str(v) for v in df[CITY_COLUMN].dropna().unique())
+        if YEAR_COLUMN in df.columns:
+            years = pd.to_numeric(df[YEAR_COLUMN], errors="coerce").dropna().unique()
+            self.years.update(int(y) for y in years)
+
+    def observe(self, frames):
+        """Pass a dataframe or chunk iterable through, adding each chunk on the way"""
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        for df in frames:
+            self.add(df)
+            yield df
+
+    def vocabulary(self):
+        return {
+            "locations": sorted(self.locations),
+            "cities": sorted(self.cities),
+            "years": sorted(self.years),
+        }
+
+def build_vocabulary(df: pd.DataFrame):
+    """Collect the distinct localities, cities and years of a dataset"""
+    builder = VocabularyBuilder()
+    builder.add(df)
+    return builder.vocabulary()
+
+def _compile(vocabulary: dict):
+    """Swap the locality and city lists for TermMatchers, built once per version"""
+    if vocabulary is None:
+        return None
+    return {**vocabulary, "locations": TermMatcher(vocabulary["locations"]), "cities": TermMatcher(vocabulary["cities"])}
+
+def _path(collection_name: str):
+    return os.path.join(settings.RAG_DATA_DIR, "vocabulary", f"{collection_name}.json")
+
+def save_vocabulary(collection_name: str, vocabulary: dict):
+    """Persist the vocabulary of a collection version next to the other local state"""
+    path = _path(collection_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(vocabulary, f)
+    os.replace(tmp, path)
+    with _lock:
+        _vocabularies[collection_name] = _compile(vocabulary)
+
+def get_vocabulary(collection_name: str):
+    """Return the vocabulary of a collection version, or None if it was never built
+
+    Localities and cities come back as TermMatchers, years as a sorted list.
+    """
+    if collection_name in _vocabularies:
+        return _vocabularies[collection_name]
+    try:
+        with open(_path(collection_name), encoding="utf-8") as f:
+            vocabulary = json.load(f)
+    except FileNotFoundError:
+        vocabulary = None
+    vocabulary = _compile(vocabulary)
+    with _lock:
+        _vocabularies[collection_name] = vocabulary
+    return vocabulary
+
+def extract_filter(query: str, vocabulary: dict):
+    """Derive payload filter conditions from localities, cities and years in the query
+
+    Returns a {column: values} spec where years are an inclusive
+    (start, end) range, or None when the query names none of them.
+    """
+    if not vocabulary:
+        return None
+    spec = {}
+    locations = extract_terms(query, vocabulary["locations"])
+    if locations:
+        spec[LOCATION_COLUMN] = locations
+    cities = extract_terms(query, vocabulary["cities"])
+    if cities:
+        spec[CITY_COLUMN] = cities
+    years = extract_years(query, vocabulary["years"])
+    if years:
+        spec[YEAR_COLUMN] = years
+    if spec:
+        logger.info(f"Query filter: {spec}")
+    return spec or None
+
+def matches_filter(payload: dict, spec: dict):
+    """Check a payload against a filter spec, as Qdrant would"""
+    for field_name, values in (spec or {}).items():
+        value = payload.get(field_name)
+        if field_name == YEAR_COLUMN:
+            if value is None or not values[0] <= value <= values[1]:
+                return False
+        elif value not in values:
+            return False
+    return True
@@ -0,0 +1,238 @@
+import pandas as pd
+import os
+import json
+import shutil
+import time
+import uuid
+import hashlib
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .embeddings import embed_texts, create_chunks
+from .filters import VocabularyBuilder, save_vocabulary
+from .readers import read_chunks, UploadError, SUPPORTED_EXTENSIONS
+from .lexical import BM25Builder
+from .snapshots import SnapshotWriter
+from .metrics import stage, registry
+from .locks import file_lock
+from .vector_store import get_store, collection_state, version_of, COLLECTION_NAME
+
+logger = logging.getLogger(__name__)
+
+def publish_lock():
+    """Serialises version creation and alias swaps across threads and worker processes on this host"""
+    return file_lock(os.path.join(settings.RAG_DATA_DIR, "publish.lock"))
+
+# Columns that identify a row across uploads
+NATURAL_KEY = ("final location", "year", "city")
+
+# Fixed namespace so the same natural key always maps to the same point ID
+POINT_ID_NAMESPACE = uuid.UUID("5b0c8a52-3f7e-4b8e-9a4a-6f1d2c7e9b31")
+
+def iter_batches(frames, batch_size: int):
+    """Yield consecutive row slices of a dataframe or of an iterable of dataframe chunks"""
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    for df in frames:
+        for start in range(0, len(df), batch_size):
+            yield start, df.iloc[start:start + batch_size]
+
+def point_id(payload: dict, occurrence: int = 0):
+    """Derive a stable point ID from the row's natural key
+
+    Rows that repeat the same natural key within one file are told apart
+    by their occurrence number.
+    """
+    key = "|".join(str(payload.get(col)).strip().lower() for col in NATURAL_KEY)
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{key}|{occurrence}"))
+
+def content_hash(payload: dict):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def batch_payloads(batch: pd.DataFrame):
+    """Row dicts of a batch with NaN as None, converted in bulk
+
+    Same values as to_dict("records") on a NaN-to-None frame (and as the
+    rows of iterrows), without its per-cell boxing.
+    """
+    row_dtype = batch.iloc[:0].to_numpy().dtype
+    values = batch.to_numpy(dtype=row_dtype).astype(object)
+    values[batch.isna().to_numpy()] = None
+    columns = list(batch.columns)
+    return [dict(zip(columns, row)) for row in values.tolist()]
+
+def prepare_batch(batch: pd.DataFrame, key_counts: Counter):
+    """Build IDs, chunk texts and JSON-safe payloads for a slice of rows"""
+    texts = create_chunks(batch)
+    payloads = batch_payloads(batch)
+    ids = []
+    for payload in payloads:
+        # The year index is an integer index; a column with gaps is parsed as float
+        if isinstance(payload.get("year"), float) and payload["year"].is_integer():
+            payload["year"] = int(payload["year"])
+
+        natural_key = tuple(payload.get(col) for col in NATURAL_KEY)
+        ids.append(point_id(payload, key_counts[natural_key]))
+        key_counts[natural_key] += 1
+
+        payload["_content_hash"] = content_hash(payload)
+    return ids, texts, payloads
+
+def ingest_dataframe(df, collection_name: str = COLLECTION_NAME, incremental: bool = False,
+                     progress=None, lexical_index: BM25Builder = None):
+    """Chunk, embed and upsert the dataframe in fixed-size batches
+
+    df may also be an iterable of dataframe chunks (see readers.read_chunks),
+    which are consumed one at a time.
+
+    Only one batch is held in memory while the previous one is being
+    written, so the Qdrant upsert of batch N overlaps the embedding of
+    batch N+1 and peak memory does not grow with the file size.
+
+    In incremental mode the collection is compared against the stored
+    content hashes: unchanged rows are skipped, new or changed rows are
+    re-embedded and rows missing from the file are deleted.
+
+    progress, if given, is called with the running stats after every batch.
+    Every row's chunk text and payload is also added to lexical_index when given.
+    """
+    batch_size = settings.INGEST_BATCH_SIZE
+    stats = {
+        "rows_processed": 0, "rows_embedded": 0, "rows_upserted": 0, "cache_hits": 0, "batches": 0, "embedding_seconds": 0.0,
+        "inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0,
+    }
+    start = time.perf_counter()
+
+    existing = get_store().fetch_content_hashes(collection_name) if incremental else {}
+    seen_ids = set()
+    key_counts = Counter()
+
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for _, batch in iter_batches(df, batch_size):
+            with stage("ingest_prepare"):
+                ids, texts, payloads = prepare_batch(batch, key_counts)
+            seen_ids.update(ids)
+            stats["rows_processed"] += len(ids)
+            if lexical_index is not None:
+                lexical_index.add(ids, texts, payloads)
+
+            if incremental:
+                changed = [i for i, id in enumerate(ids) if existing.get(id) != payloads[i]["_content_hash"]]
+                stats["unchanged"] += len(ids) - len(changed)
+                stats["updated"] += sum(1 for i in changed if ids[i] in existing)
+                stats["inserted"] += sum(1 for i in changed if ids[i] not in existing)
+                ids = [ids[i] for i in changed]
+                texts = [texts[i] for i in changed]
+                payloads = [payloads[i] for i in changed]
+            else:
+                stats["inserted"] += len(ids)
+            if not ids:
+                if progress is not None:
+                    progress(stats)
+                continue
+
+            with stage("ingest_embed"):
+                vectors, embedding_stats = embed_texts(texts)
+            stats["rows_embedded"] += len(vectors)
+            stats["cache_hits"] += embedding_stats["cache_hits"]
+            stats["embedding_seconds"] += embedding_stats["seconds"]
+
+            # Wait for the previous write before queueing this one
+            if pending is not None:
+                stats["rows_upserted"] += pending.result()
+
+            pending = writer.submit(_upsert_batch, ids, vectors, payloads, collection_name)
+            stats["batches"] += 1
+            if progress is not None:
+                progress(stats)
+
+        if pending is not None:
+            stats["rows_upserted"] += pending.result()
+            if progress is not None:
+                progress(stats)
+
+    if incremental:
+        removed = [id for id in existing if id not in seen_ids]
+        for i in range(0, len(removed), batch_size):
+            get_store().delete_vectors(removed[i:i + batch_size], collection_name=collection_name)
+        stats["deleted"] = len(removed)
+
+    elapsed = time.perf_counter() - start
+    registry.increment("rag_ingested_rows_total", stats["rows_processed"], help="Rows read by ingestion jobs")
+    registry.increment("rag_embedded_rows_total", stats["rows_embedded"], help="Rows embedded by ingestion jobs")
+    stats["embedding_seconds"] = round(stats["embedding_seconds"], 3)
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["rows_processed"] / elapsed, 1) if elapsed > 0 else None
+    logger.info(
+        f"Ingested {stats['rows_processed']} rows into '{collection_name}' ({stats['rows_per_sec']} rows/sec): "
+        f"{stats['inserted']} inserted, {stats['updated']} updated, "
+        f"{stats['deleted']} deleted, {stats['unchanged']} unchanged"
+    )
+    return stats
+
+def _upsert_batch(ids: list, vectors: list, payloads: list, collection_name: str):
+    with stage("ingest_upsert"):
+        get_store().add_vectors(ids, vectors, payloads, collection_name=collection_name)
+    return len(ids)
+
+def ingest_new_version(df, incremental: bool = False, progress=None):
+    """Build a new realestate_v{n} collection and swap the alias to it
+
+    df is a dataframe or an iterable of dataframe chunks.
+
+    Readers keep using the previous version until the new one is complete.
+    In incremental mode the new version starts as a copy of the active one
+    and only the delta is embedded. A failed build is dropped and the alias
+    is left untouched.
+    """
+    store = get_store()
+    with publish_lock():
+        active = store.get_active_collection()
+        collection_name = store.create_next_version()
+        lexical_index = BM25Builder()
+        vocabulary = VocabularyBuilder()
+        snapshot = None
+        try:
+            # The raw table is persisted next to the vectors for analytics
+            snapshot = SnapshotWriter(collection_name)
+            frames = snapshot.observe(vocabulary.observe(df))
+            if incremental and active is not None:
+                store.copy_points(active, collection_name)
+                stats = ingest_dataframe(frames, collection_name=collection_name, incremental=True, progress=progress,
+                                         lexical_index=lexical_index)
+            else:
+                stats = ingest_dataframe(frames, collection_name=collection_name, progress=progress,
+                                         lexical_index=lexical_index)
+            # Dictionary of localities/cities/years used to build query filters
+            save_vocabulary(collection_name, vocabulary.vocabulary())
+            lexical_index.save(collection_name)
+            stats["snapshot_bytes"] = snapshot.close()
+            store.activate_collection(collection_name)
+        except Exception:
+            if snapshot is not None:
+                snapshot.abort()
+            lexical_index.discard()
+            store.drop_collection(collection_name)
+            raise
+        collection_state.refresh()
+        prune_local_state()
+
+    stats["collection"] = collection_name
+    stats["version"] = version_of(collection_name)
+    logger.info(f"Alias '{COLLECTION_NAME}' now points at '{collection_name}'")
+    return stats
+
+def prune_local_state():
+    """Delete vocabularies, lexical indexes and snapshots of collection versions that no longer exist"""
+    live = {f"{COLLECTION_NAME}_v{v}" for v in get_store().list_versions()}
+    for subdir, suffix in (("vocabulary", ".json"), ("lexical", ""), ("snapshots", ".arrow")):
+        root = os.path.join(settings.RAG_DATA_DIR, subdir)
+        if not os.path.isdir(root):
+            continue
+        for entry in os.listdir(root):
+            name = entry[:-len(suffix)] if suffix and entry.endswith(suffix) else entry
+            if version_of(name) is not None and name not in live:
+                path = os.path.join(root, entry)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
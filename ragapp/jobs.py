@@ -0,0 +1,152 @@
+import os
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from . import ingestion
+from .readers import estimate_rows
+from .snapshots import get_snapshot
+from .answer_cache import answer_cache
+from .models import IngestJob
+
+logger = logging.getLogger(__name__)
+
+# Uploads are ingested here so request workers stay free for queries
+_executor = ThreadPoolExecutor(max_workers=settings.INGEST_JOB_WORKERS, thread_name_prefix="ingest")
+
+def enqueue_upload(file, mode: str = "full"):
+    """Spool an uploaded file to disk and queue it for background ingestion"""
+    os.makedirs(settings.INGEST_UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(settings.INGEST_UPLOAD_DIR, f"{uuid.uuid4().hex}_{os.path.basename(file.name)}")
+    with open(path, "wb") as out:
+        for chunk in file.chunks():
+            out.write(chunk)
+
+    job = IngestJob.objects.create(file_name=file.name, mode=mode, upload_path=path)
+    transaction.on_commit(lambda: _executor.submit(run_job, job.pk, path))
+    return job
+
+_recovered = False
+_recover_lock = threading.Lock()
+
+def recover_jobs():
+    """Pick up jobs left behind by a restart; runs once per process
+
+    Queued jobs lose their executor slot when the process that accepted
+    them exits, so they are queued again here. Running jobs whose heartbeat
+    is older than INGEST_JOB_STALE_SECONDS lost their worker and are marked
+    failed; the partial collection they were building is never activated.
+    Several processes may queue the same job; run_job lets only one run it.
+    """
+    global _recovered
+    with _recover_lock:
+        if _recovered:
+            return
+        _recovered = True
+
+    stale_before = timezone.now() - timedelta(seconds=settings.INGEST_JOB_STALE_SECONDS)
+    stale = IngestJob.objects.filter(status="running", heartbeat_at__lt=stale_before).update(
+        status="failed", finished_at=timezone.now(), error="Interrupted: the ingestion worker stopped before finishing",
+    )
+    if stale:
+        logger.warning(f"Marked {stale} stale ingest job(s) as failed")
+
+    for job in IngestJob.objects.filter(status="queued"):
+        if job.upload_path and os.path.exists(job.upload_path):
+            logger.info(f"Re-queueing ingest job {job.pk}")
+            _executor.submit(run_job, job.pk, job.upload_path)
+        else:
+            IngestJob.objects.filter(pk=job.pk, status="queued").update(
+                status="failed", finished_at=timezone.now(), error="Interrupted: the uploaded file is no longer available",
+            )
+
+def _claim(job_id: int):
+    """Move a job from queued to running; False if another worker already took it"""
+    now = timezone.now()
+    return IngestJob.objects.filter(pk=job_id, status="queued").update(
+        status="running", started_at=now, heartbeat_at=now,
+    ) == 1
+
+@contextmanager
+def _heartbeat(job_id: int):
+    """Refresh a running job's heartbeat from a side thread until the block exits"""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(settings.INGEST_JOB_HEARTBEAT_SECONDS):
+                IngestJob.objects.filter(pk=job_id, status="running").update(heartbeat_at=timezone.now())
+        except Exception:
+            logger.exception(f"Heartbeat for ingest job {job_id} stopped")
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=beat, name=f"ingest-heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def _finish(job_id: int, **fields):
+    """Record a job's outcome unless recover_jobs already marked it failed"""
+    return IngestJob.objects.filter(pk=job_id, status="running").update(finished_at=timezone.now(), **fields)
+
+def run_job(job_id: int, path: str):
+    """Parse, embed and publish one spooled upload, recording progress on the job"""
+    close_old_connections()
+    if not _claim(job_id):
+        close_old_connections()
+        return
+    try:
+        with _heartbeat(job_id):
+            job = IngestJob.objects.get(pk=job_id)
+
+            chunks = ingestion.read_chunks(path, job.file_name)
+            IngestJob.objects.filter(pk=job_id).update(total_rows=estimate_rows(path, job.file_name))
+
+            def report(stats):
+                IngestJob.objects.filter(pk=job_id).update(
+                    rows_processed=stats["rows_processed"],
+                    rows_embedded=stats["rows_embedded"],
+                    rows_upserted=stats["rows_upserted"],
+                    heartbeat_at=timezone.now(),
+                )
+
+            stats = ingestion.ingest_new_version(chunks, incremental=(job.mode == "incremental"), progress=report)
+            snapshot = get_snapshot(stats["collection"])
+        # Other workers notice the new version on their next lookup
+        answer_cache.invalidate()
+
+        _finish(
+            job_id,
+            status="succeeded",
+            total_rows=stats["rows_processed"],
+            result={
+                "rows_processed": stats["rows_processed"],
+                "columns": snapshot.table.column_names,
+                "version": stats["version"],
+                "inserted": stats["inserted"],
+                "updated": stats["updated"],
+                "deleted": stats["deleted"],
+                "unchanged": stats["unchanged"],
+                "ingestion": stats,
+            },
+        )
+    except ingestion.UploadError as e:
+        _finish(job_id, status="failed", error=str(e), result=e.details or None)
+    except Exception as e:
+        logger.exception(f"Ingest job {job_id} failed")
+        _finish(job_id, status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        close_old_connections()
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import mmap
+import shutil
+import logging
+import tempfile
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+from django.conf import settings
+from .embeddings import create_chunk
+from .vector_store import clean_payload
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_indexes = {}
+# Marks a version whose index has not been looked up yet (None means it has none)
+_UNLOADED = object()
+_lock = threading.Lock()
+_template_tokens = None
+
+def tokenize(text: str):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def template_tokens():
+    """Words of the create_chunk template itself, which every row shares"""
+    global _template_tokens
+    if _template_tokens is None:
+        _template_tokens = set(tokenize(create_chunk({})))
+    return _template_tokens
+
+def _index_tokens(text: str):
+    stop = template_tokens()
+    return [token for token in tokenize(text) if token not in stop]
+
+def _json_default(value):
+    """Serialise NumPy scalars found in dataframe payloads"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+class BM25Builder:
+    """Accumulates chunk texts during ingestion and writes a BM25 index
+
+    Postings are kept in typed arrays rather than Python lists so building
+    an index over a few hundred thousand rows stays compact. Row payloads,
+    when given, are spooled to a temporary file as JSON lines and stored
+    with the index, so lexical-only hits need no vector store round-trip.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.doc_len = array("i")
+        self.terms = {}
+        self._post_terms = array("i")
+        self._post_docs = array("i")
+        self._post_tfs = array("i")
+        self._payloads = None
+        self._payload_offsets = array("q", [0])
+
+    def add(self, ids: list, texts: list, payloads: list = None):
+        if payloads is not None:
+            if self._payloads is None:
+                os.makedirs(settings.RAG_DATA_DIR, exist_ok=True)
+                self._payloads = tempfile.NamedTemporaryFile(
+                    dir=settings.RAG_DATA_DIR, prefix="lexical-payloads-", suffix=".jsonl", delete=False,
+                )
+            for payload in payloads:
+                line = json.dumps(clean_payload(payload), default=_json_default).encode("utf-8") + b"\n"
+                self._payloads.write(line)
+                self._payload_offsets.append(self._payload_offsets[-1] + len(line))
+        for id, text in zip(ids, texts):
+            doc = len(self.ids)
+            self.ids.append(str(id))
+            tokens = _index_tokens(text)
+            self.doc_len.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self._post_terms.append(self.terms.setdefault(token, len(self.terms)))
+                self._post_docs.append(doc)
+                self._post_tfs.append(tf)
+
+    def save(self, collection_name: str):
+        """Write the index as CSR arrays that are memory-mapped on load"""
+        path = index_path(collection_name)
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        post_terms = np.frombuffer(self._post_terms, dtype=np.int32)
+        order = np.argsort(post_terms, kind="stable")
+        offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(post_terms, minlength=len(self.terms)), out=offsets[1:])
+
+        np.save(os.path.join(tmp, "ids.npy"), np.array(self.ids, dtype=str))
+        np.save(os.path.join(tmp, "doc_len.npy"), np.frombuffer(self.doc_len, dtype=np.int32))
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp, "docs.npy"), np.frombuffer(self._post_docs, dtype=np.int32)[order])
+        np.save(os.path.join(tmp, "tfs.npy"), np.frombuffer(self._post_tfs, dtype=np.int32)[order].astype(np.float32))
+        with open(os.path.join(tmp, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f)
+        if self._payloads is not None and len(self._payload_offsets) == len(self.ids) + 1:
+            self._payloads.close()
+            os.replace(self._payloads.name, os.path.join(tmp, "payloads.jsonl"))
+            np.save(os.path.join(tmp, "payload_offsets.npy"), np.frombuffer(self._payload_offsets, dtype=np.int64))
+            self._payloads = None
+        self.discard()
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        logger.info(f"Saved BM25 index for '{collection_name}': {len(self.ids)} docs, {len(self.terms)} terms")
+
+    def discard(self):
+        """Delete the payload spool file if it was not saved"""
+        if self._payloads is not None:
+            self._payloads.close()
+            os.remove(self._payloads.name)
+            self._payloads = None
+
+class BM25Index:
+    """Read-only BM25 index over memory-mapped postings"""
+
+    def __init__(self, path: str):
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"))
+        self.doc_len = load("doc_len.npy")
+        self.offsets = load("offsets.npy")
+        self.docs = load("docs.npy")
+        self.tfs = load("tfs.npy")
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+            self.terms = json.load(f)
+        self.avg_len = float(self.doc_len.mean()) if len(self.doc_len) else 0.0
+        self._norm = K1 * (1 - B + B * np.asarray(self.doc_len, dtype=np.float32) / max(self.avg_len, 1.0))
+        # Indexes built before payloads were stored have no side file
+        self._payloads = None
+        self._positions = None
+        payloads_path = os.path.join(path, "payloads.jsonl")
+        if os.path.exists(payloads_path) and os.path.getsize(payloads_path):
+            with open(payloads_path, "rb") as f:
+                self._payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._payload_offsets = load("payload_offsets.npy")
+
+    def payloads(self, ids: list):
+        """Return {point_id: payload} for the ids whose payload the index holds"""
+        if self._payloads is None:
+            return {}
+        if self._positions is None:
+            self._positions = {str(id): i for i, id in enumerate(self.ids)}
+        found = {}
+        for id in ids:
+            doc = self._positions.get(str(id))
+            if doc is not None:
+                start, end = self._payload_offsets[doc], self._payload_offsets[doc + 1]
+                found[str(id)] = json.loads(self._payloads[start:end])
+        return found
+
+    def search(self, query: str, top_k: int = 10):
+        """Return [(point_id, score)] for the best matching documents"""
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        matched = False
+        for token in set(_index_tokens(query)):
+            term = self.terms.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end]
+            idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tfs * (K1 + 1) / (tfs + self._norm[docs])
+            matched = True
+        if not matched:
+            return []
+
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(str(self.ids[i]), float(scores[i])) for i in best]
+
+def index_path(collection_name: str):
+    return os.path.join(settings.RAG_DATA_DIR, "lexical", collection_name)
+
+def get_index(collection_name: str):
+    """Return the BM25 index of a collection version, or None if it has none"""
+    index = _indexes.get(collection_name, _UNLOADED)
+    if index is not _UNLOADED:
+        return index
+    path = index_path(collection_name)
+    with _lock:
+        if collection_name not in _indexes:
+            # Only the active version is kept open; older mappings close once unused
+            _indexes.clear()
+            _indexes[collection_name] = BM25Index(path) if os.path.isdir(path) else None
+        return _indexes[collection_name]
+
+def reciprocal_rank_fusion(*rankings, k: int = 60):
+    """Merge ranked id lists into one ordering by summed 1/(k + rank)"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] += 1.0 / (k + rank + 1)
+    return [id for id, _ in scores.most_common()]
@@ -1,37 +1,220 @@
-from .embeddings import generate_embedding
-from .qdrant_client import search_vectors
+from .embeddings import embed_query, embed_query_async
+from .async_clients import bind_gemini_async_client
+from .vector_store import get_store, clean_payload, collection_state
+from .analytics import detect_intent, chart_from_rows
+from .context_builder import build_context, estimate_tokens
+from .filters import extract_filter, get_vocabulary, matches_filter
+from .lexical import get_index, reciprocal_rank_fusion
+from .metrics import stage, timed, record_tokens, registry
+from .deadlines import Deadline, DeadlineExceeded, LatencyTracker, TIMEOUT_ERRORS, is_transient, backoff_delay
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
 import google.generativeai as genai
 import os
+import re
 import json
+import time
+import asyncio
 import logging
+import threading
+import contextvars
 
 logger = logging.getLogger(__name__)
 
+# Runs the dense search while the lexical side is scored in the request thread
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+# Gemini calls run here so a slow one can be hedged, or abandoned at the deadline
+GENERATION_WORKERS = 32
+_generation_pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generate")
+# Calls submitted to the pool and not yet finished (running or queued)
+_generations_in_flight = 0
+_generations_lock = threading.Lock()
+# Hedge calls in flight at once; a running call cannot be interrupted, so a
+# losing hedge keeps its pool slot until it returns
+_hedge_slots = threading.BoundedSemaphore(settings.GENERATION_MAX_HEDGES)
+
+# Durations of recent successful generations; their p95 sets the hedge delay
+generation_latency = LatencyTracker()
+
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-def retrieve_context(query: str, top_k: int = 10):
-    """Retrieve similar vectors from Qdrant"""
-    query_vector = generate_embedding(query)
-    results = search_vectors(query_vector, top_k=top_k)
-    return [point.payload for point in results]
+def _retrieval_plan(query: str, collection_name: str):
+    """Return the payload filter and BM25 index (or None) used for a query"""
+    # Restrict the search to localities/cities/years named in the query
+    vocabulary = get_vocabulary(collection_name)
+    query_filter = extract_filter(query, vocabulary)
+    lexical_index = get_index(collection_name) if settings.RETRIEVAL_MODE == "hybrid" else None
+    return query_filter, lexical_index
+
+def _fuse(results: list, lexical_hits: list, payloads: dict, query_filter: dict, top_k: int):
+    """Merge dense and lexical hits with reciprocal rank fusion"""
+    # Lexical hits are not filtered by Qdrant, so check them here
+    lexical_ids = [id for id, _ in lexical_hits if id in payloads and matches_filter(payloads[id], query_filter)]
+    ranked = reciprocal_rank_fusion([str(point.id) for point in results], lexical_ids, k=settings.RRF_K)
+    return [clean_payload(payloads[id]) for id in ranked[:top_k]]
+
+def _lexical_search(lexical_index, query: str, top_k: int):
+    if lexical_index is None:
+        return []
+    with stage("lexical_search"):
+        return lexical_index.search(query, top_k=top_k)
+
+def _lexical_payloads(lexical_index, ids: list):
+    """Payloads of lexical-only hits from the index side file; returns (payloads, ids it lacks)"""
+    payloads = lexical_index.payloads(ids)
+    return payloads, [id for id in ids if id not in payloads]
+
+def _dense_search(store, query_vector: list, top_k: int, query_filter: dict = None):
+    with stage("vector_search"):
+        return store.search(query_vector, top_k=top_k, query_filter=query_filter)
+
+def _dense_search_batch(store, query_vectors: list, top_k: int, query_filters: list = None):
+    with stage("vector_search"):
+        return store.search_batch(query_vectors, top_k=top_k, query_filters=query_filters)
+
+def _submit_search_batch(store, query_vectors: list, top_k: int, query_filters: list = None):
+    return _search_pool.submit(
+        contextvars.copy_context().run, _dense_search_batch, store, query_vectors, top_k, query_filters,
+    )
+
+def _search_timeout(deadline: Deadline = None):
+    return deadline.budget(settings.SEARCH_TIMEOUT) if deadline is not None else None
+
+def _submit_search(store, query_vector: list, top_k: int, query_filter: dict = None):
+    # Run in the request's context so the search shows up in its Server-Timing
+    return _search_pool.submit(contextvars.copy_context().run, _dense_search, store, query_vector, top_k, query_filter)
+
+def _result(future, timeout: float = None):
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise DeadlineExceeded("Vector search did not finish before the deadline")
+
+@timed("retrieve")
+def retrieve_context(query: str, top_k: int = 10, query_vector: list = None, deadline: Deadline = None):
+    """Retrieve similar vectors from the vector store, fused with BM25 hits in hybrid mode
+
+    With a deadline, the dense search may take at most SEARCH_TIMEOUT or
+    whatever is left of the budget; DeadlineExceeded is raised after that.
+    """
+    if query_vector is None:
+        query_vector = embed_query(query)
 
-def llama_answer(query: str, context_rows: list):
-    """Generate chart-ready JSON response using Gemini"""
+    query_filter, lexical_index = _retrieval_plan(query, collection_state.get()["collection"])
+    store = get_store()
+    dense = _submit_search(store, query_vector, top_k, query_filter)
+    lexical_hits = _lexical_search(lexical_index, query, top_k * 2)
+    results = _result(dense, _search_timeout(deadline))
+    if query_filter and not results:
+        query_filter = None
+        results = _result(_submit_search(store, query_vector, top_k), _search_timeout(deadline))
+
+    payloads = {str(point.id): point.payload for point in results}
+    if not lexical_hits:
+        return [clean_payload(payload) for payload in payloads.values()]
+
+    missing = [id for id, _ in lexical_hits if id not in payloads]
+    if missing:
+        found, missing = _lexical_payloads(lexical_index, missing)
+        payloads.update(found)
+    if missing:
+        payloads.update(store.retrieve_payloads(missing))
+    return _fuse(results, lexical_hits, payloads, query_filter, top_k)
+
+@timed("retrieve")
+async def retrieve_context_async(query: str, top_k: int = 10, query_vector: list = None, deadline: Deadline = None):
+    """retrieve_context for the async request path"""
+    if query_vector is None:
+        query_vector = await embed_query_async(query)
+
+    state = await collection_state.aget()
+    query_filter, lexical_index = _retrieval_plan(query, state["collection"])
+    store = get_store()
+    # BM25 scoring takes well under a millisecond, so it runs inline
+    lexical_hits = _lexical_search(lexical_index, query, top_k * 2)
+    try:
+        with stage("vector_search"):
+            results = await asyncio.wait_for(
+                store.search_async(query_vector, top_k=top_k, query_filter=query_filter), _search_timeout(deadline),
+            )
+            if query_filter and not results:
+                query_filter = None
+                results = await asyncio.wait_for(store.search_async(query_vector, top_k=top_k), _search_timeout(deadline))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Vector search did not finish before the deadline")
+
+    payloads = {str(point.id): point.payload for point in results}
+    if not lexical_hits:
+        return [clean_payload(payload) for payload in payloads.values()]
+
+    missing = [id for id, _ in lexical_hits if id not in payloads]
+    if missing:
+        found, missing = _lexical_payloads(lexical_index, missing)
+        payloads.update(found)
+    if missing:
+        payloads.update(await store.retrieve_payloads_async(missing))
+    return _fuse(results, lexical_hits, payloads, query_filter, top_k)
+
+@timed("retrieve")
+def retrieve_contexts(queries: list, query_vectors: list, top_k: int = 10, deadline: Deadline = None):
+    """retrieve_context for many queries, with one batched dense search
+
+    Queries whose filtered search finds nothing are searched again
+    unfiltered in a second batch, and the payloads of lexical hits missing
+    from the dense results are fetched in one call. A deadline bounds each
+    batched search as in retrieve_context.
+    """
+    collection_name = collection_state.get()["collection"]
+    plans = [_retrieval_plan(query, collection_name) for query in queries]
+    query_filters = [query_filter for query_filter, _ in plans]
+    store = get_store()
+    results = _result(_submit_search_batch(store, query_vectors, top_k, query_filters), _search_timeout(deadline))
+    empty = [i for i, hits in enumerate(results) if query_filters[i] and not hits]
+    if empty:
+        retried = _result(_submit_search_batch(store, [query_vectors[i] for i in empty], top_k), _search_timeout(deadline))
+        for i, hits in zip(empty, retried):
+            results[i], query_filters[i] = hits, None
+
+    lexical = [_lexical_search(lexical_index, query, top_k * 2) for query, (_, lexical_index) in zip(queries, plans)]
+    payloads = [{str(point.id): point.payload for point in hits} for hits in results]
+    missing = list({id for lexical_hits, found in zip(lexical, payloads) for id, _ in lexical_hits if id not in found})
+    fetched = {}
+    if missing:
+        # Every plan shares the active collection's index
+        fetched, missing = _lexical_payloads(next(index for _, index in plans if index is not None), missing)
+    if missing:
+        fetched.update(store.retrieve_payloads(missing))
+
+    contexts = []
+    for hits, lexical_hits, found, query_filter in zip(results, lexical, payloads, query_filters):
+        if not lexical_hits:
+            contexts.append([clean_payload(payload) for payload in found.values()])
+            continue
+        found.update({id: fetched[id] for id, _ in lexical_hits if id not in found and id in fetched})
+        contexts.append(_fuse(hits, lexical_hits, found, query_filter, top_k))
+    return contexts
+
+def build_prompt(query: str, context_rows: list):
+    """Build the chart-JSON prompt; returns (prompt, chart type suggested by the query intent)"""
     
     # Detect query intent
-    query_lower = query.lower()
-    is_comparison = any(word in query_lower for word in ['compare', 'vs', 'versus', 'between', 'difference', 'across'])
-    is_trend = any(word in query_lower for word in ['trend', 'over time', 'yearly', 'year', 'growth', 'change', 'last', 'years', 'over'])
-    has_total = any(word in query_lower for word in ['total', 'sum', 'aggregate', 'highest', 'top', 'which', 'best', 'worst'])
+    intent = detect_intent(query)
+    is_comparison = intent["is_comparison"]
+    is_trend = intent["is_trend"]
+    has_total = intent["has_total"]
     
     logger.info(f"Query: {query}")
     logger.info(f"Detected - Comparison: {is_comparison}, Trend: {is_trend}, Total: {has_total}")
     
     # Format context data
-    context_text = "\n\n".join([
-        f"Record {i+1}:\n" + "\n".join([f"  {k}: {v}" for k, v in row.items() if v is not None])
-        for i, row in enumerate(context_rows[:15])
-    ])
+    if settings.PROMPT_CONTEXT_FORMAT == "records":
+        context_text = "\n\n".join([
+            f"Record {i+1}:\n" + "\n".join([f"  {k}: {v}" for k, v in row.items() if v is not None])
+            for i, row in enumerate(context_rows[:settings.PROMPT_MAX_ROWS])
+        ])
+    else:
+        context_text = build_context(query, context_rows).text
     
     # Determine chart type with better logic
     if is_trend:
@@ -185,81 +368,437 @@ CRITICAL RULES FOR CHART DATA:
 
 Return ONLY the JSON object. NO markdown, NO code blocks, NO explanations."""
 
-    model = genai.GenerativeModel('gemini-2.0-flash')
+    return prompt, chart_hint
+
+def _generation_config():
+    return genai.types.GenerationConfig(
+        temperature=0.1,  # Lower for more consistent structure
+        top_p=0.8,
+    )
+
+def strip_code_fence(result: str):
+    """Remove markdown code fences around a JSON response"""
+    result = result.strip()
+    if result.startswith("```json"):
+        result = result.replace("```json", "").replace("```", "").strip()
+    elif result.startswith("```"):
+        result = result.replace("```", "").strip()
+    return result
+
+def validate_chart(chart, chart_hint: str, context_rows: list):
+    """Fill in and repair the chart object of an LLM answer"""
+    if not chart:
+        chart = {"type": chart_hint, "data": []}
     
-    try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.1,  # Lower for more consistent structure
-                top_p=0.8,
-            )
-        )
-        
-        result = response.text.strip()
+    # Ensure chart type is valid
+    if chart.get("type") not in ["bar", "line"]:
+        logger.warning(f"Invalid chart type: {chart.get('type')}, using {chart_hint}")
+        chart["type"] = chart_hint
+    
+    # Validate chart data structure
+    chart_data = chart.get("data", [])
+    if chart_data:
+        first_row = chart_data[0]
         
-        # Clean markdown formatting
-        if result.startswith("```json"):
-            result = result.replace("```json", "").replace("```", "").strip()
-        elif result.startswith("```"):
-            result = result.replace("```", "").strip()
+        # Check for invalid structures
+        if "label" in first_row or "metric" in first_row:
+            logger.warning("Detected wrong structure with 'label'/'metric', attempting fix")
+            chart["data"] = restructure_chart_data(chart_data, context_rows)
         
+        # Validate all rows have same keys
+        if len(chart_data) > 1:
+            first_keys = set(first_row.keys())
+            for i, row in enumerate(chart_data[1:], 1):
+                if set(row.keys()) != first_keys:
+                    logger.warning(f"Inconsistent keys at row {i}: {row.keys()} vs {first_keys}")
+    return chart
+
+def validate_answer(parsed_result: dict, chart_hint: str, context_rows: list):
+    """Fill in missing fields of a parsed LLM answer and repair its chart"""
+    # Log the result for debugging
+    logger.info(f"LLM Response - Chart Type: {parsed_result.get('chart', {}).get('type')}")
+    logger.info(f"Chart Data Sample: {parsed_result.get('chart', {}).get('data', [])[:2]}")
+    
+    # Validate and fix structure
+    if "summary" not in parsed_result:
+        parsed_result["summary"] = "Analysis complete."
+    
+    parsed_result["chart"] = validate_chart(parsed_result.get("chart"), chart_hint, context_rows)
+    
+    if "table" not in parsed_result or not parsed_result["table"]:
+        parsed_result["table"] = context_rows[:10]
+    
+    return parsed_result
+
+def fallback_answer(summary: str, chart_hint: str, context_rows: list):
+    return {
+        "summary": summary,
+        "chart": {"type": chart_hint, "data": []},
+        "table": context_rows[:10]
+    }
+
+PARSE_ERROR_SUMMARY = "Could not parse analysis. The AI response was not in valid JSON format. Please try rephrasing your query."
+
+def _record_usage(prompt: str, response):
+    """Record prompt/completion token counts, estimating the prompt when usage is missing"""
+    usage = getattr(response, "usage_metadata", None)
+    record_tokens("prompt", getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt))
+    completion_tokens = getattr(usage, "candidates_token_count", 0)
+    if completion_tokens:
+        record_tokens("completion", completion_tokens)
+
+@timed("parse")
+def _parse_answer(text: str, chart_hint: str, context_rows: list):
+    result = strip_code_fence(text)
+    try:
         # Parse JSON
         parsed_result = json.loads(result)
-        
-        # Log the result for debugging
-        logger.info(f"LLM Response - Chart Type: {parsed_result.get('chart', {}).get('type')}")
-        logger.info(f"Chart Data Sample: {parsed_result.get('chart', {}).get('data', [])[:2]}")
-        
-        # Validate and fix structure
-        if "summary" not in parsed_result:
-            parsed_result["summary"] = "Analysis complete."
-        
-        if "chart" not in parsed_result or not parsed_result["chart"]:
-            parsed_result["chart"] = {"type": chart_hint, "data": []}
-        
-        # Ensure chart type is valid
-        if parsed_result["chart"].get("type") not in ["bar", "line"]:
-            logger.warning(f"Invalid chart type: {parsed_result['chart'].get('type')}, using {chart_hint}")
-            parsed_result["chart"]["type"] = chart_hint
-        
-        if "table" not in parsed_result or not parsed_result["table"]:
-            parsed_result["table"] = context_rows[:10]
-        
-        # Validate chart data structure
-        chart_data = parsed_result.get("chart", {}).get("data", [])
-        if chart_data:
-            first_row = chart_data[0]
-            
-            # Check for invalid structures
-            if "label" in first_row or "metric" in first_row:
-                logger.warning("Detected wrong structure with 'label'/'metric', attempting fix")
-                parsed_result["chart"]["data"] = restructure_chart_data(chart_data, context_rows)
-            
-            # Validate all rows have same keys
-            if len(chart_data) > 1:
-                first_keys = set(first_row.keys())
-                for i, row in enumerate(chart_data[1:], 1):
-                    if set(row.keys()) != first_keys:
-                        logger.warning(f"Inconsistent keys at row {i}: {row.keys()} vs {first_keys}")
-        
-        return parsed_result
-        
     except json.JSONDecodeError as e:
         logger.error(f"JSON parsing error: {str(e)}")
         logger.error(f"Raw response: {result[:500]}")
-        return {
-            "summary": "Could not parse analysis. The AI response was not in valid JSON format. Please try rephrasing your query.",
-            "chart": {"type": chart_hint, "data": []},
-            "table": context_rows[:10]
-        }
+        return fallback_answer(PARSE_ERROR_SUMMARY, chart_hint, context_rows)
+    return validate_answer(parsed_result, chart_hint, context_rows)
+
+DEGRADED_TIMEOUT_SUMMARY = "The AI analysis did not finish in time, so this answer was computed directly from the most relevant records."
+DEGRADED_ERROR_SUMMARY = "The AI analysis is unavailable right now, so this answer was computed directly from the most relevant records."
+
+def degraded_answer(query: str, context_rows: list, timed_out: bool = True):
+    """Answer built from the retrieved rows alone: their table plus a computed chart"""
+    chart, summary = chart_from_rows(query, context_rows)
+    notice = DEGRADED_TIMEOUT_SUMMARY if timed_out else DEGRADED_ERROR_SUMMARY
+    registry.increment("rag_degraded_answers_total", help="Answers served without the LLM",
+                       reason="deadline" if timed_out else "error")
+    return {
+        "summary": f"{notice} {summary}" if summary else notice,
+        "chart": chart,
+        "table": context_rows[:10],
+        "degraded": True,
+    }
+
+def _hedge_delay():
+    return generation_latency.quantile(settings.GENERATION_HEDGE_QUANTILE, settings.GENERATION_HEDGE_DELAY)
+
+def _generate_once(model, prompt: str, deadline: Deadline):
+    # The timeout is what is left when the call starts, not when it was
+    # queued; a call whose deadline passed in the queue is not sent at all
+    timeout = deadline.budget()
+    start = time.perf_counter()
+    response = model.generate_content(
+        prompt, generation_config=_generation_config(), request_options={"timeout": timeout},
+    )
+    generation_latency.add(time.perf_counter() - start)
+    return response
+
+def _generation_done(call):
+    global _generations_in_flight
+    with _generations_lock:
+        _generations_in_flight -= 1
+
+def _submit_generation(model, prompt: str, deadline: Deadline):
+    global _generations_in_flight
+    with _generations_lock:
+        _generations_in_flight += 1
+    call = _generation_pool.submit(_generate_once, model, prompt, deadline)
+    call.add_done_callback(_generation_done)
+    return call
+
+def _reserve_hedge(saturated: bool = False):
+    """Take a hedge slot, or count the hedge as skipped when none is free"""
+    if not saturated and _hedge_slots.acquire(blocking=False):
+        registry.increment("rag_generation_hedges_total", help="Duplicate generation requests sent")
+        return True
+    registry.increment("rag_generation_hedges_skipped_total",
+                       help="Hedges not sent because too many were in flight or the pool was busy")
+    return False
+
+def _generate_hedged(model, prompt: str, deadline: Deadline):
+    """One generate_content call, plus a duplicate if it runs past the hedge delay
+
+    Whichever call succeeds first wins. Calls still queued at that point are
+    cancelled; a running loser finishes in the background. No duplicate is
+    sent when GENERATION_MAX_HEDGES are in flight or every pool worker is
+    busy, so hedges never queue ahead of first attempts.
+    """
+    calls = {_submit_generation(model, prompt, deadline)}
+    try:
+        if settings.GENERATION_HEDGING_ENABLED:
+            done, _ = wait(calls, timeout=min(_hedge_delay(), deadline.budget()))
+            if not done and deadline.remaining() > 0 and _reserve_hedge(_generations_in_flight >= GENERATION_WORKERS):
+                hedge = _submit_generation(model, prompt, deadline)
+                hedge.add_done_callback(lambda call: _hedge_slots.release())
+                calls.add(hedge)
+
+        error = None
+        while calls:
+            done, calls = wait(calls, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Generation did not finish before the deadline")
+            for call in done:
+                if call.exception() is None:
+                    return call.result()
+                error = call.exception()
+        raise error
+    finally:
+        for call in calls:
+            call.cancel()
+
+def _generate(model, prompt: str, deadline: Deadline):
+    """Hedged generate_content, retried with jittered backoff on transient errors"""
+    for attempt in range(settings.GENERATION_MAX_RETRIES + 1):
+        try:
+            return _generate_hedged(model, prompt, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if attempt == settings.GENERATION_MAX_RETRIES or not is_transient(e):
+                raise
+            delay = backoff_delay(attempt, settings.GENERATION_RETRY_BACKOFF)
+            if delay >= deadline.remaining():
+                raise DeadlineExceeded("No time left to retry generation") from e
+            logger.warning(f"Generation failed ({e}), retrying in {delay:.2f}s")
+            registry.increment("rag_generation_retries_total", help="Generation retries after transient errors")
+            time.sleep(delay)
+
+def llama_answer(query: str, context_rows: list, deadline: Deadline = None):
+    """Generate chart-ready JSON response using Gemini
+
+    Generation gets whatever is left of the deadline (QUERY_DEADLINE from
+    now when none is given); when it runs out, or Gemini keeps failing, a
+    degraded answer is built from context_rows instead.
+    """
+    deadline = deadline or Deadline(settings.QUERY_DEADLINE)
+    with stage("prompt"):
+        prompt, chart_hint = build_prompt(query, context_rows)
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    
+    try:
+        with stage("generate"):
+            response = _generate(model, prompt, deadline)
+        _record_usage(prompt, response)
+        return _parse_answer(response.text, chart_hint, context_rows)
+    except DeadlineExceeded as e:
+        logger.warning(f"Returning a degraded answer for '{query}': {e}")
+        return degraded_answer(query, context_rows)
     except Exception as e:
         logger.error(f"Error in llama_answer: {str(e)}")
-        return {
-            "summary": f"An error occurred: {str(e)}",
-            "chart": {"type": chart_hint, "data": []},
-            "table": context_rows[:10]
-        }
+        return degraded_answer(query, context_rows, timed_out=False)
+
+async def _generate_once_async(model, prompt: str, deadline: Deadline):
+    timeout = deadline.budget()
+    start = time.perf_counter()
+    response = await model.generate_content_async(
+        prompt, generation_config=_generation_config(), request_options={"timeout": timeout},
+    )
+    generation_latency.add(time.perf_counter() - start)
+    return response
+
+async def _generate_hedged_async(model, prompt: str, deadline: Deadline):
+    """_generate_hedged for the async path; the losing call is cancelled"""
+    calls = {asyncio.ensure_future(_generate_once_async(model, prompt, deadline))}
+    try:
+        if settings.GENERATION_HEDGING_ENABLED:
+            done, _ = await asyncio.wait(calls, timeout=min(_hedge_delay(), deadline.budget()))
+            if not done and deadline.remaining() > 0 and _reserve_hedge():
+                hedge = asyncio.ensure_future(_generate_once_async(model, prompt, deadline))
+                hedge.add_done_callback(lambda call: _hedge_slots.release())
+                calls.add(hedge)
+
+        error = None
+        while calls:
+            done, calls = await asyncio.wait(calls, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Generation did not finish before the deadline")
+            for call in done:
+                if call.exception() is None:
+                    return call.result()
+                error = call.exception()
+        raise error
+    finally:
+        for call in calls:
+            call.cancel()
+
+async def _generate_async(model, prompt: str, deadline: Deadline):
+    """_generate for the async path"""
+    for attempt in range(settings.GENERATION_MAX_RETRIES + 1):
+        try:
+            return await _generate_hedged_async(model, prompt, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if attempt == settings.GENERATION_MAX_RETRIES or not is_transient(e):
+                raise
+            delay = backoff_delay(attempt, settings.GENERATION_RETRY_BACKOFF)
+            if delay >= deadline.remaining():
+                raise DeadlineExceeded("No time left to retry generation") from e
+            logger.warning(f"Generation failed ({e}), retrying in {delay:.2f}s")
+            registry.increment("rag_generation_retries_total", help="Generation retries after transient errors")
+            await asyncio.sleep(delay)
+
+async def llama_answer_async(query: str, context_rows: list, deadline: Deadline = None):
+    """llama_answer for the async request path"""
+    deadline = deadline or Deadline(settings.QUERY_DEADLINE)
+    with stage("prompt"):
+        prompt, chart_hint = build_prompt(query, context_rows)
+    # Use the event loop's pooled client instead of genai's process-wide one
+    model = bind_gemini_async_client(genai.GenerativeModel('gemini-2.0-flash'))
+    
+    try:
+        with stage("generate"):
+            response = await _generate_async(model, prompt, deadline)
+        _record_usage(prompt, response)
+        return _parse_answer(response.text, chart_hint, context_rows)
+    except DeadlineExceeded as e:
+        logger.warning(f"Returning a degraded answer for '{query}': {e}")
+        return degraded_answer(query, context_rows)
+    except Exception as e:
+        logger.error(f"Error in llama_answer_async: {str(e)}")
+        return degraded_answer(query, context_rows, timed_out=False)
+
+class AnswerStreamParser:
+    """Pulls the summary and chart out of a partially streamed answer JSON
+
+    feed() returns the summary characters decoded since the previous call.
+    The chart object becomes available as soon as its closing brace has
+    arrived, before the rest of the answer (usually the table) is streamed.
+    """
+
+    SUMMARY_START = re.compile(r'"summary"\s*:\s*"')
+    CHART_START = re.compile(r'"chart"\s*:\s*(?=\{)')
+
+    def __init__(self):
+        self.buffer = ""
+        self.summary = ""
+        self.summary_done = False
+        self.chart = None
+        self._summary_start = None
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text: str):
+        self.buffer += text
+        if self.chart is None:
+            self._read_chart()
+        return self._read_summary()
+
+    def _read_summary(self):
+        if self.summary_done:
+            return ""
+        if self._summary_start is None:
+            match = self.SUMMARY_START.search(self.buffer)
+            if not match:
+                return ""
+            self._summary_start = match.end()
+
+        # Find the longest prefix that ends on a complete character/escape
+        raw = self.buffer[self._summary_start:]
+        i = complete = 0
+        closed = False
+        while i < len(raw):
+            if raw[i] == "\\":
+                step = 6 if raw[i + 1:i + 2] == "u" else 2
+                if i + step > len(raw):
+                    break
+                i += step
+            elif raw[i] == '"':
+                closed = True
+                break
+            else:
+                i += 1
+            complete = i
+        try:
+            decoded = json.loads(f'"{raw[:complete]}"')
+        except ValueError:
+            return ""
+        if not closed and decoded and "\ud800" <= decoded[-1] <= "\udbff":
+            # Wait for the low half of a surrogate pair
+            decoded = decoded[:-1]
+
+        delta = decoded[len(self.summary):]
+        self.summary = decoded
+        self.summary_done = closed
+        return delta
+
+    def _read_chart(self):
+        match = self.CHART_START.search(self.buffer)
+        if not match:
+            return
+        try:
+            chart, _ = self._decoder.raw_decode(self.buffer, match.end())
+        except json.JSONDecodeError:
+            return  # Not complete yet
+        self.chart = chart
+
+def stream_answer(query: str, context_rows: list, deadline: Deadline = None):
+    """Stream a Gemini answer as (event, data) pairs
+
+    Yields ("summary", text) deltas while the response is generated, the
+    validated ("chart", chart) as soon as it has been received, and finally
+    ("done", answer) with the same dict llama_answer would have returned.
+    If the deadline passes first, ("degraded", answer) replaces whatever was
+    streamed with degraded_answer's summary and chart before "done".
+    """
+    deadline = deadline or Deadline(settings.QUERY_DEADLINE)
+    with stage("prompt"):
+        prompt, chart_hint = build_prompt(query, context_rows)
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    parser = AnswerStreamParser()
+    chart_sent = False
+    
+    try:
+        response = model.generate_content(
+            prompt, generation_config=_generation_config(), stream=True,
+            request_options={"timeout": deadline.budget()},
+        )
+        for chunk in response:
+            if deadline.remaining() <= 0:
+                raise DeadlineExceeded("Generation did not finish before the deadline")
+            delta = parser.feed(chunk.text)
+            if delta:
+                yield "summary", delta
+            if parser.chart is not None and not chart_sent:
+                chart_sent = True
+                yield "chart", validate_chart(parser.chart, chart_hint, context_rows)
+        
+        _record_usage(prompt, response)
+        result = validate_answer(json.loads(strip_code_fence(parser.buffer)), chart_hint, context_rows)
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parsing error: {str(e)}")
+        logger.error(f"Raw response: {parser.buffer[:500]}")
+        result = fallback_answer(PARSE_ERROR_SUMMARY, chart_hint, context_rows)
+    except TIMEOUT_ERRORS as e:
+        logger.warning(f"Returning a degraded answer for '{query}': {e}")
+        result = degraded_answer(query, context_rows)
+        yield "degraded", {"summary": result["summary"], "chart": result["chart"]}
+        yield "done", result
+        return
+    except Exception as e:
+        logger.error(f"Error in stream_answer: {str(e)}")
+        result = fallback_answer(f"An error occurred: {str(e)}", chart_hint, context_rows)
+    
+    # Summaries that were not streamed (fallbacks, defaults) are sent whole
+    if not parser.summary:
+        yield "summary", result["summary"]
+    if not chart_sent:
+        yield "chart", result["chart"]
+    yield "done", result
+
+def summarize_chart(chart: dict, fallback: str):
+    """Ask Gemini for a short prose summary of already-computed chart data"""
+    prompt = f"""You are a real estate data analyst. Write a 2-3 sentence summary of this {chart['type']} chart data.
+Use the exact numbers given, highlight the key insight, and do not invent figures.
+
+{json.dumps(chart['data'][:50])}
+
+Return only the summary text."""
+    try:
+        model = genai.GenerativeModel('gemini-2.0-flash')
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(temperature=0.1, max_output_tokens=200)
+        )
+        return response.text.strip() or fallback
+    except Exception as e:
+        logger.error(f"Error in summarize_chart: {str(e)}")
+        return fallback
 
 def restructure_chart_data(wrong_data, context_rows):
     """Fix wrong chart data structure when LLM returns label/metric format"""
@@ -0,0 +1,410 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import uuid
+import numpy as np
+from django.conf import settings
+from .locks import file_lock
+from .vector_store import VectorStore, SearchHit, COLLECTION_NAME, EMBEDDING_DIM
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per matrix-vector product during search
+SEARCH_BLOCK_ROWS = 65536
+
+ACTIVE_FILE = "ACTIVE"
+
+# Written with every compaction; readers reload a collection when it changes
+VERSION_FILE = "VERSION"
+
+class LocalCollection:
+    """Read-only view of a compacted collection directory
+
+    vectors.npy holds L2-normalised rows and is memory-mapped, so every
+    worker process shares the same page cache. Payloads are stored
+    column-wise in payloads.json.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = [str(id) for id in np.load(os.path.join(path, "ids.npy"))]
+        self.positions = {id: i for i, id in enumerate(self.ids)}
+        with open(os.path.join(path, "payloads.json"), encoding="utf-8") as f:
+            self.columns = json.load(f)
+        self._filter_columns = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def payload(self, position: int):
+        return {name: values[position] for name, values in self.columns.items()}
+
+    def _column(self, name: str):
+        if name not in self._filter_columns:
+            self._filter_columns[name] = np.array(self.columns.get(name, [None] * len(self)), dtype=object)
+        return self._filter_columns[name]
+
+    def mask(self, spec: dict):
+        """Boolean row mask for a filter spec, or None for no filter"""
+        if not spec:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        for field_name, values in spec.items():
+            column = self._column(field_name)
+            if field_name == "year":
+                years = np.array([v if isinstance(v, (int, float)) else np.nan for v in column], dtype=float)
+                mask &= (years >= values[0]) & (years <= values[1])
+            else:
+                mask &= np.isin(column, list(values))
+        return mask
+
+    def search(self, query_vector: list, top_k: int, spec: dict = None):
+        """Exact cosine top-k via blocked matrix-vector products and argpartition"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        mask = self.mask(spec)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = block @ query
+            if mask is not None:
+                scores = np.where(mask[start:start + len(block)], scores, -np.inf)
+            if len(scores) > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+            else:
+                keep = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, keep + start])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+
+        order = np.argsort(-best_scores)[:top_k]
+        return [
+            SearchHit(self.ids[row], float(score), self.payload(row))
+            for row, score in zip(best_rows[order], best_scores[order])
+            if np.isfinite(score)
+        ]
+
+    def search_batch(self, query_vectors: list, top_k: int, specs: list = None):
+        """search() for many queries, scoring each block against all of them in one matrix product"""
+        if not query_vectors:
+            return []
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        # Queries with the same filter share one mask
+        by_spec = {}
+        masks = [
+            by_spec.setdefault(json.dumps(spec, sort_keys=True, default=list), self.mask(spec)) if spec else None
+            for spec in (specs or [None] * len(queries))
+        ]
+        filtered = any(mask is not None for mask in masks)
+
+        best_rows = np.empty((0, len(queries)), dtype=np.int64)
+        best_scores = np.empty((0, len(queries)), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = block @ queries.T
+            if filtered:
+                block_mask = np.column_stack([
+                    mask[start:start + len(block)] if mask is not None else np.ones(len(block), dtype=bool)
+                    for mask in masks
+                ])
+                scores = np.where(block_mask, scores, -np.inf)
+            if len(block) > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+            else:
+                keep = np.repeat(np.arange(len(block))[:, None], len(queries), axis=1)
+            best_rows = np.concatenate([best_rows, keep + start])
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, keep, axis=0)])
+
+        order = np.argsort(-best_scores, axis=0)[:top_k]
+        rows = np.take_along_axis(best_rows, order, axis=0)
+        scores = np.take_along_axis(best_scores, order, axis=0)
+        return [
+            [
+                SearchHit(self.ids[row], float(score), self.payload(row))
+                for row, score in zip(rows[:, column], scores[:, column])
+                if np.isfinite(score)
+            ]
+            for column in range(len(queries))
+        ]
+
+class LocalStore(VectorStore):
+    """In-process vector index on memory-mapped NumPy files
+
+    Each collection is a directory under `root`. Writes go to an append-only
+    log (vectors.bin, rows.jsonl, deleted.jsonl) that is compacted into
+    vectors.npy/ids.npy/payloads.json before the collection is read. The
+    ACTIVE file names the collection readers use and is replaced
+    atomically.
+
+    Worker processes share the directory: appends and compaction hold an
+    exclusive lock on `<collection>.lock`, and readers hold it shared while
+    they open a collection, so nobody sees it halfway through a swap.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.dtype = np.dtype(settings.LOCAL_VECTOR_DTYPE)
+        os.makedirs(self.root, exist_ok=True)
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _path(self, collection_name: str):
+        return os.path.join(self.root, collection_name)
+
+    def _file_lock(self, collection_name: str, shared: bool = False):
+        return file_lock(os.path.join(self.root, f"{collection_name}.lock"), shared=shared)
+
+    def list_collections(self):
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(self._path(name)) and not name.endswith((".tmp", ".old"))
+        )
+
+    def get_active_collection(self):
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return name if name and os.path.isdir(self._path(name)) else None
+
+    def create_collection(self, collection_name: str):
+        os.makedirs(self._path(collection_name))
+
+    def drop_collection(self, collection_name: str):
+        with self._lock:
+            self._collections.pop(collection_name, None)
+        with self._file_lock(collection_name):
+            shutil.rmtree(self._path(collection_name), ignore_errors=True)
+
+    def point_alias(self, collection_name: str):
+        self._compact(collection_name)
+        tmp = os.path.join(self.root, f"{ACTIVE_FILE}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(collection_name)
+        os.replace(tmp, os.path.join(self.root, ACTIVE_FILE))
+
+    def count(self, collection_name: str):
+        return len(self._open(collection_name))
+
+    def copy_points(self, source: str, target: str):
+        self._compact(source)
+        with self._file_lock(source, shared=True), self._file_lock(target):
+            for name in ("vectors.npy", "ids.npy", "payloads.json"):
+                shutil.copyfile(os.path.join(self._path(source), name), os.path.join(self._path(target), name))
+            _write_version(self._path(target))
+        return self.count(target)
+
+    def add_vectors(self, ids: list, vectors: list, payloads: list, collection_name: str = COLLECTION_NAME):
+        path = self._path(collection_name)
+        block = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        dim = self._dim(path)
+        if block.shape[1] != dim:
+            raise ValueError(f"Expected {dim}-dimensional vectors for '{collection_name}', got {block.shape[1]}")
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        block = (block / np.where(norms == 0, 1, norms)).astype(self.dtype)
+        rows = "".join(
+            json.dumps({"id": str(id), "payload": payload}, default=_json_default) + "\n"
+            for id, payload in zip(ids, payloads)
+        )
+        # Vectors and rows must land together, never split by a compaction
+        with self._file_lock(collection_name):
+            with open(os.path.join(path, "vectors.bin"), "ab") as f:
+                f.write(block.tobytes())
+            with open(os.path.join(path, "rows.jsonl"), "a", encoding="utf-8") as f:
+                f.write(rows)
+
+    def _dim(self, path: str):
+        """Vector size of a collection: its compacted matrix's, else EMBEDDING_DIM"""
+        try:
+            return np.load(os.path.join(path, "vectors.npy"), mmap_mode="r").shape[1]
+        except FileNotFoundError:
+            return EMBEDDING_DIM
+
+    def delete_vectors(self, ids: list, collection_name: str = COLLECTION_NAME):
+        with self._file_lock(collection_name):
+            with open(os.path.join(self._path(collection_name), "deleted.jsonl"), "a", encoding="utf-8") as f:
+                for id in ids:
+                    f.write(json.dumps(str(id)) + "\n")
+
+    def fetch_content_hashes(self, collection_name: str = COLLECTION_NAME):
+        collection = self._open(collection_name)
+        hashes = collection.columns.get("_content_hash", [None] * len(collection))
+        return dict(zip(collection.ids, hashes))
+
+    def search(self, query_vector: list, top_k: int = 5, query_filter: dict = None):
+        active = self.get_active_collection()
+        if active is None:
+            return []
+        return self._open(active).search(query_vector, top_k, query_filter)
+
+    def search_batch(self, query_vectors: list, top_k: int = 5, query_filters: list = None):
+        active = self.get_active_collection()
+        if active is None:
+            return [[] for _ in query_vectors]
+        return self._open(active).search_batch(query_vectors, top_k, query_filters)
+
+    def retrieve_payloads(self, ids: list):
+        active = self.get_active_collection()
+        if active is None:
+            return {}
+        collection = self._open(active)
+        return {
+            str(id): collection.payload(collection.positions[str(id)])
+            for id in ids if str(id) in collection.positions
+        }
+
+    def _open(self, collection_name: str):
+        """Return the compacted collection, reloading it when its version marker changes"""
+        self._compact(collection_name)
+        path = self._path(collection_name)
+        with self._file_lock(collection_name, shared=True):
+            version = _read_version(path)
+            with self._lock:
+                cached = self._collections.get(collection_name)
+            if cached is None or cached[0] != version:
+                # Memory maps stay valid after a later compaction swaps the directory
+                cached = (version, LocalCollection(path))
+                with self._lock:
+                    self._collections[collection_name] = cached
+        return cached[1]
+
+    def _needs_compaction(self, path: str):
+        return not os.path.exists(os.path.join(path, "vectors.npy")) \
+            or os.path.exists(os.path.join(path, "rows.jsonl")) \
+            or os.path.exists(os.path.join(path, "deleted.jsonl"))
+
+    def _compact(self, collection_name: str):
+        """Merge the write log into the compacted files (last write per ID wins)"""
+        path = self._path(collection_name)
+        if not self._needs_compaction(path):
+            return
+        with self._file_lock(collection_name):
+            # Another worker may have compacted while this one waited
+            if self._needs_compaction(path):
+                self._compact_locked(collection_name)
+
+    def _compact_locked(self, collection_name: str):
+        path = self._path(collection_name)
+        rows_path = os.path.join(path, "rows.jsonl")
+        deleted_path = os.path.join(path, "deleted.jsonl")
+        has_base = os.path.exists(os.path.join(path, "vectors.npy"))
+
+        # (source, row) per surviving ID; source 0 is the base, 1 is the log
+        order = {}
+        base_ids = []
+        base_columns = {}
+        if has_base:
+            base_ids = [str(id) for id in np.load(os.path.join(path, "ids.npy"))]
+            with open(os.path.join(path, "payloads.json"), encoding="utf-8") as f:
+                base_columns = json.load(f)
+            for row, id in enumerate(base_ids):
+                order[id] = (0, row)
+
+        log_payloads = []
+        if os.path.exists(rows_path):
+            with open(rows_path, encoding="utf-8") as f:
+                for row, line in enumerate(f):
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final line from a writer that died mid-append
+                        logger.warning(f"Ignoring incomplete row {row} in the write log of '{collection_name}'")
+                        break
+                    order.pop(entry["id"], None)
+                    order[entry["id"]] = (1, row)
+                    log_payloads.append(entry["payload"])
+        if os.path.exists(deleted_path):
+            with open(deleted_path, encoding="utf-8") as f:
+                for line in f:
+                    order.pop(json.loads(line), None)
+
+        dim = self._dim(path)
+        base_vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r") if has_base else None
+        log_vectors = None
+        if log_payloads:
+            log_vectors = np.memmap(os.path.join(path, "vectors.bin"), dtype=self.dtype, mode="r")
+            complete = log_vectors.size // dim
+            if complete < len(log_payloads):
+                # Vectors are appended before their rows, so this is not a torn write
+                raise ValueError(
+                    f"Write log of '{collection_name}' has {len(log_payloads)} rows but only {complete} "
+                    f"vectors of dimension {dim}; it was written with a different EMBEDDING_DIM"
+                )
+            if log_vectors.size != len(log_payloads) * dim:
+                logger.warning(f"Ignoring vectors without rows at the end of the write log of '{collection_name}'")
+            log_vectors = log_vectors[:len(log_payloads) * dim].reshape(len(log_payloads), dim)
+
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        ids = list(order)
+        if ids:
+            out = np.lib.format.open_memmap(
+                os.path.join(tmp, "vectors.npy"), mode="w+", dtype=self.dtype, shape=(len(ids), dim)
+            )
+        else:
+            # An empty file cannot be memory-mapped for writing
+            out = None
+            np.save(os.path.join(tmp, "vectors.npy"), np.empty((0, dim), dtype=self.dtype))
+        columns = {name: [] for name in base_columns}
+        for i, id in enumerate(ids):
+            source, row = order[id]
+            if source == 0:
+                out[i] = base_vectors[row]
+                payload = {name: values[row] for name, values in base_columns.items()}
+            else:
+                out[i] = log_vectors[row]
+                payload = log_payloads[row]
+            for name in payload:
+                if name not in columns:
+                    columns[name] = [None] * i
+            for name, values in columns.items():
+                values.append(payload.get(name))
+        if out is not None:
+            out.flush()
+        del out, base_vectors, log_vectors
+
+        np.save(os.path.join(tmp, "ids.npy"), np.array(ids, dtype=str))
+        with open(os.path.join(tmp, "payloads.json"), "w", encoding="utf-8") as f:
+            json.dump(columns, f, default=_json_default)
+        _write_version(tmp)
+
+        # Swap the compacted files in; the log is discarded with the old directory.
+        # Readers wait on the shared lock rather than see the path missing in between
+        old = f"{path}.old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        logger.info(f"Compacted local collection '{collection_name}': {len(ids)} points")
+
+def _read_version(path: str):
+    try:
+        with open(os.path.join(path, VERSION_FILE), encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        # Collections compacted before version markers existed
+        return str(os.stat(os.path.join(path, "vectors.npy")).st_mtime_ns)
+
+def _write_version(path: str):
+    with open(os.path.join(path, VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(uuid.uuid4().hex)
+
+def _json_default(value):
+    """Serialise NumPy scalars found in dataframe payloads"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return str(value)
@@ -0,0 +1,41 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+_thread_locks = {}
+_guard = threading.Lock()
+
+def _thread_lock(path: str):
+    with _guard:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+@contextmanager
+def file_lock(path, shared: bool = False):
+    """Hold an flock on path, serialising worker processes on the same host
+
+    Exclusive holders also take a per-path thread lock, so threads of one
+    process queue up without relying on flock semantics. shared=True takes
+    a shared (reader) lock that only excludes exclusive holders.
+    """
+    path = str(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    thread_lock = None if shared else _thread_lock(path)
+    if thread_lock is not None:
+        thread_lock.acquire()
+    try:
+        with open(path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        if thread_lock is not None:
+            thread_lock.release()
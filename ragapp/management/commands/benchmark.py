@@ -0,0 +1,43 @@
+import json
+import time
+import importlib
+from django.core.management.base import BaseCommand
+
+SUITES = ["ingest", "query", "batch", "prompt", "chunks", "quantization"]
+
+class Command(BaseCommand):
+    help = "Run an offline benchmark suite from ragapp/benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("suite", choices=SUITES)
+        parser.add_argument("--rows", type=int, default=10, help="Retrieved rows per query")
+        parser.add_argument("--dataset-rows", type=int, default=20000, help="Rows in the synthetic dataset")
+        parser.add_argument("--repeat", type=int, default=3, help="Repetitions per timed case")
+        parser.add_argument("--requests", type=int, default=200, help="Queries sent by the query suite")
+        parser.add_argument("--distinct-queries", type=int, help="Repeat this many distinct queries in the query suite")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients in the query suite, generations per batch in the batch suite")
+        parser.add_argument("--backend", choices=["qdrant", "local"], default="qdrant",
+                            help="Vector store; qdrant runs in-process (:memory: or --qdrant-path)")
+        parser.add_argument("--qdrant-path", help="Directory for on-disk local Qdrant instead of :memory:")
+        parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per fake embedding call")
+        parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds per fake generation")
+        parser.add_argument("--qdrant-url", help="Qdrant server the quantization suite builds and times collections on")
+        parser.add_argument("--archive-rows", type=int, default=5_000_000, help="Row count the quantization suite projects memory for")
+        parser.add_argument("--llm-tail", type=float, default=0.0, help="Share of fake generations that take 10x as long")
+        parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache on during the query suite")
+        parser.add_argument("--endpoint", choices=["query", "query/async"], default="query",
+                            help="Endpoint the query suite sends requests to")
+        parser.add_argument("--live", action="store_true", help="Call the real Gemini API where the suite supports it")
+        parser.add_argument("--output", help="Also write the results as JSON to this path")
+
+    def handle(self, *args, **options):
+        from ragapp.benchmarks.harness import git_revision
+        suite = importlib.import_module(f"ragapp.benchmarks.{options['suite']}")
+        results = suite.run(**options)
+        results["revision"] = git_revision()
+        results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self.stdout.write(suite.report(results))
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
@@ -0,0 +1,174 @@
+import time
+import threading
+import contextvars
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction
+
+# Upper bounds of the Prometheus histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Stage timings of the current request; None outside a request (jobs, shell)
+_timings = contextvars.ContextVar("stage_timings", default=None)
+
+class Histogram:
+    """Cumulative Prometheus-style histogram"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """Process-wide histograms and counters keyed by (name, labels)"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets: tuple, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help)
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._help.setdefault(name, help)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Prometheus text exposition of everything recorded so far"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            helps = dict(self._help)
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines += [f"# HELP {name} {helps[name]}", f"# TYPE {name} histogram"]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines += [f"# HELP {name} {helps[name]}", f"# TYPE {name} counter"]
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: tuple):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+registry = Registry()
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a pipeline stage
+
+    The duration goes into the rag_stage_seconds histogram and, inside a
+    request, into that request's Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("rag_stage_seconds", elapsed, LATENCY_BUCKETS, help="Time spent per pipeline stage", stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+def timed(name: str):
+    """Decorator form of stage() for sync and async functions"""
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_tokens(kind: str, tokens: int):
+    """Record the size of a prompt or completion in tokens"""
+    registry.observe("rag_llm_tokens", tokens, TOKEN_BUCKETS, help="Tokens per Gemini request", kind=kind)
+
+# stats() keys of the caches and the result label they are exported under
+CACHE_OUTCOMES = [("hits", "hit"), ("near_hits", "near_hit"), ("shared_hits", "shared_hit"), ("misses", "miss")]
+
+def render_cache_stats(caches: dict):
+    """Prometheus lines for the stats() dicts of the answer/query/embedding caches"""
+    lines = [
+        "# HELP rag_cache_lookups_total Cache lookups by outcome",
+        "# TYPE rag_cache_lookups_total counter",
+    ]
+    ratios = ["# HELP rag_cache_hit_ratio Share of lookups served from the cache", "# TYPE rag_cache_hit_ratio gauge"]
+    for cache, stats in caches.items():
+        for key, outcome in CACHE_OUTCOMES:
+            if key in stats:
+                lines.append(f'rag_cache_lookups_total{{cache="{cache}",result="{outcome}"}} {stats[key]}')
+        if stats.get("hit_rate") is not None:
+            ratios.append(f'rag_cache_hit_ratio{{cache="{cache}"}} {stats["hit_rate"]}')
+    return "\n".join(lines + ratios) + "\n"
+
+def start_timings():
+    """Collect stage timings for the current context; returns (list, reset token)"""
+    timings = []
+    return timings, _timings.set(timings)
+
+def stop_timings(token):
+    _timings.reset(token)
+
+def current_timings():
+    """Stage timings collected so far in the current context, or None"""
+    return _timings.get()
+
+def _durations(timings: list):
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    return durations
+
+def stage_milliseconds(timings: list):
+    """{stage: ms} with repeats summed, for JSON responses"""
+    return {name: round(seconds * 1000, 1) for name, seconds in _durations(timings).items()}
+
+def server_timing(timings: list, total: float):
+    """Server-Timing header value, stages in first-seen order with repeats summed"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in _durations(timings).items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
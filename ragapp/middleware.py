@@ -0,0 +1,49 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import registry, start_timings, stop_timings, server_timing, LATENCY_BUCKETS
+
+class ServerTimingMiddleware:
+    """Add a Server-Timing header with the stages timed during the request
+
+    Streaming responses only report the stages that ran before the first
+    byte; generation time still lands in the /api/metrics histograms.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = start_timings()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings, token = start_timings()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    def _finish(self, request, response, timings: list, elapsed: float):
+        # Label by URL pattern rather than path to keep the series count bounded
+        match = request.resolver_match
+        route = match.route if match is not None else "unmatched"
+        registry.observe("rag_request_seconds", elapsed, LATENCY_BUCKETS,
+                         help="Time to first byte per API route", route=route)
+        if settings.SERVER_TIMING_ENABLED:
+            response["Server-Timing"] = server_timing(timings, elapsed)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ragapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='upload_path',
+            field=models.CharField(blank=True, max_length=512),
+        ),
+    ]
@@ -1,3 +1,62 @@
 from django.db import models
 
-# Create your models here.
+
+class IngestJob(models.Model):
+    """A background upload: parse, embed and publish one file"""
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    ]
+
+    file_name = models.CharField(max_length=255)
+    mode = models.CharField(max_length=16, default="full")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued")
+    total_rows = models.IntegerField(null=True, blank=True)
+    rows_processed = models.IntegerField(default=0)
+    rows_embedded = models.IntegerField(default=0)
+    rows_upserted = models.IntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Spooled upload, kept until the job finishes so it can be re-queued after a restart
+    upload_path = models.CharField(max_length=512, blank=True)
+    # Refreshed while a job runs; a stale one means its worker died
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+    def progress(self):
+        """Return progress counters with throughput (rows/sec) and ETA (seconds)"""
+        from django.utils import timezone
+
+        throughput = None
+        eta = None
+        if self.started_at:
+            elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+            if elapsed > 0 and self.rows_processed:
+                throughput = round(self.rows_processed / elapsed, 1)
+                if self.status == "running" and self.total_rows:
+                    eta = round(max(self.total_rows - self.rows_processed, 0) / throughput, 1)
+        return {
+            "job_id": self.pk,
+            "file_name": self.file_name,
+            "mode": self.mode,
+            "status": self.status,
+            "total_rows": self.total_rows,
+            "rows_processed": self.rows_processed,
+            "rows_embedded": self.rows_embedded,
+            "rows_upserted": self.rows_upserted,
+            "rows_per_sec": throughput,
+            "eta_seconds": eta,
+            "result": self.result,
+            "error": self.error or None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
@@ -1,35 +1,278 @@
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import (
+    Distance, VectorParams, PointStruct, PointIdsList,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation,
+    PayloadSchemaType, Filter, FieldCondition, MatchAny, Range, QueryRequest,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig, SearchParams, QuantizationSearchParams,
+)
+from .vector_store import (
+    VectorStore, SearchHit, COLLECTION_NAME, EMBEDDING_DIM, get_store,
+)
+from .async_clients import loop_local
+from .metrics import stage
+from django.conf import settings
 import os
+import re
 
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
-COLLECTION_NAME = "realestate"
-EMBEDDING_DIM = 768  # Dimension for Gemini text-embedding-004
 
 client = QdrantClient(
     url=QDRANT_URL,
     api_key=QDRANT_API_KEY,
 )
 
-def initialize_qdrant_collection():
-    collections = [c.name for c in client.get_collections().collections]
-    if COLLECTION_NAME not in collections:
-        client.recreate_collection(
+def get_async_client():
+    """AsyncQdrantClient for the running event loop, with a pooled HTTP connection set"""
+    return loop_local("qdrant", lambda: AsyncQdrantClient(
+        url=QDRANT_URL,
+        api_key=QDRANT_API_KEY,
+        pool_size=settings.QDRANT_ASYNC_POOL_SIZE,
+    ))
+
+# Payload fields that query filters match on
+PAYLOAD_INDEXES = {
+    "final location": PayloadSchemaType.KEYWORD,
+    "city": PayloadSchemaType.KEYWORD,
+    "year": PayloadSchemaType.INTEGER,
+}
+
+# VECTOR_STORAGE_PROFILE -> (original vectors on disk, quantization config)
+STORAGE_PROFILES = {
+    "float32": (False, None),
+    "on_disk": (True, None),
+    "int8": (True, ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))),
+    "binary": (True, BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))),
+}
+
+def storage_profile(profile: str = None):
+    """Return (on_disk, quantization_config) for a storage profile"""
+    profile = profile or settings.VECTOR_STORAGE_PROFILE
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown VECTOR_STORAGE_PROFILE '{profile}', expected one of {', '.join(STORAGE_PROFILES)}")
+    return STORAGE_PROFILES[profile]
+
+def search_params(profile: str = None):
+    """Rescore quantized candidates with the original vectors; None when not quantized"""
+    _, quantization = storage_profile(profile)
+    if quantization is None:
+        return None
+    return SearchParams(quantization=QuantizationSearchParams(
+        rescore=True, oversampling=settings.QUANTIZATION_OVERSAMPLING,
+    ))
+
+def payload_key(field_name: str):
+    """Quote field names such as 'final location' for Qdrant's JSON path syntax"""
+    return field_name if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", field_name) else f'"{field_name}"'
+
+def build_filter(spec: dict):
+    """Turn a {field: values} spec from filters.extract_filter into a Qdrant Filter"""
+    if not spec:
+        return None
+    conditions = []
+    for field_name, values in spec.items():
+        if field_name == "year":
+            conditions.append(FieldCondition(key=payload_key(field_name), range=Range(gte=values[0], lte=values[1])))
+        else:
+            conditions.append(FieldCondition(key=payload_key(field_name), match=MatchAny(any=list(values))))
+    return Filter(must=conditions)
+
+class QdrantStore(VectorStore):
+    """Versioned collections in Qdrant behind the realestate alias"""
+
+    def list_collections(self):
+        return [c.name for c in client.get_collections().collections]
+
+    def get_active_collection(self):
+        """Return the physical collection behind the realestate alias, or None
+
+        A plain collection named realestate (created before aliases were
+        introduced) is treated as active until the first swap replaces it.
+        """
+        for alias in client.get_aliases().aliases:
+            if alias.alias_name == COLLECTION_NAME:
+                return alias.collection_name
+        if COLLECTION_NAME in self.list_collections():
+            return COLLECTION_NAME
+        return None
+
+    def create_collection(self, collection_name: str):
+        on_disk, quantization = storage_profile()
+        client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE, on_disk=on_disk),
+            quantization_config=quantization,
+        )
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=payload_key(field_name),
+                field_schema=field_schema,
+            )
+
+    def drop_collection(self, collection_name: str):
+        client.delete_collection(collection_name)
+
+    def point_alias(self, collection_name: str):
+        if COLLECTION_NAME in self.list_collections():
+            self._replace_legacy_collection(collection_name)
+            return
+
+        operations = [CreateAliasOperation(create_alias=CreateAlias(
+            collection_name=collection_name, alias_name=COLLECTION_NAME,
+        ))]
+        if any(alias.alias_name == COLLECTION_NAME for alias in client.get_aliases().aliases):
+            operations.insert(0, DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=COLLECTION_NAME)))
+        # Swapping an existing alias is atomic: both operations apply in one request
+        client.update_collection_aliases(change_aliases_operations=operations)
+
+    def _replace_legacy_collection(self, collection_name: str):
+        """One-off migration of a plain realestate collection to the alias
+
+        An alias cannot share its name with a collection, so the legacy data
+        is first copied to realestate_v0 (kept as the previous version), then
+        the collection is dropped right before the alias is created. Readers
+        see no realestate collection for that single request; if creating the
+        alias fails, the legacy collection is restored from the copy.
+        """
+        backup = f"{COLLECTION_NAME}_v0"
+        if backup in self.list_collections():
+            self.drop_collection(backup)
+        self.create_collection(backup)
+        self.copy_points(COLLECTION_NAME, backup)
+        client.delete_collection(COLLECTION_NAME)
+        try:
+            client.update_collection_aliases(change_aliases_operations=[
+                CreateAliasOperation(create_alias=CreateAlias(
+                    collection_name=collection_name, alias_name=COLLECTION_NAME,
+                )),
+            ])
+        except Exception:
+            self.create_collection(COLLECTION_NAME)
+            self.copy_points(backup, COLLECTION_NAME)
+            raise
+
+    def count(self, collection_name: str):
+        return client.get_collection(collection_name).points_count
+
+    def copy_points(self, source: str, target: str, batch_size: int = 1000):
+        offset = None
+        copied = 0
+        while True:
+            points, offset = client.scroll(
+                collection_name=source,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if points:
+                client.upsert(
+                    collection_name=target,
+                    points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                    wait=True,
+                )
+                copied += len(points)
+            if offset is None:
+                return copied
+
+    def add_vectors(self, ids: list, vectors: list, payloads: list, collection_name: str = COLLECTION_NAME):
+        points = [
+            PointStruct(id=id, vector=vector, payload=payload)
+            for id, vector, payload in zip(ids, vectors, payloads)
+        ]
+        client.upsert(collection_name=collection_name, points=points, wait=True)
+
+    def delete_vectors(self, ids: list, collection_name: str = COLLECTION_NAME):
+        client.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=ids),
+            wait=True,
+        )
+
+    def fetch_content_hashes(self, collection_name: str = COLLECTION_NAME):
+        hashes = {}
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=["_content_hash"],
+                with_vectors=False,
+            )
+            for point in points:
+                hashes[str(point.id)] = (point.payload or {}).get("_content_hash")
+            if offset is None:
+                return hashes
+
+    def search(self, query_vector: list, top_k: int = 5, query_filter: dict = None):
+        points = client.query_points(
             collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+            query=query_vector,
+            query_filter=build_filter(query_filter),
+            search_params=search_params(),
+            limit=top_k,
+        ).points
+        return [SearchHit(str(point.id), point.score, point.payload) for point in points]
+
+    def search_batch(self, query_vectors: list, top_k: int = 5, query_filters: list = None):
+        """All searches in a single query_batch_points request"""
+        if not query_vectors:
+            return []
+        query_filters = query_filters or [None] * len(query_vectors)
+        params = search_params()
+        responses = client.query_batch_points(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                QueryRequest(query=query_vector, filter=build_filter(query_filter), params=params,
+                             limit=top_k, with_payload=True)
+                for query_vector, query_filter in zip(query_vectors, query_filters)
+            ],
         )
-        print(f"Qdrant collection '{COLLECTION_NAME}' created.")
+        return [
+            [SearchHit(str(point.id), point.score, point.payload) for point in response.points]
+            for response in responses
+        ]
+
+    def retrieve_payloads(self, ids: list):
+        points = client.retrieve(collection_name=COLLECTION_NAME, ids=ids, with_payload=True, with_vectors=False)
+        return {str(point.id): point.payload for point in points}
+
+    async def search_async(self, query_vector: list, top_k: int = 5, query_filter: dict = None):
+        response = await get_async_client().query_points(
+            collection_name=COLLECTION_NAME,
+            query=query_vector,
+            query_filter=build_filter(query_filter),
+            search_params=search_params(),
+            limit=top_k,
+        )
+        return [SearchHit(str(point.id), point.score, point.payload) for point in response.points]
+
+    async def retrieve_payloads_async(self, ids: list):
+        points = await get_async_client().retrieve(
+            collection_name=COLLECTION_NAME, ids=ids, with_payload=True, with_vectors=False,
+        )
+        return {str(point.id): point.payload for point in points}
+
+def initialize_qdrant_collection():
+    store = QdrantStore()
+    active = store.get_active_collection()
+    if active is None:
+        collection_name = store.create_next_version()
+        store.activate_collection(collection_name)
+        print(f"Qdrant collection '{collection_name}' created behind alias '{COLLECTION_NAME}'.")
     else:
-        print(f"Qdrant collection '{COLLECTION_NAME}' already exists.")
+        print(f"Qdrant collection '{COLLECTION_NAME}' already exists ({active}).")
 
 def add_vector(id: str, vector: list[float], metadata: dict):
-    point = PointStruct(id=id, vector=vector, payload=metadata)
-    client.upsert(collection_name=COLLECTION_NAME, points=[point])
-
-def search_vectors(query_vector: list[float], top_k: int = 5):
-    return client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        limit=top_k,
-    ).points
\ No newline at end of file
+    get_store().add_vectors([id], [vector], [metadata], collection_name=COLLECTION_NAME)
+
+def search_vectors(query_vector: list[float], top_k: int = 5, query_filter: dict = None):
+    with stage("vector_search"):
+        return get_store().search(query_vector, top_k=top_k, query_filter=query_filter)
+
+async def search_vectors_async(query_vector: list[float], top_k: int = 5, query_filter: dict = None):
+    with stage("vector_search"):
+        return await get_store().search_async(query_vector, top_k=top_k, query_filter=query_filter)
@@ -0,0 +1,166 @@
+import codecs
+import logging
+from itertools import chain
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Columns every upload must contain
+REQUIRED_COLUMNS = ['final location', 'year']
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# Bytes read at a time while checking the CSV encoding
+ENCODING_BLOCK_BYTES = 1 << 20
+
+# Integral floats beyond this are left alone (no exact int64 round-trip)
+MAX_EXACT_INT = 2 ** 53
+
+
+class UploadError(ValueError):
+    """The uploaded file cannot be ingested; details are shown to the user"""
+
+    def __init__(self, message: str, details: dict = None):
+        super().__init__(message)
+        self.details = details or {}
+
+
+def detect_encoding(path: str):
+    """Pick utf-8 (with or without BOM) or latin-1 by validating the whole file
+
+    The full scan is cheap next to parsing and means the encoding can never
+    turn out wrong after part of the file has already been ingested.
+    """
+    with open(path, "rb") as f:
+        first = f.read(ENCODING_BLOCK_BYTES)
+        encoding = "utf-8-sig" if first.startswith(codecs.BOM_UTF8) else "utf-8"
+        decoder = codecs.getincrementaldecoder(encoding)()
+        offset = 0
+        try:
+            for block in chain([first], iter(lambda: f.read(ENCODING_BLOCK_BYTES), b"")):
+                decoder.decode(block)
+                offset += len(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            if encoding == "utf-8-sig":
+                raise UploadError(
+                    f"File is marked as UTF-8 but has invalid UTF-8 bytes near byte {offset + e.start}; "
+                    "re-save it as UTF-8"
+                )
+            return "latin-1"
+    return encoding
+
+
+def estimate_rows(path: str, file_name: str):
+    """Cheap data row count for progress reporting, without parsing the file"""
+    if file_name.endswith('.csv'):
+        lines = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                lines += block.count(b"\n")
+        return max(lines - 1, 0)
+    if file_name.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return max((workbook.active.max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+    return None
+
+
+def _csv_chunks(path: str, chunk_rows: int):
+    encoding = detect_encoding(path)
+    try:
+        yield from pd.read_csv(path, encoding=encoding, on_bad_lines='skip', chunksize=chunk_rows)
+    except pd.errors.EmptyDataError:
+        return
+    except UnicodeDecodeError as e:
+        # Only if the file changed after detect_encoding validated it
+        raise UploadError(f"File could not be decoded as {encoding}: {e.reason}")
+
+
+def _xlsx_chunks(path: str, chunk_rows: int):
+    """Stream the first sheet with openpyxl's read-only row iterator"""
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if name is None else str(name) for i, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row[:len(columns)])
+            if len(batch) == chunk_rows:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _xls_chunks(path: str, chunk_rows: int):
+    # The legacy binary format has no streaming reader; parse it whole and slice
+    df = pd.read_excel(path)
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].copy()
+
+
+def normalize_chunk(df: pd.DataFrame):
+    """Make a parsed chunk independent of where the chunk boundaries fell
+
+    Whether a numeric column comes out as int or float depends on the
+    rows in that chunk (one blank cell turns it into float). Integral
+    floats are stored as ints so the same row always produces the same
+    chunk text, payload and content hash.
+    """
+    df.columns = df.columns.astype(str).str.strip()
+    for column in df.select_dtypes(include="float").columns:
+        values = df[column]
+        integral = values.notna() & (values % 1 == 0) & (values.abs() < MAX_EXACT_INT)
+        if integral.any():
+            converted = values.astype(object)
+            converted[integral] = values[integral].astype(np.int64).astype(object)
+            df[column] = converted
+    return df
+
+
+def read_chunks(path: str, file_name: str, chunk_rows: int = None):
+    """Validate an uploaded CSV/Excel file and iterate over it in dataframe chunks
+
+    Only one chunk is parsed at a time, so memory stays bounded whatever
+    the file size. The first chunk is parsed before returning so that
+    empty files and missing columns fail before any ingestion starts.
+    """
+    chunk_rows = chunk_rows or settings.UPLOAD_CHUNK_ROWS
+    # Check file type and read accordingly
+    if file_name.endswith('.xlsx'):
+        chunks = _xlsx_chunks(path, chunk_rows)
+    elif file_name.endswith('.xls'):
+        chunks = _xls_chunks(path, chunk_rows)
+    elif file_name.endswith('.csv'):
+        chunks = _csv_chunks(path, chunk_rows)
+    else:
+        raise UploadError("Please upload a CSV or Excel file (.csv, .xlsx, .xls)")
+
+    first = next(chunks, None)
+    # Check if the file has any rows
+    if first is None or first.empty:
+        raise UploadError("File is empty")
+    first = normalize_chunk(first)
+
+    # Verify at least some expected columns exist
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in first.columns]
+    if missing_cols:
+        raise UploadError(f"Missing required columns: {missing_cols}", {
+            "found_columns": list(first.columns[:10]),  # Show first 10 columns
+            "total_columns": len(first.columns)
+        })
+    return chain([first], (normalize_chunk(chunk) for chunk in chunks if not chunk.empty))
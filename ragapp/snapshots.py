@@ -0,0 +1,164 @@
+import os
+import shutil
+import logging
+import threading
+import pandas as pd
+import pyarrow as pa
+from django.conf import settings
+from .vector_store import collection_state, version_of
+
+logger = logging.getLogger(__name__)
+
+_snapshots = {}
+_lock = threading.Lock()
+
+def snapshot_path(collection_name: str):
+    return os.path.join(settings.RAG_DATA_DIR, "snapshots", f"{collection_name}.arrow")
+
+def _arrow_table(df: pd.DataFrame):
+    """Convert a chunk to Arrow, storing columns of mixed Python types as strings"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        arrays = {}
+        for column in df.columns:
+            try:
+                arrays[column] = pa.array(df[column], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                values = [None if pd.isna(v) else str(v) for v in df[column]]
+                arrays[column] = pa.array(values, type=pa.string())
+        return pa.table(arrays)
+
+def _unified_type(types: list):
+    """One Arrow type that every chunk's type for a column can be cast to"""
+    types = {t for t in types if not pa.types.is_null(t)}
+    if not types:
+        return pa.null()
+    if len(types) == 1:
+        return types.pop()
+    if all(pa.types.is_integer(t) for t in types):
+        return pa.int64()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+def _cast(table: pa.Table, schema: pa.Schema):
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            columns.append(column if column.type == field.type else column.cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+class SnapshotWriter:
+    """Writes an uploaded table chunk by chunk as an Arrow IPC snapshot
+
+    Each chunk is spooled to its own part file first, because inferred
+    column types can differ between chunks (int64 in one, double in the
+    next). close() casts the parts to one schema and writes the final,
+    uncompressed file so readers can memory-map it.
+    """
+
+    def __init__(self, collection_name: str):
+        self.path = snapshot_path(collection_name)
+        self.rows = 0
+        self._parts_dir = f"{self.path}.parts"
+        self._parts = []
+        shutil.rmtree(self._parts_dir, ignore_errors=True)
+        os.makedirs(self._parts_dir)
+
+    def add(self, df: pd.DataFrame):
+        table = _arrow_table(df)
+        part = os.path.join(self._parts_dir, f"{len(self._parts)}.arrow")
+        with pa.OSFile(part, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        self._parts.append((part, table.schema))
+        self.rows += table.num_rows
+
+    def observe(self, frames):
+        """Pass a dataframe or chunk iterable through, adding each chunk on the way"""
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        for df in frames:
+            self.add(df)
+            yield df
+
+    def close(self):
+        """Merge the parts into the snapshot file and return its size in bytes"""
+        schemas = [schema for _, schema in self._parts]
+        names = list(dict.fromkeys(name for schema in schemas for name in schema.names))
+        schema = pa.schema([
+            (name, _unified_type([s.field(name).type for s in schemas if name in s.names]))
+            for name in names
+        ])
+        tmp = f"{self.path}.tmp"
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for part, _ in self._parts:
+                with pa.memory_map(part, "r") as source:
+                    writer.write_table(_cast(pa.ipc.open_file(source).read_all(), schema))
+        os.replace(tmp, self.path)
+        shutil.rmtree(self._parts_dir, ignore_errors=True)
+        logger.info(f"Wrote snapshot {self.path}: {self.rows} rows, {len(names)} columns")
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        shutil.rmtree(self._parts_dir, ignore_errors=True)
+        for path in (f"{self.path}.tmp", self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class Snapshot:
+    """Memory-mapped Arrow snapshot of the table behind one collection version
+
+    The Arrow buffers point straight into the mapped file, so every worker
+    on the host shares the same pages and a restart only re-maps the file.
+    """
+
+    def __init__(self, path: str, collection_name: str):
+        self.path = path
+        self.collection = collection_name
+        self.version = version_of(collection_name)
+        self.size_bytes = os.path.getsize(path)
+        self.table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        self._dataframe = None
+
+    def dataframe(self):
+        """The table as a pandas DataFrame with Arrow-backed (zero-copy) columns"""
+        if self._dataframe is None:
+            self._dataframe = self.table.to_pandas(types_mapper=pd.ArrowDtype)
+        return self._dataframe
+
+    def info(self):
+        return {
+            "version": self.version,
+            "rows": self.table.num_rows,
+            "columns": self.table.num_columns,
+            "size_bytes": self.size_bytes,
+        }
+
+def get_snapshot(collection_name: str):
+    """Return the snapshot of a collection version, opening it on first use, or None"""
+    snapshot = _snapshots.get(collection_name)
+    if snapshot is not None:
+        return snapshot
+    path = snapshot_path(collection_name)
+    if not os.path.exists(path):
+        return None
+    with _lock:
+        if collection_name not in _snapshots:
+            # Only the active version is kept open; older mappings close once unused
+            _snapshots.clear()
+            _snapshots[collection_name] = Snapshot(path, collection_name)
+        return _snapshots[collection_name]
+
+def active_snapshot():
+    """Snapshot of the active collection version, or None"""
+    state = collection_state.get()
+    return get_snapshot(state["collection"]) if state["exists"] else None
+
+def get_dataframe():
+    """The active dataset as a DataFrame for analytics, or None before the first upload"""
+    snapshot = active_snapshot()
+    return snapshot.dataframe() if snapshot is not None else None
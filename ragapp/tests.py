@@ -1,3 +1,1164 @@
-from django.test import TestCase
+import os
+import json
+import time
+import asyncio
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
+from .analytics import analyze
+from .benchmarks.datasets import make_dataset, payload_rows
+from .benchmarks.fakes import fake_vector
+from .benchmarks.harness import benchmark_environment, fake_providers
+from .coalescing import SingleFlight
+from .deadlines import Deadline, DeadlineExceeded
+from .embeddings import create_chunk, create_chunks, embed_texts, embed_query, QueryEmbeddingCache
+from .filters import build_vocabulary, _compile
+from .ingestion import ingest_new_version
+from .jobs import run_job
+from .llm import AnswerStreamParser, llama_answer, stream_answer, DEGRADED_TIMEOUT_SUMMARY, DEGRADED_ERROR_SUMMARY
 
-# Create your tests here.
+
+class ChunkTextTests(TestCase):
+    """create_chunks must give byte-identical text to create_chunk over iterrows"""
+
+    def assertSameChunks(self, df):
+        self.assertEqual(create_chunks(df), [create_chunk(row) for _, row in df.iterrows()])
+
+    def test_synthetic_dataset(self):
+        self.assertSameChunks(make_dataset(60))
+
+    def test_missing_columns_and_nan(self):
+        df = make_dataset(20)[["final location", "year", "shop - weighted average rate"]]
+        self.assertSameChunks(df)
+
+    def test_narrow_float_columns(self):
+        values = [1.1, 0.1, 12345.678, 1e-7, 3.0, np.nan]
+        self.assertSameChunks(pd.DataFrame({"final location": ["Wakad"] * 6, "loc_lat": np.array(values, np.float32)}))
+        self.assertSameChunks(pd.DataFrame({"loc_lat": np.array(values, np.float32), "loc_lng": np.array(values, np.float32)}))
+        self.assertSameChunks(pd.DataFrame({"final location": ["Wakad"] * 6, "loc_lat": np.array(values, np.float16)}))
+        self.assertSameChunks(pd.DataFrame({"final location": ["Wakad"] * 6, "loc_lat": pd.array(values, dtype="Float32")}))
+
+    def test_all_numeric_frame_is_upcast_like_iterrows(self):
+        self.assertSameChunks(pd.DataFrame({"year": [2020, 2021], "loc_lat": [18.5, 18.75]}))
+
+
+@override_settings(EMBEDDING_CACHE_ENABLED=False, EMBEDDING_BATCH_SIZE=3, EMBEDDING_RETRY_BACKOFF=0)
+class EmbedTextsTests(TestCase):
+    """Concurrent batched embedding keeps rows aligned and retries failed batches"""
+
+    texts = [f"row {i}" for i in range(10)]
+
+    def expected(self):
+        from .vector_store import EMBEDDING_DIM
+        return [fake_vector(text, EMBEDDING_DIM) for text in self.texts]
+
+    def test_keeps_input_order(self):
+        with fake_providers(embed_latency=0.01) as (embeddings, _):
+            vectors, stats = embed_texts(self.texts)
+        self.assertEqual(vectors, self.expected())
+        self.assertEqual((stats["rows"], stats["batches"], stats["retries"]), (10, 4, 0))
+        self.assertEqual(embeddings.calls, 4)
+
+    def test_retries_a_failed_batch(self):
+        import google.generativeai as genai
+        failures = []
+        with fake_providers() as (embeddings, _):
+            def flaky(model, content, **kwargs):
+                if content[0] == "row 3" and not failures:
+                    failures.append(content)
+                    raise ConnectionError("reset")
+                return embeddings(model, content, **kwargs)
+
+            with mock.patch.object(genai, "embed_content", flaky):
+                vectors, stats = embed_texts(self.texts)
+        self.assertEqual(vectors, self.expected())
+        self.assertEqual(stats["retries"], 1)
+
+    @override_settings(EMBEDDING_MAX_RETRIES=2)
+    def test_gives_up_after_max_retries(self):
+        import google.generativeai as genai
+        with fake_providers(), mock.patch.object(genai, "embed_content", side_effect=ConnectionError("down")) as embed:
+            with self.assertRaises(ConnectionError):
+                embed_texts(self.texts[:2])
+        self.assertEqual(embed.call_count, 3)
+
+
+class QueryEmbeddingCacheTests(TestCase):
+    """Query vectors are reused within their TTL and the cache stays bounded"""
+
+    def test_ttl(self):
+        cache = QueryEmbeddingCache(max_entries=10, ttl=60)
+        with mock.patch("ragapp.embeddings.time.monotonic", return_value=1000.0):
+            cache.set("wakad", [1.0])
+        with mock.patch("ragapp.embeddings.time.monotonic", return_value=1059.0):
+            self.assertEqual(cache.get("wakad"), [1.0])
+        with mock.patch("ragapp.embeddings.time.monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get("wakad"))
+        self.assertEqual((cache.hits, cache.misses, cache.stats()["entries"]), (1, 1, 0))
+
+    def test_lru_limit(self):
+        cache = QueryEmbeddingCache(max_entries=2, ttl=60)
+        cache.set("a", [1.0])
+        cache.set("b", [2.0])
+        cache.get("a")
+        cache.set("c", [3.0])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), ([1.0], [3.0]))
+
+    def test_shared_backend(self):
+        from django.core.cache import caches
+        caches["default"].clear()
+        writer = QueryEmbeddingCache(max_entries=2, ttl=60, backend="default")
+        reader = QueryEmbeddingCache(max_entries=2, ttl=60, backend="default")
+        writer.set("wakad", [1.0])
+        self.assertEqual(reader.get("wakad"), [1.0])
+        self.assertEqual(reader.shared_hits, 1)
+
+    def test_embed_query_reuses_normalized_queries(self):
+        with fake_providers() as (embeddings, _), \
+                mock.patch("ragapp.embeddings.query_cache", QueryEmbeddingCache(max_entries=10, ttl=60)):
+            first = embed_query("Price trends in  Wakad")
+            self.assertEqual(embed_query("price trends in wakad "), first)
+        self.assertEqual(embeddings.calls, 1)
+
+
+class AnswerCacheTests(TestCase):
+    """Cached answers are reused for near-duplicates of the same places and dropped on a new version"""
+
+    def test_exact_and_near_duplicate_hits(self):
+        from .answer_cache import AnswerCache
+        cache = AnswerCache(max_entries=10, threshold=0.97)
+        vector = np.array(fake_vector("wakad"))
+        close = vector + 0.01 * np.array(fake_vector("noise"))
+        with benchmark_environment("local"):
+            ingest_new_version(make_dataset(30))
+            cache.store("Show Wakad prices in 2020", vector, {"summary": "a"}, version=1)
+            self.assertEqual(cache.lookup("show wakad  prices in 2020", vector, 1), {"summary": "a"})
+            self.assertEqual(cache.lookup("Wakad prices for 2020", close, 1), {"summary": "a"})
+            self.assertIsNone(cache.lookup("Show Wakad prices in 2021", close, 1))
+            self.assertIsNone(cache.lookup("Show Wakad prices in 2020", vector, 2))
+        self.assertEqual((cache.hits, cache.near_hits, cache.misses), (1, 1, 2))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_new_dataset_version_invalidates_answers(self):
+        query = {"query": "Tell me about real estate in Pune"}
+        with benchmark_environment("local") as (_, model_class):
+            ingest_new_version(make_dataset(30))
+            first = self.client.post("/api/query", query, content_type="application/json").json()
+            self.assertEqual(self.client.post("/api/query", query, content_type="application/json").json(), first)
+            self.assertEqual(model_class.calls, 1)
+
+            ingest_new_version(make_dataset(30, seed=1))
+            self.client.post("/api/query", query, content_type="application/json")
+            self.assertEqual(model_class.calls, 2)
+
+
+class EmbeddingCacheTests(TestCase):
+    """The on-disk embedding cache: lookups, size accounting and LRU eviction"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.path = os.path.join(root, "embedding_cache.sqlite3")
+
+    def cache(self, max_bytes=1024):
+        from .embeddings import EmbeddingCache
+        return EmbeddingCache(self.path, max_bytes=max_bytes)
+
+    def test_round_trip_and_size_accounting(self):
+        cache = self.cache()
+        cache.put_many({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+        self.assertEqual(cache.get_many(["a", "missing"]), {"a": [1.0, 2.0]})
+        cache.put_many({"a": [5.0, 6.0, 7.0]})
+        self.assertEqual(cache.total_bytes(), 12 + 8)
+        self.assertEqual(self.cache().get_many(["a"]), {"a": [5.0, 6.0, 7.0]})
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (2, 1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = self.cache(max_bytes=48)
+        cache.put_many({"a": [0.0] * 4})
+        time.sleep(0.01)
+        cache.put_many({"b": [0.0] * 4, "c": [0.0] * 4})
+        time.sleep(0.01)
+        cache.get_many(["a"])
+        time.sleep(0.01)
+        cache.put_many({"d": [0.0] * 4})
+        self.assertEqual(set(cache.get_many(["a", "b", "c", "d"])), {"a", "d"})
+        self.assertLessEqual(cache.total_bytes(), 48)
+
+    def test_embed_texts_skips_cached_texts(self):
+        with benchmark_environment("local") as (embeddings, _):
+            first, _ = embed_texts(["row 1", "row 2"])
+            calls = embeddings.calls
+            vectors, stats = embed_texts(["row 2", "row 1", "row 3"])
+        # Cached vectors come back as float32
+        np.testing.assert_allclose(vectors[:2], [first[1], first[0]], rtol=1e-6)
+        self.assertEqual(stats["cache_hits"], 2)
+        self.assertEqual(embeddings.texts, 3)
+        self.assertEqual(embeddings.calls, calls + 1)
+
+
+@override_settings(INGEST_BATCH_SIZE=25)
+class StreamingIngestTests(TestCase):
+    """Ingestion embeds and upserts fixed-size batches while the input is still being read"""
+
+    def test_batches_are_written_while_reading(self):
+        from . import ingestion
+        from .vector_store import get_store
+        df = make_dataset(100)
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend):
+                events = []
+
+                def frames():
+                    for start in range(0, len(df), 25):
+                        events.append(("read", start))
+                        yield df.iloc[start:start + 25]
+
+                upsert_batch = ingestion._upsert_batch
+
+                def upsert(ids, *args):
+                    events.append(("upsert", len(ids)))
+                    return upsert_batch(ids, *args)
+
+                reports = []
+                with mock.patch.object(ingestion, "_upsert_batch", upsert):
+                    stats = ingest_new_version(frames(), progress=lambda stats: reports.append(dict(stats)))
+
+                upserts = [size for event, size in events if event == "upsert"]
+                self.assertEqual(upserts, [25] * 4)
+                self.assertLess(events.index(("upsert", 25)), events.index(("read", 75)))
+                self.assertEqual((stats["rows_upserted"], stats["batches"]), (100, 4))
+                self.assertEqual(get_store().count(stats["collection"]), 100)
+                self.assertEqual(reports[-1]["rows_upserted"], 100)
+                self.assertEqual([r["rows_processed"] for r in reports[:4]], [25, 50, 75, 100])
+
+
+@override_settings(INGEST_BATCH_SIZE=20, COLLECTION_VERSIONS_TO_KEEP=1)
+class VersionSwapTests(TestCase):
+    """Readers stay on the active version until a new one is complete"""
+
+    def test_alias_moves_only_when_the_build_completes(self):
+        from .vector_store import get_store
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend):
+                store = get_store()
+                ingest_new_version(make_dataset(30, seed=1))
+                seen = []
+
+                def progress(stats):
+                    seen.append((store.get_active_collection(), len(store.search(fake_vector("q"), top_k=50))))
+
+                stats = ingest_new_version(make_dataset(60, seed=2), progress=progress)
+                self.assertEqual(set(seen), {("realestate_v1", 30)})
+                self.assertEqual(store.get_active_collection(), stats["collection"])
+                self.assertEqual(len(store.search(fake_vector("q"), top_k=100)), 60)
+
+    def test_failed_build_is_dropped(self):
+        from . import ingestion
+        from .vector_store import get_store
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend):
+                store = get_store()
+                ingest_new_version(make_dataset(30))
+                with mock.patch.object(ingestion, "embed_texts", side_effect=RuntimeError("quota")):
+                    with self.assertRaises(RuntimeError):
+                        ingest_new_version(make_dataset(40))
+                self.assertEqual(store.get_active_collection(), "realestate_v1")
+                self.assertEqual(store.list_versions(), [1])
+                self.assertEqual(store.count("realestate_v1"), 30)
+
+    def test_old_versions_are_garbage_collected(self):
+        from .vector_store import get_store
+        with benchmark_environment("local"):
+            for seed in range(3):
+                ingest_new_version(make_dataset(10, seed=seed))
+            self.assertEqual(get_store().list_versions(), [2, 3])
+
+
+class CollectionStateTests(TestCase):
+    """Requests read the active collection from the cached state, not the vector store"""
+
+    def test_check_data_makes_no_store_round_trips(self):
+        from .vector_store import get_store
+        with benchmark_environment("local"):
+            self.assertFalse(self.client.get("/api/check-data").json()["exists"])
+            ingest_new_version(make_dataset(30))
+            store = get_store()
+            with mock.patch.object(store, "get_active_collection", wraps=store.get_active_collection) as active, \
+                    mock.patch.object(store, "count", wraps=store.count) as count:
+                bodies = [self.client.get("/api/check-data").json() for _ in range(3)]
+            self.assertEqual((active.call_count, count.call_count), (0, 0))
+            self.assertEqual(bodies[-1]["points_count"], 30)
+            self.assertEqual(bodies[-1]["version"], 1)
+
+    def test_stale_state_refreshes_in_background(self):
+        from .vector_store import CollectionState
+        state = CollectionState(ttl=0)
+        with benchmark_environment("local"):
+            self.assertFalse(state.get()["exists"])
+            ingest_new_version(make_dataset(30))
+            # The stale state is returned at once while a thread refreshes it
+            self.assertFalse(state.get()["exists"])
+            for _ in range(100):
+                if state._state["exists"]:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(state.get()["points_count"], 30)
+
+
+class ReaderTests(TestCase):
+    """Uploads are parsed chunk by chunk, whatever their format and encoding"""
+
+    def write(self, suffix, data: bytes = None):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data or b"")
+        self.addCleanup(os.remove, path)
+        return path
+
+    def read(self, path, chunk_rows=10):
+        from .readers import read_chunks
+        return list(read_chunks(path, os.path.basename(path), chunk_rows=chunk_rows))
+
+    def test_csv_in_chunks(self):
+        df = make_dataset(25)
+        path = self.write(".csv", df.to_csv(index=False).encode("utf-8"))
+        chunks = self.read(path)
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(pd.concat(chunks)["final location"]), list(df["final location"]))
+        from .readers import estimate_rows
+        self.assertEqual(estimate_rows(path, "data.csv"), 25)
+
+    def test_xlsx_in_chunks(self):
+        df = make_dataset(25)
+        path = self.write(".xlsx")
+        df.to_excel(path, index=False)
+        chunks = self.read(path)
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(pd.concat(chunks)["year"]), list(df["year"]))
+
+    def test_encodings(self):
+        header = "final location,year\n"
+        bom = self.write(".csv", b"\xef\xbb\xbf" + (header + "Baner,2020\n").encode("utf-8"))
+        self.assertEqual(list(self.read(bom)[0].columns), ["final location", "year"])
+        latin = self.write(".csv", (header + "Caf\xe9 Road,2020\n").encode("latin-1"))
+        self.assertEqual(self.read(latin)[0]["final location"][0], "Caf\xe9 Road")
+
+        from .readers import UploadError
+        broken = self.write(".csv", b"\xef\xbb\xbf" + header.encode() + b"Caf\xe9,2020\n")
+        with self.assertRaisesRegex(UploadError, "invalid UTF-8"):
+            self.read(broken)
+
+    def test_chunk_boundaries_do_not_change_values(self):
+        rows = "".join(f"Baner,{2015 + i},{'' if i == 1 else i * 10}\n" for i in range(4))
+        path = self.write(".csv", ("final location,year,flat total\n" + rows).encode())
+        values = list(pd.concat(self.read(path, chunk_rows=2))["flat total"])
+        self.assertEqual(values[2:], [20, 30])
+        self.assertIsInstance(values[0], int)
+
+    def test_rejects_empty_files_and_missing_columns(self):
+        from .readers import UploadError
+        with self.assertRaisesRegex(UploadError, "empty"):
+            self.read(self.write(".csv", b"final location,year\n"))
+        with self.assertRaises(UploadError) as raised:
+            self.read(self.write(".csv", b"location,when\nBaner,2020\n"))
+        self.assertEqual(raised.exception.details["found_columns"], ["location", "when"])
+        with self.assertRaises(UploadError):
+            self.read(self.write(".txt", b"x"))
+
+
+class SnapshotTests(TestCase):
+    """Each dataset version keeps an Arrow snapshot that analytics read instead of a global DataFrame"""
+
+    def test_snapshot_follows_the_active_version(self):
+        from . import snapshots
+        df = make_dataset(30)
+        with benchmark_environment("local"):
+            self.assertIsNone(snapshots.get_dataframe())
+            ingest_new_version(df)
+            snapshot = snapshots.active_snapshot()
+            self.assertEqual(snapshot.info()["rows"], 30)
+            self.assertEqual(list(snapshot.dataframe()["final location"]), list(df["final location"]))
+
+            ingest_new_version(make_dataset(12, seed=1))
+            self.assertEqual(len(snapshots.get_dataframe()), 12)
+            # Only the active version stays mapped
+            self.assertEqual(list(snapshots._snapshots), ["realestate_v2"])
+            # A restarted worker re-maps the same file
+            snapshots._snapshots.clear()
+            self.assertEqual(snapshots.active_snapshot().info()["rows"], 12)
+
+    def test_chunks_with_different_types_share_one_schema(self):
+        from .snapshots import SnapshotWriter, get_snapshot
+        with benchmark_environment("local"):
+            writer = SnapshotWriter("realestate_v9")
+            writer.add(pd.DataFrame({"year": [2020], "rate": [5000]}))
+            writer.add(pd.DataFrame({"year": [2021], "rate": [5100.5], "note": ["new"]}))
+            writer.close()
+            df = get_snapshot("realestate_v9").dataframe()
+        self.assertEqual(list(df["rate"]), [5000.0, 5100.5])
+        self.assertEqual(df["note"].isna().tolist(), [True, False])
+
+    def test_failed_upload_leaves_no_snapshot(self):
+        from . import ingestion, snapshots
+        with benchmark_environment("local"):
+            with mock.patch.object(ingestion, "embed_texts", side_effect=RuntimeError("quota")):
+                with self.assertRaises(RuntimeError):
+                    ingest_new_version(make_dataset(10))
+            self.assertFalse(os.path.exists(snapshots.snapshot_path("realestate_v1")))
+            self.assertIsNone(snapshots.get_snapshot("realestate_v1"))
+
+
+class IncrementalIngestTests(TestCase):
+    """Incremental uploads only embed the delta and delete rows missing from the file"""
+
+    def test_insert_update_delete(self):
+        from .vector_store import get_store
+        df = make_dataset(44)
+        with benchmark_environment(backend="local") as (embeddings, _):
+            first = ingest_new_version(df.iloc[:40])
+            self.assertEqual(first["inserted"], 40)
+
+            changed = df.drop(index=[0, 1]).copy()
+            changed.loc[[5, 6, 7], "flat total"] += 1
+            texts_before = embeddings.texts
+            stats = ingest_new_version(changed, incremental=True)
+
+            self.assertEqual(
+                (stats["inserted"], stats["updated"], stats["deleted"], stats["unchanged"]), (4, 3, 2, 35),
+            )
+            self.assertEqual(stats["rows_embedded"], 7)
+            self.assertEqual(embeddings.texts - texts_before, 7)
+            self.assertEqual(stats["version"], first["version"] + 1)
+            self.assertEqual(get_store().count(stats["collection"]), 42)
+
+            unchanged = ingest_new_version(changed, incremental=True)
+            self.assertEqual((unchanged["rows_embedded"], unchanged["unchanged"]), (0, 42))
+
+
+class LocalStoreTests(TestCase):
+    """Exact search, write-log compaction and its recovery from torn writes"""
+
+    def setUp(self):
+        from .local_store import LocalStore
+        from .vector_store import EMBEDDING_DIM
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.store = LocalStore(self.root)
+        self.store.create_collection("realestate_v1")
+        self.dim = EMBEDDING_DIM
+
+    def unit(self, i):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        vector[i] = 1.0
+        return vector
+
+    def add(self, ids):
+        self.store.add_vectors(
+            [str(i) for i in ids], [self.unit(i) for i in ids],
+            [{"final location": f"L{i}", "year": 2015 + i} for i in ids], collection_name="realestate_v1",
+        )
+
+    def test_search_sees_the_last_write_per_id(self):
+        self.add(range(5))
+        self.store.activate_collection("realestate_v1")
+        self.store.delete_vectors(["3"], collection_name="realestate_v1")
+        self.store.add_vectors(["1"], [self.unit(4) + self.unit(1)], [{"final location": "moved"}], collection_name="realestate_v1")
+
+        hits = self.store.search(self.unit(4), top_k=2)
+        self.assertEqual([hit.id for hit in hits], ["4", "1"])
+        self.assertEqual(hits[1].payload["final location"], "moved")
+        self.assertEqual(self.store.count("realestate_v1"), 4)
+        self.assertFalse(any(hit.id == "3" for hit in self.store.search(self.unit(3), top_k=4)))
+
+        filtered = self.store.search(self.unit(0), top_k=5, query_filter={"year": (2016, 2017)})
+        self.assertEqual([hit.id for hit in filtered], ["2"])
+        batched = self.store.search_batch([self.unit(0), self.unit(2)], top_k=1)
+        self.assertEqual([[hit.id for hit in hits] for hits in batched], [["0"], ["2"]])
+        self.assertEqual(self.store.search_batch([], top_k=1), [])
+
+    def test_torn_log_is_truncated_to_complete_records(self):
+        self.add(range(3))
+        path = os.path.join(self.root, "realestate_v1")
+        # A writer died after appending vectors and half a row
+        with open(os.path.join(path, "vectors.bin"), "ab") as f:
+            f.write(self.unit(5).astype(self.store.dtype).tobytes()[:-8])
+        with open(os.path.join(path, "rows.jsonl"), "a", encoding="utf-8") as f:
+            f.write('{"id": "5", "payl')
+        self.assertEqual(self.store.count("realestate_v1"), 3)
+
+    def test_rejects_vectors_of_another_dimension(self):
+        self.add(range(2))
+        self.store.count("realestate_v1")
+        with self.assertRaises(ValueError):
+            self.store.add_vectors(["9"], [np.ones(self.dim // 2)], [{}], collection_name="realestate_v1")
+
+    def test_log_written_with_another_dimension_fails_compaction(self):
+        path = os.path.join(self.root, "realestate_v1")
+        with open(os.path.join(path, "vectors.bin"), "ab") as f:
+            f.write(np.ones((2, self.dim // 2), dtype=self.store.dtype).tobytes())
+        with open(os.path.join(path, "rows.jsonl"), "a", encoding="utf-8") as f:
+            f.write('{"id": "1", "payload": {}}\n{"id": "2", "payload": {}}\n')
+        with self.assertRaises(ValueError):
+            self.store.count("realestate_v1")
+
+
+class QueryFilterTests(TestCase):
+    """Localities, cities and years named in a query restrict retrieval to matching rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vocabulary = _compile(build_vocabulary(make_dataset(60)))
+
+    def test_extract_filter(self):
+        from .filters import extract_filter
+        self.assertEqual(
+            extract_filter("Flat rates in Baner and Aundh between 2018 and 2020", self.vocabulary),
+            {"final location": ["Baner", "Aundh"], "year": (2018, 2020)},
+        )
+        self.assertEqual(extract_filter("Tell me about Pimpri Chinchwad", self.vocabulary),
+                         {"city": ["Pimpri Chinchwad"]})
+        self.assertIsNone(extract_filter("Wakadi prices", self.vocabulary))
+        self.assertIsNone(extract_filter("Wakad in 2017", None))
+
+    def test_matches_filter(self):
+        from .filters import matches_filter
+        spec = {"final location": ["Wakad"], "year": (2017, 2019)}
+        self.assertTrue(matches_filter({"final location": "Wakad", "year": 2018}, spec))
+        self.assertFalse(matches_filter({"final location": "Wakad", "year": 2020}, spec))
+        self.assertFalse(matches_filter({"final location": "Baner", "year": 2018}, spec))
+        self.assertTrue(matches_filter({"final location": "Baner"}, None))
+
+    def test_qdrant_filter(self):
+        from .qdrant_client import build_filter
+        conditions = build_filter({"final location": ["Wakad"], "year": (2017, 2019)}).must
+        self.assertEqual(conditions[0].key, '"final location"')
+        self.assertEqual(conditions[0].match.any, ["Wakad"])
+        self.assertEqual((conditions[1].key, conditions[1].range.gte, conditions[1].range.lte), ("year", 2017, 2019))
+        self.assertIsNone(build_filter(None))
+
+    @override_settings(RETRIEVAL_MODE="dense")
+    def test_retrieval_is_filtered(self):
+        from .llm import retrieve_context
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend):
+                ingest_new_version(make_dataset(140))
+                rows = retrieve_context("Wakad between 2017 and 2019", top_k=10)
+                self.assertEqual(len(rows), 3)
+                self.assertEqual({row["final location"] for row in rows}, {"Wakad"})
+                self.assertEqual(sorted(row["year"] for row in rows), [2017, 2018, 2019])
+
+
+class VectorStorageProfileTests(TestCase):
+    """Quantized and half-precision storage still find the right rows"""
+
+    def test_storage_profiles(self):
+        from qdrant_client.http.models import ScalarQuantization
+        from .qdrant_client import storage_profile, search_params
+        self.assertEqual(storage_profile("float32"), (False, None))
+        on_disk, quantization = storage_profile("int8")
+        self.assertTrue(on_disk)
+        self.assertIsInstance(quantization, ScalarQuantization)
+        self.assertIsNone(search_params("on_disk"))
+        with override_settings(QUANTIZATION_OVERSAMPLING=3.0):
+            params = search_params("binary").quantization
+        self.assertEqual((params.rescore, params.oversampling), (True, 3.0))
+        with self.assertRaises(ValueError):
+            storage_profile("fp8")
+
+    def assertFindsOwnRow(self, df):
+        from .vector_store import get_store, EMBEDDING_DIM
+        text = create_chunks(df.iloc[[7]])[0]
+        hits = get_store().search(fake_vector(text, EMBEDDING_DIM), top_k=1)
+        self.assertEqual(hits[0].payload["final location"], df.iloc[7]["final location"])
+        self.assertEqual(hits[0].payload["year"], df.iloc[7]["year"])
+
+    @override_settings(VECTOR_STORAGE_PROFILE="int8")
+    def test_quantized_qdrant_collection(self):
+        import ragapp.qdrant_client as qdrant
+        df = make_dataset(40)
+        with benchmark_environment("qdrant"):
+            # The in-process Qdrant accepts but does not keep quantization settings
+            with mock.patch.object(qdrant.client, "create_collection", wraps=qdrant.client.create_collection) as create:
+                ingest_new_version(df)
+            kwargs = create.call_args.kwargs
+            self.assertIsNotNone(kwargs["quantization_config"].scalar)
+            self.assertTrue(kwargs["vectors_config"].on_disk)
+            with mock.patch.object(qdrant.client, "query_points", wraps=qdrant.client.query_points) as query:
+                self.assertFindsOwnRow(df)
+            self.assertTrue(query.call_args.kwargs["search_params"].quantization.rescore)
+
+    @override_settings(LOCAL_VECTOR_DTYPE="float16")
+    def test_half_precision_local_store(self):
+        from django.conf import settings
+        df = make_dataset(40)
+        with benchmark_environment("local"):
+            stats = ingest_new_version(df)
+            vectors = np.load(os.path.join(settings.LOCAL_VECTOR_STORE_DIR, stats["collection"], "vectors.npy"))
+            self.assertEqual(vectors.dtype, np.float16)
+            self.assertFindsOwnRow(df)
+
+
+class LexicalIndexTests(TestCase):
+    """BM25 search, rank fusion and the per-version index cache"""
+
+    def setUp(self):
+        from . import lexical
+        self.lexical = lexical
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, ignore_errors=True)
+        for context in (override_settings(RAG_DATA_DIR=data_dir), mock.patch.object(lexical, "_indexes", {})):
+            context.__enter__()
+            self.addCleanup(context.__exit__, None, None, None)
+
+    def build(self, collection_name, texts):
+        builder = self.lexical.BM25Builder()
+        builder.add([str(i) for i in range(len(texts))], texts, [{"text": text} for text in texts])
+        builder.save(collection_name)
+
+    def test_search_ranks_documents_matching_more_terms_higher(self):
+        self.build("realestate_v1", ["Baner Pune", "Wakad Pune", "Baner Kharadi", "Aundh Pune"])
+        index = self.lexical.get_index("realestate_v1")
+        hits = index.search("baner kharadi", top_k=3)
+        self.assertEqual([id for id, _ in hits], ["2", "0"])
+        self.assertEqual(index.payloads(["2"]), {"2": {"text": "Baner Kharadi"}})
+        self.assertEqual(index.search("hinjewadi"), [])
+
+    def test_reciprocal_rank_fusion(self):
+        fused = self.lexical.reciprocal_rank_fusion(["a", "b", "c"], ["b", "d"])
+        self.assertEqual(fused[0], "b")
+        self.assertEqual(set(fused), {"a", "b", "c", "d"})
+        self.assertLess(fused.index("a"), fused.index("d"))
+
+    def test_only_the_latest_version_stays_cached(self):
+        self.build("realestate_v1", ["Baner Pune"])
+        self.build("realestate_v2", ["Wakad Pune"])
+        first = self.lexical.get_index("realestate_v1")
+        self.assertIs(self.lexical.get_index("realestate_v1"), first)
+        self.assertIsNotNone(self.lexical.get_index("realestate_v2"))
+        self.assertEqual(list(self.lexical._indexes), ["realestate_v2"])
+        self.assertIsNone(self.lexical.get_index("realestate_v3"))
+        self.assertEqual(list(self.lexical._indexes), ["realestate_v3"])
+
+
+class ContextBuilderTests(TestCase):
+    """The prompt context is a compact table of the asked-about columns within a token budget"""
+
+    def setUp(self):
+        self.rows = payload_rows(make_dataset(40))
+
+    def test_selects_key_and_metric_columns(self):
+        from .context_builder import build_context, DEFAULT_COLUMNS
+        context = build_context("Office rates in Wakad", self.rows)
+        self.assertEqual(context.columns, ["final location", "city", "year", "office - weighted average rate"])
+        self.assertEqual(context.text.splitlines()[0], "final location,city,year,office - weighted average rate")
+        self.assertEqual(build_context("Tell me about Pune", self.rows).columns[3:], DEFAULT_COLUMNS)
+
+    def test_respects_the_token_budget(self):
+        from .context_builder import build_context, estimate_tokens
+        full = build_context("Office rates in Wakad", self.rows, token_budget=10000, max_rows=100)
+        self.assertEqual((full.rows, full.dropped), (40, 0))
+
+        budgeted = build_context("Office rates in Wakad", self.rows, token_budget=100, max_rows=100)
+        self.assertLessEqual(estimate_tokens(budgeted.text), 100)
+        self.assertEqual(budgeted.rows + budgeted.dropped, 40)
+        self.assertGreater(budgeted.dropped, 0)
+        # The best matches are kept, in order
+        self.assertEqual(budgeted.text.splitlines(), full.text.splitlines()[:budgeted.rows + 1])
+
+        self.assertEqual(build_context("Office rates in Wakad", self.rows, token_budget=1).rows, 1)
+
+    def test_formats_values_compactly(self):
+        from .context_builder import build_context
+        rows = [{"final location": "Wakad", "year": 2020.0, "flat - weighted average rate": 5500.256, "city": None}]
+        self.assertEqual(build_context("Flat rate in Wakad", rows).text.splitlines()[1], "Wakad,2020,5500.26")
+
+
+class AnswerStreamParserTests(TestCase):
+
+    ANSWER = {
+        "summary": 'Rates in "Wakad" rose 12%\nacross 2019–2023 \U0001F4C8 overall.',
+        "chart": {"type": "line", "data": [{"year": 2019, "Wakad": 6100}, {"year": 2020, "Wakad": 6400}]},
+        "table": [{"final location": "Wakad", "year": 2019}],
+    }
+
+    def _feed(self, text: str, size: int):
+        parser = AnswerStreamParser()
+        deltas = []
+        chart_at = None
+        for i in range(0, len(text), size):
+            deltas.append(parser.feed(text[i:i + size]))
+            if chart_at is None and parser.chart is not None:
+                chart_at = i + size
+        return parser, deltas, chart_at
+
+    def test_summary_deltas_rebuild_the_summary(self):
+        # ensure_ascii escapes the emoji as a surrogate pair that chunks split apart
+        text = json.dumps(self.ANSWER)
+        for size in (1, 2, 5, 16):
+            parser, deltas, _ = self._feed(text, size)
+            self.assertEqual("".join(deltas), self.ANSWER["summary"])
+            self.assertTrue(parser.summary_done)
+            self.assertNotIn("\\", "".join(deltas))
+
+    def test_chart_is_available_before_the_table(self):
+        text = json.dumps(self.ANSWER)
+        parser, _, chart_at = self._feed(text, 4)
+        self.assertEqual(parser.chart, self.ANSWER["chart"])
+        self.assertLess(chart_at, text.index('"table"') + 4)
+
+    def test_code_fence_and_missing_summary(self):
+        parser = AnswerStreamParser()
+        self.assertEqual(parser.feed('```json\n{"chart": {"type": "bar", "da'), "")
+        self.assertIsNone(parser.chart)
+        parser.feed('ta": []}, "table": []}\n```')
+        self.assertEqual(parser.chart, {"type": "bar", "data": []})
+        self.assertEqual(parser.summary, "")
+
+
+class SingleFlightTests(TestCase):
+
+    def _run_threads(self, count, target):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight(timeout=5)
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return "answer"
+        self._run_threads(5, lambda: results.append(flight.do("key", compute)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["answer"] * 5)
+        self.assertEqual(flight._calls, {})
+
+    def test_exceptions_are_shared(self):
+        flight = SingleFlight(timeout=5)
+        calls, errors = [], []
+
+        def fail():
+            calls.append(1)
+            time.sleep(0.1)
+            raise ValueError("upstream failed")
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except ValueError as e:
+                errors.append(str(e))
+        self._run_threads(4, call)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, ["upstream failed"] * 4)
+
+    def test_cancelled_leader_hands_over_to_a_follower(self):
+        flight = SingleFlight(timeout=5)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        async def scenario():
+            leader = asyncio.create_task(flight.do_async("key", compute))
+            await asyncio.sleep(0.01)
+            followers = [asyncio.create_task(flight.do_async("key", compute)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await asyncio.gather(*followers)
+
+        self.assertEqual(asyncio.run(scenario()), ["answer"] * 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(flight._calls, {})
+
+    def test_interrupted_sync_leader_hands_over(self):
+        flight = SingleFlight(timeout=5)
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def interrupted():
+            started.set()
+            release.wait()
+            raise KeyboardInterrupt
+
+        def leader():
+            try:
+                flight.do("key", interrupted)
+            except KeyboardInterrupt:
+                results.append("interrupted")
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait()
+        follower = threading.Thread(target=lambda: results.append(flight.do("key", lambda: "answer")))
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        thread.join()
+        follower.join()
+        self.assertEqual(sorted(results), ["answer", "interrupted"])
+
+    def test_follower_gives_up_after_timeout(self):
+        flight = SingleFlight(timeout=0.05)
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("key", lambda: time.sleep(0.3) or "slow")))
+        leader.start()
+        time.sleep(0.01)
+        results.append(flight.do("key", lambda: "own"))
+        leader.join()
+        self.assertEqual(results, ["own", "slow"])
+
+
+@override_settings(GENERATION_MAX_RETRIES=0)
+class DeadlineTests(TestCase):
+    """Generation runs inside the request's deadline and degrades instead of failing"""
+
+    def setUp(self):
+        self.rows = payload_rows(make_dataset(10))
+
+    def test_budget(self):
+        deadline = Deadline(10)
+        self.assertEqual(deadline.budget(cap=2), 2)
+        self.assertGreater(deadline.budget(), 9)
+        with self.assertRaises(DeadlineExceeded):
+            Deadline(0).budget()
+
+    def test_answer_within_deadline(self):
+        with fake_providers(llm_latency=0.01) as (_, model_class):
+            result = llama_answer("Show price trends for Wakad", self.rows, deadline=Deadline(5))
+        self.assertNotIn("degraded", result)
+        self.assertEqual(model_class.calls, 1)
+
+    def test_expired_deadline_skips_the_call(self):
+        with fake_providers() as (_, model_class):
+            result = llama_answer("Show price trends for Wakad", self.rows, deadline=Deadline(0))
+        self.assertTrue(result["degraded"])
+        self.assertTrue(result["summary"].startswith(DEGRADED_TIMEOUT_SUMMARY))
+        self.assertEqual(model_class.calls, 0)
+        self.assertEqual(result["table"], self.rows[:10])
+
+    @override_settings(GENERATION_HEDGING_ENABLED=False)
+    def test_slow_generation_degrades(self):
+        start = time.perf_counter()
+        with fake_providers(llm_latency=1.0):
+            result = llama_answer("Show price trends for Wakad", self.rows, deadline=Deadline(0.2))
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertTrue(result["degraded"])
+        self.assertTrue(result["summary"].startswith(DEGRADED_TIMEOUT_SUMMARY))
+        self.assertTrue(result["chart"]["data"])
+
+    def test_upstream_error_degrades(self):
+        with fake_providers() as (_, model_class), \
+                mock.patch.object(model_class, "generate_content", side_effect=RuntimeError("quota")):
+            result = llama_answer("Show price trends for Wakad", self.rows, deadline=Deadline(5))
+        self.assertTrue(result["degraded"])
+        self.assertTrue(result["summary"].startswith(DEGRADED_ERROR_SUMMARY))
+
+    def test_slow_stream_degrades(self):
+        with fake_providers(llm_per_token=0.05):
+            events = list(stream_answer("Show price trends for Wakad", self.rows, deadline=Deadline(0.3)))
+        names = [event for event, _ in events]
+        self.assertEqual(names[-2:], ["degraded", "done"])
+        self.assertTrue(events[-2][1]["summary"].startswith(DEGRADED_TIMEOUT_SUMMARY))
+        self.assertTrue(events[-1][1]["degraded"])
+
+    def read_events(self, response):
+        body = b"".join(response.streaming_content).decode()
+        return [block.split("\n")[0].removeprefix("event: ") for block in body.strip().split("\n\n")]
+
+    @override_settings(QUERY_DEADLINE=0.3, ANSWER_CACHE_ENABLED=False)
+    def test_stream_view_shares_the_deadline(self):
+        with benchmark_environment("local", llm_per_token=0.05):
+            ingest_new_version(make_dataset(50))
+            response = self.client.post("/api/query/stream", {"query": "Tell me about real estate in Pune"},
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+            events = self.read_events(response)
+        self.assertEqual(events[0], "rows")
+        self.assertEqual(events[-2:], ["degraded", "done"])
+
+    @override_settings(ANSWER_CACHE_ENABLED=False)
+    def test_stream_view_times_out_before_retrieval(self):
+        with benchmark_environment("local"):
+            ingest_new_version(make_dataset(50))
+            with mock.patch("ragapp.views.embed_query", side_effect=TimeoutError):
+                response = self.client.post("/api/query/stream", {"query": "Tell me about real estate in Pune"},
+                                            content_type="application/json")
+        self.assertEqual(response.status_code, 504)
+
+    @override_settings(ANSWER_CACHE_ENABLED=False, EMBEDDING_TIMEOUT=2)
+    def test_batch_embedding_timeout(self):
+        from .views import TIMEOUT_ERROR
+        with benchmark_environment("local"):
+            ingest_new_version(make_dataset(50))
+            with mock.patch("ragapp.views.embed_queries", side_effect=TimeoutError) as embed:
+                response = self.client.post("/api/query/batch", {"queries": [
+                    "Tell me about real estate in Pune", "Flat rates in Baner and Aundh",
+                ]}, content_type="application/json")
+        self.assertLessEqual(embed.call_args.kwargs["timeout"], 2)
+        results = response.json()["results"]
+        self.assertEqual([r["status"] for r in results], [504, 200])
+        self.assertEqual(results[0]["result"]["error"], TIMEOUT_ERROR)
+
+    @override_settings(ANSWER_CACHE_ENABLED=False, SEARCH_TIMEOUT=0.05)
+    def test_batch_search_timeout(self):
+        from . import llm
+        dense_search_batch = llm._dense_search_batch
+
+        def slow_search(*args, **kwargs):
+            time.sleep(0.3)
+            return dense_search_batch(*args, **kwargs)
+
+        with benchmark_environment("local"):
+            ingest_new_version(make_dataset(50))
+            with mock.patch.object(llm, "_dense_search_batch", slow_search):
+                response = self.client.post("/api/query/batch", {"queries": ["Tell me about real estate in Pune"]},
+                                            content_type="application/json")
+        self.assertEqual(response.json()["results"][0]["status"], 504)
+
+
+class AnalyticsRoutingTests(TestCase):
+    """Only named places, years or explicit chart intent go to exact analytics"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.df = make_dataset(200)
+        cls.vocabulary = _compile(build_vocabulary(cls.df))
+
+    def route(self, query):
+        with_vocabulary = analyze(query, self.df, self.vocabulary)
+        without = analyze(query, self.df)
+        self.assertEqual(with_vocabulary is None, without is None, query)
+        return with_vocabulary
+
+    def test_open_questions_go_to_the_llm(self):
+        for query in (
+            "Which area is best for families?",
+            "What is the average price?",
+            "Are flat rates high?",
+            "Tell me about total sales",
+            "How many flats sold?",
+            "Is Baner a good place to invest?",
+            "Tell me about Wakad",
+            "What is it like to live in Aundh in 2020?",
+        ):
+            self.assertIsNone(self.route(query), query)
+
+    def test_named_places_and_years_are_computed(self):
+        for query in ("Show price trends for Wakad", "Flat rates in Baner and Aundh", "Total sales in 2019"):
+            self.assertIsNotNone(self.route(query), query)
+
+    def test_explicit_chart_intent_is_computed(self):
+        self.assertEqual(self.route("Top 5 areas by flats sold")["chart"]["type"], "bar")
+        self.assertEqual(self.route("Show the trend of total sales")["chart"]["type"], "line")
+
+
+class AsyncQueryViewTests(TestCase):
+    """/api/query/async answers from the in-process Qdrant in the benchmark harness"""
+
+    @override_settings(ANSWER_CACHE_ENABLED=False)
+    def test_async_query(self):
+        with benchmark_environment(backend="qdrant") as (_, model_class):
+            ingest_new_version(make_dataset(100))
+            response = self.client.post(
+                "/api/query/async", {"query": "What is the property market like in Pune"},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(model_class.calls, 1)
+        self.assertTrue(response.json()["chart"]["data"])
+
+
+@override_settings(ANSWER_CACHE_ENABLED=False)
+class LatencyMetricsTests(TestCase):
+    """Stage timings reach the Server-Timing header and the /api/metrics histograms"""
+
+    def stages(self, response):
+        return [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+
+    def test_server_timing_header(self):
+        with benchmark_environment("local"):
+            ingest_new_version(make_dataset(30))
+            response = self.client.post("/api/query", {"query": "Tell me about real estate in Pune"},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        stages = self.stages(response)
+        for name in ("embed_query", "retrieve", "generate", "total"):
+            self.assertIn(name, stages)
+        self.assertEqual(stages[-1], "total")
+        self.assertEqual(self.stages(self.client.get("/api/health-check")), ["total"])
+
+    @override_settings(SERVER_TIMING_ENABLED=False)
+    def test_server_timing_can_be_disabled(self):
+        self.assertFalse(self.client.get("/api/health-check").has_header("Server-Timing"))
+
+    def test_metrics_endpoint(self):
+        from .metrics import server_timing, stage_milliseconds
+        self.assertEqual(server_timing([("embed", 0.01), ("search", 0.002), ("embed", 0.005)], 0.02),
+                         "embed;dur=15.0, search;dur=2.0, total;dur=20.0")
+        self.assertEqual(stage_milliseconds([("embed", 0.01), ("embed", 0.005)]), {"embed": 15.0})
+
+        self.client.get("/api/health-check")
+        body = self.client.get("/api/metrics").content.decode()
+        self.assertIn('rag_request_seconds_count{route="api/health-check"}', body)
+        self.assertIn('rag_cache_lookups_total{cache="answer",result="hit"}', body)
+
+
+class GeminiAsyncClientTests(TestCase):
+    """The per-loop Gemini client and its fallback to genai's default"""
+
+    def bind_twice(self):
+        from .async_clients import bind_gemini_async_client
+        models = [mock.Mock(_async_client=None), mock.Mock(_async_client=None)]
+
+        async def bind():
+            for model in models:
+                bind_gemini_async_client(model)
+        asyncio.run(bind())
+        return models
+
+    def test_one_client_per_loop(self):
+        from . import async_clients
+        manager = mock.Mock()
+        with mock.patch.object(async_clients.genai_client, "_client_manager", manager):
+            first, second = self.bind_twice()
+        manager.make_client.assert_called_once_with("generative_async")
+        self.assertIs(first._async_client, manager.make_client.return_value)
+        self.assertIs(second._async_client, first._async_client)
+
+    def test_falls_back_without_private_client_manager(self):
+        from . import async_clients
+        with mock.patch.object(async_clients.genai_client, "_client_manager", None):
+            first, second = self.bind_twice()
+        self.assertIsNone(first._async_client)
+        self.assertIsNone(second._async_client)
+
+
+@override_settings(ANSWER_CACHE_ENABLED=False)
+class BatchQueryTests(TestCase):
+    """/api/query/batch on both vector store backends"""
+
+    def post(self, queries):
+        return self.client.post("/api/query/batch", {"queries": queries}, content_type="application/json")
+
+    def test_analytics_only_batch(self):
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend=backend) as (embeddings, model_class):
+                ingest_new_version(make_dataset(100))
+                calls = embeddings.calls
+                response = self.post(["Show price trends for Wakad", "Top 5 areas by flats sold"])
+                self.assertEqual(response.status_code, 200, response.content)
+                self.assertEqual([r["status"] for r in response.json()["results"]], [200, 200])
+                self.assertEqual((embeddings.calls - calls, model_class.calls), (0, 0))
+
+    def test_mixed_batch_keeps_order_and_deduplicates(self):
+        queries = [
+            "What is the property market like in Pune",
+            "Show price trends for Wakad",
+            "what is the property market like in pune",
+            "Is Pimpri Chinchwad a good place for a first home",
+        ]
+        for backend in ("local", "qdrant"):
+            with self.subTest(backend=backend), benchmark_environment(backend=backend) as (embeddings, model_class):
+                ingest_new_version(make_dataset(100))
+                calls = embeddings.calls
+                response = self.post(queries)
+                self.assertEqual(response.status_code, 200, response.content)
+                results = response.json()["results"]
+                self.assertEqual([r["query"] for r in results], queries)
+                self.assertEqual([r["status"] for r in results], [200] * 4)
+                self.assertEqual(results[0]["result"], results[2]["result"])
+                self.assertEqual(embeddings.calls - calls, 1)
+                self.assertEqual(model_class.calls, 2)
+
+    def test_invalid_batches(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post(["ok", ""]).status_code, 400)
+        with override_settings(QUERY_BATCH_MAX_SIZE=2):
+            self.assertEqual(self.post(["a", "b", "c"]).status_code, 400)
+
+
+class IngestJobTests(TransactionTestCase):
+    """Background ingestion as seen through /api/ingest-status"""
+
+    def spool(self, df):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        df.to_csv(path, index=False)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        return path
+
+    def create_job(self, path):
+        from .models import IngestJob
+        return IngestJob.objects.create(file_name="data.csv", upload_path=path)
+
+    def status(self, job):
+        response = self.client.get(f"/api/ingest-status/{job.pk}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_job_lifecycle(self):
+        path = self.spool(make_dataset(60))
+        job = self.create_job(path)
+        self.assertEqual(self.status(job)["status"], "queued")
+        with benchmark_environment("local"):
+            run_job(job.pk, path)
+        body = self.status(job)
+        self.assertEqual(body["status"], "succeeded")
+        self.assertEqual(body["rows_processed"], 60)
+        self.assertEqual(body["result"]["version"], 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.client.get("/api/ingest-status/999999").status_code, 404)
+
+    @override_settings(INGEST_JOB_HEARTBEAT_SECONDS=0.02)
+    def test_heartbeat_during_long_phase(self):
+        from . import ingestion
+        from .models import IngestJob
+        path = self.spool(make_dataset(20))
+        job = self.create_job(path)
+        read_chunks = ingestion.read_chunks
+        seen = []
+
+        def slow_read(*args, **kwargs):
+            started = IngestJob.objects.get(pk=job.pk).heartbeat_at
+            time.sleep(0.2)
+            seen.append((started, IngestJob.objects.get(pk=job.pk).heartbeat_at))
+            return read_chunks(*args, **kwargs)
+
+        with benchmark_environment("local"), mock.patch.object(ingestion, "read_chunks", slow_read):
+            run_job(job.pk, path)
+        started, later = seen[0]
+        self.assertGreater(later, started)
+        self.assertEqual(self.status(job)["status"], "succeeded")
+
+    def test_failed_job_is_not_overwritten(self):
+        from . import ingestion
+        from .models import IngestJob
+        path = self.spool(make_dataset(20))
+        job = self.create_job(path)
+        read_chunks = ingestion.read_chunks
+
+        def recovered_meanwhile(*args, **kwargs):
+            # Another process decided this worker was dead
+            IngestJob.objects.filter(pk=job.pk).update(status="failed", error="Interrupted")
+            return read_chunks(*args, **kwargs)
+
+        with benchmark_environment("local"), mock.patch.object(ingestion, "read_chunks", recovered_meanwhile):
+            run_job(job.pk, path)
+        body = self.status(job)
+        self.assertEqual(body["status"], "failed")
+        self.assertEqual(body["error"], "Interrupted")
@@ -1,9 +1,14 @@
 from django.urls import path
-from .views import upload_csv, query_view, check_data,health_check
+from .views import upload_csv, query_view, query_stream, query_async_view, query_batch_view, check_data, health_check, ingest_status, metrics
 
 urlpatterns = [
     path("upload-csv", upload_csv),
+    path("ingest-status/<int:job_id>", ingest_status),
     path("query", query_view),
+    path("query/stream", query_stream),
+    path("query/async", query_async_view),
+    path("query/batch", query_batch_view),
     path("check-data", check_data),
     path("health-check", health_check),
+    path("metrics", metrics),
 ]
\ No newline at end of file
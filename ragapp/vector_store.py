@@ -0,0 +1,207 @@
+import re
+import time
+import logging
+import threading
+from collections import namedtuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Readers always go through this name; it points at the newest complete
+# realestate_v{n} collection
+COLLECTION_NAME = "realestate"
+EMBEDDING_DIM = settings.EMBEDDING_DIM  # text-embedding-004 output size
+
+VERSION_PATTERN = re.compile(rf"^{COLLECTION_NAME}_v(\d+)$")
+
+# Bookkeeping fields stored alongside each row but never shown to users
+INTERNAL_PAYLOAD_KEYS = ("_content_hash",)
+
+SearchHit = namedtuple("SearchHit", ["id", "score", "payload"])
+
+def version_of(collection_name: str):
+    """Return n for a realestate_v{n} collection name, else None"""
+    match = VERSION_PATTERN.match(collection_name or "")
+    return int(match.group(1)) if match else None
+
+def clean_payload(payload: dict):
+    """Strip internal bookkeeping fields from a stored payload"""
+    return {k: v for k, v in payload.items() if k not in INTERNAL_PAYLOAD_KEYS}
+
+class VectorStore:
+    """Interface between the RAG pipeline and a vector index backend
+
+    Datasets live in versioned realestate_v{n} collections. Searches always
+    go to the active one, and activate_collection switches to a new
+    version atomically. Filters are the {field: values} specs produced by
+    filters.extract_filter.
+    """
+
+    def list_collections(self):
+        raise NotImplementedError
+
+    def get_active_collection(self):
+        """Return the physical collection readers are using, or None"""
+        raise NotImplementedError
+
+    def create_collection(self, collection_name: str):
+        raise NotImplementedError
+
+    def drop_collection(self, collection_name: str):
+        raise NotImplementedError
+
+    def point_alias(self, collection_name: str):
+        """Atomically make collection_name the active collection"""
+        raise NotImplementedError
+
+    def count(self, collection_name: str):
+        raise NotImplementedError
+
+    def copy_points(self, source: str, target: str):
+        """Copy every point (vector and payload) from one collection to another"""
+        raise NotImplementedError
+
+    def add_vectors(self, ids: list, vectors: list, payloads: list, collection_name: str):
+        raise NotImplementedError
+
+    def delete_vectors(self, ids: list, collection_name: str):
+        raise NotImplementedError
+
+    def fetch_content_hashes(self, collection_name: str):
+        """Return {point_id: content_hash} for every point in the collection"""
+        raise NotImplementedError
+
+    def search(self, query_vector: list, top_k: int = 5, query_filter: dict = None):
+        """Return the top_k SearchHits of the active collection"""
+        raise NotImplementedError
+
+    def search_batch(self, query_vectors: list, top_k: int = 5, query_filters: list = None):
+        """Return one list of top_k SearchHits per query vector
+
+        query_filters holds one filter spec (or None) per vector. Backends
+        that can answer several searches in one call override this.
+        """
+        query_filters = query_filters or [None] * len(query_vectors)
+        return [
+            self.search(query_vector, top_k=top_k, query_filter=query_filter)
+            for query_vector, query_filter in zip(query_vectors, query_filters)
+        ]
+
+    def retrieve_payloads(self, ids: list):
+        """Return {point_id: payload} for the given IDs in the active collection"""
+        raise NotImplementedError
+
+    async def search_async(self, query_vector: list, top_k: int = 5, query_filter: dict = None):
+        """Async search; backends without an async client run search() in a worker thread"""
+        return await sync_to_async(self.search, thread_sensitive=False)(query_vector, top_k=top_k, query_filter=query_filter)
+
+    async def retrieve_payloads_async(self, ids: list):
+        return await sync_to_async(self.retrieve_payloads, thread_sensitive=False)(ids)
+
+    def list_versions(self):
+        """Return the version numbers of all realestate_v{n} collections"""
+        return sorted(v for v in map(version_of, self.list_collections()) if v is not None)
+
+    def create_next_version(self):
+        """Create an empty realestate_v{n+1} collection and return its name"""
+        versions = self.list_versions()
+        collection_name = f"{COLLECTION_NAME}_v{(versions[-1] if versions else 0) + 1}"
+        self.create_collection(collection_name)
+        return collection_name
+
+    def activate_collection(self, collection_name: str):
+        """Switch readers to collection_name and delete old versions
+
+        Versions beyond COLLECTION_VERSIONS_TO_KEEP are garbage-collected.
+        """
+        self.point_alias(collection_name)
+        self.garbage_collect_versions(keep=settings.COLLECTION_VERSIONS_TO_KEEP, active=collection_name)
+
+    def garbage_collect_versions(self, keep: int, active: str):
+        """Delete all but the newest `keep` inactive versions"""
+        active_version = version_of(active)
+        inactive = [v for v in self.list_versions() if v != active_version]
+        stale = inactive[:-keep] if keep > 0 else inactive
+        for version in stale:
+            self.drop_collection(f"{COLLECTION_NAME}_v{version}")
+        return stale
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide vector store selected by VECTOR_STORE_BACKEND"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.VECTOR_STORE_BACKEND == "local":
+                    from .local_store import LocalStore
+                    _store = LocalStore(settings.LOCAL_VECTOR_STORE_DIR)
+                elif settings.VECTOR_STORE_BACKEND == "qdrant":
+                    from .qdrant_client import QdrantStore
+                    _store = QdrantStore()
+                else:
+                    raise ValueError(f"Unknown VECTOR_STORE_BACKEND '{settings.VECTOR_STORE_BACKEND}'")
+    return _store
+
+class CollectionState:
+    """Cached existence, point count and version of the active collection
+
+    Readers get the last known state without a round-trip to the vector
+    store. Once the state is older than `ttl` a single background thread
+    refreshes it while callers keep getting the previous snapshot. Only the
+    very first read in a process blocks.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._state = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        state = self._state
+        if state is None:
+            return self.refresh()
+        if time.monotonic() - state["refreshed_at"] > self.ttl:
+            self._refresh_in_background()
+        return state
+
+    async def aget(self):
+        """get() for async callers; the first read runs in a worker thread"""
+        if self._state is None:
+            return await sync_to_async(self.refresh, thread_sensitive=False)()
+        return self.get()
+
+    def refresh(self):
+        """Read the active collection from the store and remember the result"""
+        store = get_store()
+        active = store.get_active_collection()
+        self._state = {
+            "exists": active is not None,
+            "collection": active,
+            "version": version_of(active) if active is not None else None,
+            "points_count": store.count(active) if active is not None else 0,
+            "refreshed_at": time.monotonic(),
+        }
+        return self._state
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Collection state refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="collection-state-refresh", daemon=True).start()
+
+collection_state = CollectionState(ttl=settings.COLLECTION_STATE_TTL)
@@ -1,26 +1,44 @@
-import pandas as pd
-from django.http import JsonResponse
+import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view
-from .embeddings import generate_embedding, create_chunk
-from .qdrant_client import client as qdrant
-import io
-
-# For storing the CSV in memory
-DATAFRAME = None
+from django.conf import settings
+from .vector_store import collection_state
+from .embeddings import embed_query, embed_query_async, embed_queries, normalize_query, query_cache, get_embedding_cache
+from .answer_cache import answer_cache
+from .analytics import analyze
+from .snapshots import active_snapshot
+from .filters import get_vocabulary
+from .ingestion import SUPPORTED_EXTENSIONS
+from .jobs import enqueue_upload
+from .models import IngestJob
+from .metrics import (
+    stage, registry, render_cache_stats, start_timings, stop_timings, current_timings, stage_milliseconds,
+)
+from .coalescing import coalesce, coalesce_async
+from .deadlines import Deadline, TIMEOUT_ERRORS
 
 @api_view(["GET"])
 def check_data(request):
     """Check if data exists in Qdrant"""
     try:
-        collections = qdrant.get_collections().collections
-        collection_exists = any(c.name == "realestate" for c in collections)
+        # Served from the collection state registry, no Qdrant round-trip
+        state = collection_state.get()
         
-        if collection_exists:
-            # Get collection info
-            collection_info = qdrant.get_collection("realestate")
+        if state["exists"]:
+            snapshot = active_snapshot()
             return JsonResponse({
                 "exists": True,
-                "points_count": collection_info.points_count,
+                "points_count": state["points_count"],
+                "collection": state["collection"],
+                "version": state["version"],
+                "snapshot": snapshot.info() if snapshot is not None else None,
                 "message": "Data already loaded in Qdrant"
             })
         else:
@@ -34,90 +52,27 @@ def check_data(request):
 
 @api_view(["POST"])
 def upload_csv(request):
-    global DATAFRAME
-
     try:
         file = request.FILES["file"]
-        file_content_bytes = file.read()
-        
-        # Check file type and read accordingly
-        if file.name.endswith('.xlsx') or file.name.endswith('.xls'):
-            # Excel file
-            DATAFRAME = pd.read_excel(io.BytesIO(file_content_bytes))
-        elif file.name.endswith('.csv'):
-            # CSV file
-            try:
-                DATAFRAME = pd.read_csv(io.BytesIO(file_content_bytes), encoding='utf-8', on_bad_lines='skip')
-            except:
-                DATAFRAME = pd.read_csv(io.BytesIO(file_content_bytes), encoding='latin-1', on_bad_lines='skip')
-        else:
+
+        # Check file type before queueing; parsing happens in the job
+        if not file.name.endswith(SUPPORTED_EXTENSIONS):
             return JsonResponse({"error": "Please upload a CSV or Excel file (.csv, .xlsx, .xls)"}, status=400)
-        
-        # Check if dataframe is empty
-        if DATAFRAME.empty:
-            return JsonResponse({"error": "File is empty"}, status=400)
-        
-        # Clean column names (remove leading/trailing spaces)
-        DATAFRAME.columns = DATAFRAME.columns.str.strip()
-        
-        # Verify at least some expected columns exist
-        required_columns = ['final location', 'year']
-        missing_cols = [col for col in required_columns if col not in DATAFRAME.columns]
-        
-        if missing_cols:
-            return JsonResponse({
-                "error": f"Missing required columns: {missing_cols}",
-                "found_columns": list(DATAFRAME.columns[:10]),  # Show first 10 columns
-                "total_columns": len(DATAFRAME.columns)
-            }, status=400)
 
-        # Drop old collection
-        try:
-            qdrant.delete_collection("realestate")
-        except:
-            pass
-
-        # Recreate
-        from qdrant_client.models import VectorParams, Distance
-        qdrant.create_collection(
-            collection_name="realestate",
-            vectors_config=VectorParams(size=768, distance=Distance.COSINE)
-        )
+        # "incremental" only re-embeds new/changed rows and deletes missing ones
+        mode = request.data.get("mode", "full")
+        if mode not in ("full", "incremental"):
+            return JsonResponse({"error": "mode must be 'full' or 'incremental'"}, status=400)
 
-        # Embed each row with all columns
-        payloads = []
-        vectors = []
-        for i, row in DATAFRAME.iterrows():
-            # Create text chunk with all data
-            text = create_chunk(row)
-            emb = generate_embedding(text)
-            
-            # Store full row as payload
-            payload = row.to_dict()
-            # Convert any NaN to None for JSON serialization
-            payload = {k: (None if pd.isna(v) else v) for k, v in payload.items()}
-            
-            payloads.append(payload)
-            vectors.append(emb)
-
-        # Batch upsert
-        qdrant.upsert(
-            collection_name="realestate",
-            points=[
-                {
-                    "id": idx,
-                    "vector": vectors[idx],
-                    "payload": payloads[idx]
-                }
-                for idx in range(len(vectors))
-            ],
-        )
+        with stage("upload_spool"):
+            job = enqueue_upload(file, mode=mode)
 
         return JsonResponse({
-            "message": "File uploaded and embedded!",
-            "rows_processed": len(DATAFRAME),
-            "columns": list(DATAFRAME.columns)
-        })
+            "message": "File queued for embedding",
+            "job_id": job.pk,
+            "status": job.status,
+            "status_url": f"/api/ingest-status/{job.pk}"
+        }, status=202)
     
     except KeyError as e:
         return JsonResponse({"error": f"No file uploaded: {str(e)}"}, status=400)
@@ -125,6 +80,93 @@ def upload_csv(request):
         return JsonResponse({"error": str(e), "type": str(type(e).__name__)}, status=500)
 
 
+@api_view(["GET"])
+def ingest_status(request, job_id):
+    """Report progress of a background upload"""
+    try:
+        job = IngestJob.objects.get(pk=job_id)
+    except IngestJob.DoesNotExist:
+        return JsonResponse({"error": f"Unknown job {job_id}"}, status=404)
+    return JsonResponse(job.progress())
+
+
+def _analytics_answer(query: str):
+    """Exact answer from the active snapshot for chart queries, or None"""
+    with stage("analytics"):
+        snapshot = active_snapshot() if settings.ANALYTICS_ENABLED else None
+        if snapshot is None:
+            return None
+        return analyze(query, snapshot.dataframe(), get_vocabulary(snapshot.collection))
+
+
+NO_CONTEXT_ERROR = "No relevant data found for your query. Try different keywords."
+TIMEOUT_ERROR = "The query timed out before any data was retrieved. Please try again."
+
+def _cacheable(result: dict):
+    # Failed generations come back without chart data and degraded answers are
+    # only a stopgap; don't cache either
+    return settings.ANSWER_CACHE_ENABLED and result.get("chart", {}).get("data") and not result.get("degraded")
+
+def _rag_answer(query: str, version):
+    """Embed, check the answer cache, retrieve and generate; returns (result, status)
+
+    All stages share one QUERY_DEADLINE budget. Once rows are retrieved a
+    late answer degrades to a computed one (see llama_answer); before that
+    the query fails with 504.
+    """
+    from .llm import llama_answer, retrieve_context
+    
+    deadline = Deadline(settings.QUERY_DEADLINE)
+    try:
+        # Serve repeated and near-duplicate questions for this dataset version
+        query_vector = embed_query(query, timeout=deadline.budget(settings.EMBEDDING_TIMEOUT))
+        if settings.ANSWER_CACHE_ENABLED:
+            cached = answer_cache.lookup(query, query_vector, version)
+            if cached is not None:
+                return cached, 200
+        
+        # Retrieve context from Qdrant
+        context_rows = retrieve_context(query, top_k=10, query_vector=query_vector, deadline=deadline)
+    except TIMEOUT_ERRORS:
+        return {"error": TIMEOUT_ERROR}, 504
+    
+    if not context_rows:
+        return {"error": NO_CONTEXT_ERROR}, 404
+    
+    # Get structured JSON response from LLM
+    result = llama_answer(query, context_rows, deadline=deadline)
+    
+    if _cacheable(result):
+        answer_cache.store(query, query_vector, result, version)
+    
+    return result, 200
+
+async def _rag_answer_async(query: str, version):
+    """_rag_answer for the async request path"""
+    from .llm import llama_answer_async, retrieve_context_async
+    
+    deadline = Deadline(settings.QUERY_DEADLINE)
+    try:
+        query_vector = await embed_query_async(query, timeout=deadline.budget(settings.EMBEDDING_TIMEOUT))
+        if settings.ANSWER_CACHE_ENABLED:
+            cached = answer_cache.lookup(query, query_vector, version)
+            if cached is not None:
+                return cached, 200
+        
+        context_rows = await retrieve_context_async(query, top_k=10, query_vector=query_vector, deadline=deadline)
+    except TIMEOUT_ERRORS:
+        return {"error": TIMEOUT_ERROR}, 504
+    
+    if not context_rows:
+        return {"error": NO_CONTEXT_ERROR}, 404
+    
+    result = await llama_answer_async(query, context_rows, deadline=deadline)
+    
+    if _cacheable(result):
+        answer_cache.store(query, query_vector, result, version)
+    
+    return result, 200
+
 @api_view(["POST"])
 def query_view(request):
     query = request.data.get("query", "")
@@ -133,30 +175,296 @@ def query_view(request):
         return JsonResponse({"error": "Query parameter is required"}, status=400)
     
     try:
-        from .llm import llama_answer, retrieve_context
+        # Check if collection exists (cached, refreshed in the background)
+        state = collection_state.get()
+        if not state["exists"]:
+            return JsonResponse({
+                "error": "No data found in Qdrant. Please upload a file first."
+            }, status=400)
         
-        # Check if collection exists
-        collections = qdrant.get_collections().collections
-        if not any(c.name == "realestate" for c in collections):
+        # Chart queries over known locations/metrics are computed exactly from the table
+        result = _analytics_answer(query)
+        if result is not None:
+            return JsonResponse(result)
+        
+        # Identical queries already being answered wait for that answer
+        version = state["version"]
+        result, status = coalesce((version, normalize_query(query)), lambda: _rag_answer(query, version))
+        return JsonResponse(result, status=status)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    
+@csrf_exempt
+@require_POST
+async def query_async_view(request):
+    """query_view as a native async view for ASGI servers
+
+    Gemini and Qdrant are called through their async clients, so a worker
+    waits on many queries at once instead of one per thread. DRF views are
+    sync-only, so the body is parsed here (JSON or form-encoded).
+    """
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    else:
+        data = request.POST
+    query = data.get("query", "")
+    
+    if not query:
+        return JsonResponse({"error": "Query parameter is required"}, status=400)
+    
+    try:
+        state = await collection_state.aget()
+        if not state["exists"]:
             return JsonResponse({
                 "error": "No data found in Qdrant. Please upload a file first."
             }, status=400)
         
-        # Retrieve context from Qdrant
-        context_rows = retrieve_context(query, top_k=10)
+        # pandas group-bys are CPU work; keep them off the event loop
+        result = await sync_to_async(_analytics_answer, thread_sensitive=False)(query)
+        if result is not None:
+            return JsonResponse(result)
         
-        if not context_rows:
+        version = state["version"]
+        result, status = await coalesce_async(
+            (version, normalize_query(query)), lambda: _rag_answer_async(query, version),
+        )
+        return JsonResponse(result, status=status)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def _run_timed(timings: dict, func, *args):
+    """Call func, adding the stages it times to timings ({stage: ms})"""
+    collected, token = start_timings()
+    try:
+        return func(*args)
+    finally:
+        stop_timings(token)
+        for name, ms in stage_milliseconds(collected).items():
+            timings[name] = round(timings.get(name, 0.0) + ms, 1)
+
+def _generate_answer(query: str, query_vector: list, context_rows: list, version):
+    """Generate under a QUERY_DEADLINE that starts when the query leaves the queue"""
+    from .llm import llama_answer
+    result = llama_answer(query, context_rows)
+    if _cacheable(result):
+        answer_cache.store(query, query_vector, result, version)
+    return result
+
+def _timed_out(answers: dict, pending: list):
+    for key in pending:
+        answers[key] = ({"error": TIMEOUT_ERROR}, 504)
+    return answers
+
+def _answer_batch(queries: list, version):
+    """Return {normalized query: (result, status)} and per-query stage timings
+
+    Identical queries are answered once. Embedding and retrieval run
+    batched for all queries that analytics and the answer cache could not
+    answer, within one QUERY_DEADLINE; queries still waiting on them when
+    it passes get 504. Generations then run QUERY_BATCH_CONCURRENCY at a
+    time, each with its own deadline.
+    """
+    from .llm import retrieve_contexts
+    
+    deadline = Deadline(settings.QUERY_DEADLINE)
+    unique = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query), query)
+    answers = {}
+    timings = {key: {} for key in unique}
+    
+    for key, query in unique.items():
+        result = _run_timed(timings[key], _analytics_answer, query)
+        if result is not None:
+            answers[key] = (result, 200)
+    
+    pending = [key for key in unique if key not in answers]
+    if not pending:
+        return answers, timings
+    try:
+        query_vectors = embed_queries(
+            [unique[key] for key in pending], timeout=deadline.budget(settings.EMBEDDING_TIMEOUT),
+        )
+    except TIMEOUT_ERRORS:
+        return _timed_out(answers, pending), timings
+    vectors = dict(zip(pending, query_vectors))
+    if settings.ANSWER_CACHE_ENABLED:
+        for key in pending:
+            cached = answer_cache.lookup(unique[key], vectors[key], version)
+            if cached is not None:
+                answers[key] = (cached, 200)
+    
+    pending = [key for key in pending if key not in answers]
+    if not pending:
+        return answers, timings
+    try:
+        context_rows = retrieve_contexts(
+            [unique[key] for key in pending], [vectors[key] for key in pending], deadline=deadline,
+        )
+    except TIMEOUT_ERRORS:
+        return _timed_out(answers, pending), timings
+    contexts = dict(zip(pending, context_rows))
+    for key in pending:
+        if not contexts[key]:
+            answers[key] = ({"error": NO_CONTEXT_ERROR}, 404)
+    
+    pending = [key for key in pending if key not in answers]
+    with ThreadPoolExecutor(max_workers=settings.QUERY_BATCH_CONCURRENCY, thread_name_prefix="batch") as pool:
+        generations = {
+            key: pool.submit(
+                contextvars.copy_context().run, _run_timed, timings[key],
+                _generate_answer, unique[key], vectors[key], contexts[key], version,
+            )
+            for key in pending
+        }
+        for key, generation in generations.items():
+            try:
+                answers[key] = (generation.result(), 200)
+            except Exception as e:
+                answers[key] = ({"error": str(e)}, 500)
+    return answers, timings
+
+@api_view(["POST"])
+def query_batch_view(request):
+    """Answer a list of queries in one request
+
+    Takes {"queries": [...]} and returns one entry per query, in order,
+    holding the status and body /api/query would have returned plus the
+    query's own stage timings (ms). Batch-wide stages (embedding,
+    retrieval) are reported once under "timings".
+    """
+    queries = request.data.get("queries")
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return JsonResponse({"error": "queries must be a non-empty list of query strings"}, status=400)
+    if len(queries) > settings.QUERY_BATCH_MAX_SIZE:
+        return JsonResponse({"error": f"At most {settings.QUERY_BATCH_MAX_SIZE} queries per batch"}, status=400)
+    
+    try:
+        state = collection_state.get()
+        if not state["exists"]:
             return JsonResponse({
-                "error": "No relevant data found for your query. Try different keywords."
-            }, status=404)
+                "error": "No data found in Qdrant. Please upload a file first."
+            }, status=400)
         
-        # Get structured JSON response from LLM
-        result = llama_answer(query, context_rows)
+        start = time.perf_counter()
+        answers, timings = _answer_batch(queries, state["version"])
+        results = []
+        for query in queries:
+            key = normalize_query(query)
+            result, status = answers[key]
+            results.append({"query": query, "status": status, "result": result, "timings": timings[key]})
         
-        return JsonResponse(result)
+        batch_timings = stage_milliseconds(current_timings() or [])
+        batch_timings["total"] = round((time.perf_counter() - start) * 1000, 1)
+        return JsonResponse({"results": results, "timings": batch_timings})
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+def _sse(event: str, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _event_stream(events):
+    response = StreamingHttpResponse((_sse(event, data) for event, data in events), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _answer_events(result: dict):
+    """Events for an answer that is already complete (analytics or cache)"""
+    yield "rows", {"rows": result.get("table", [])}
+    yield "summary", {"text": result.get("summary", "")}
+    yield "chart", result.get("chart", {})
+    yield "done", result
+
+
+def _generation_events(query: str, query_vector: list, context_rows: list, version, deadline: Deadline):
+    from .llm import stream_answer
+    yield "rows", {"rows": context_rows}
+    try:
+        for event, data in stream_answer(query, context_rows, deadline=deadline):
+            if event == "summary":
+                data = {"text": data}
+            elif event == "done" and _cacheable(data):
+                answer_cache.store(query, query_vector, data, version)
+            yield event, data
+    except Exception as e:
+        yield "error", {"error": str(e)}
+
+
+@api_view(["POST"])
+def query_stream(request):
+    """Answer a query as Server-Sent Events
+
+    Emits the retrieved rows first, then "summary" text deltas while Gemini
+    generates, the validated "chart", and "done" with the full answer in the
+    same shape /api/query returns. The query shares one QUERY_DEADLINE with
+    its generation; a "degraded" event replaces the streamed summary and
+    chart when it passes. Failures before streaming starts get the same JSON
+    errors as /api/query.
+    """
+    query = request.data.get("query", "")
     
+    if not query:
+        return JsonResponse({"error": "Query parameter is required"}, status=400)
+    
+    try:
+        from .llm import retrieve_context
+        
+        state = collection_state.get()
+        if not state["exists"]:
+            return JsonResponse({
+                "error": "No data found in Qdrant. Please upload a file first."
+            }, status=400)
+        
+        result = _analytics_answer(query)
+        if result is not None:
+            return _event_stream(_answer_events(result))
+        
+        deadline = Deadline(settings.QUERY_DEADLINE)
+        version = state["version"]
+        try:
+            query_vector = embed_query(query, timeout=deadline.budget(settings.EMBEDDING_TIMEOUT))
+            if settings.ANSWER_CACHE_ENABLED:
+                cached = answer_cache.lookup(query, query_vector, version)
+                if cached is not None:
+                    return _event_stream(_answer_events(cached))
+            
+            context_rows = retrieve_context(query, top_k=10, query_vector=query_vector, deadline=deadline)
+        except TIMEOUT_ERRORS:
+            return JsonResponse({"error": TIMEOUT_ERROR}, status=504)
+        
+        if not context_rows:
+            return JsonResponse({"error": NO_CONTEXT_ERROR}, status=404)
+        
+        return _event_stream(_generation_events(query, query_vector, context_rows, version, deadline))
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@api_view(["GET"])
+def metrics(request):
+    """Stage latencies, token counts and cache hit rates in Prometheus text format
+
+    Counters are per process; scrape every worker (or run a single one).
+    """
+    caches = {"answer": answer_cache.stats(), "query_embedding": query_cache.stats()}
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        caches["embedding"] = embedding_cache.stats()
+    return HttpResponse(registry.render() + render_cache_stats(caches),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @api_view(["GET"])
 def health_check(request):
     return JsonResponse({"status": "ok"})
\ No newline at end of file